@@ -0,0 +1,77 @@
+"""
+Alembic迁移环境
+连接串取自应用配置; 由应用启动时调用(upgrade_database)时复用传入的连接
+"""
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import engine_from_config, pool
+
+from app.config import settings
+from app.database import Base
+from app import models  # noqa: F401 - 注册所有模型到Base.metadata
+
+config = context.config
+external_connection = config.attributes.get("connection")
+
+# 命令行执行时按alembic.ini配置日志, 应用内调用时不覆盖应用的日志配置
+if config.config_file_name is not None and external_connection is None:
+    fileConfig(config.config_file_name)
+
+if not config.get_main_option("sqlalchemy.url"):
+    config.set_main_option("sqlalchemy.url", settings.DATABASE_URL.replace("%", "%%"))
+
+target_metadata = Base.metadata
+
+
+def include_name(name, type_, parent_names) -> bool:
+    """SQLite全文检索的FTS5虚拟表及其影子表只由迁移管理, 不参与自动生成比较"""
+    if type_ == "table":
+        return not (name or "").startswith("messages_fts")
+    return True
+
+
+def run_migrations_offline() -> None:
+    """生成SQL脚本而不连接数据库(alembic upgrade head --sql)"""
+    context.configure(
+        url=config.get_main_option("sqlalchemy.url"),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    """连接数据库执行迁移"""
+    if external_connection is not None:
+        _run(external_connection)
+        return
+
+    connectable = engine_from_config(
+        config.get_section(config.config_ini_section, {}),
+        prefix="sqlalchemy.",
+        poolclass=pool.NullPool,
+    )
+    with connectable.connect() as connection:
+        _run(connection)
+
+
+def _run(connection) -> None:
+    # SQLite不支持大部分ALTER TABLE, 使用batch模式重建表
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        render_as_batch=True,
+        include_name=include_name,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
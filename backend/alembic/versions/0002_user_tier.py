@@ -0,0 +1,38 @@
+"""user tier column
+
+users上的调度等级列(加权公平调度); create_all不会给已有的表加列,
+按已有列跳过, 兼容在模型加列之后用create_all新建的数据库
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _columns(table: str) -> set:
+    return {column["name"] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade() -> None:
+    if "tier" not in _columns("users"):
+        with op.batch_alter_table("users") as batch_op:
+            batch_op.add_column(
+                sa.Column("tier", sa.String(length=20), nullable=False, server_default="standard")
+            )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("tier")
@@ -0,0 +1,38 @@
+"""prompt cache usage columns
+
+api_usages上记录提供商报告的提示词Token和缓存读写Token(提示词缓存);
+create_all不会给已有的表加列, 按已有列跳过, 兼容在模型加列之后用create_all新建的数据库
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:02
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+USAGE_COLUMNS = ("prompt_tokens", "cache_read_tokens", "cache_write_tokens")
+
+
+def upgrade() -> None:
+    existing = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("api_usages")}
+    missing = [name for name in USAGE_COLUMNS if name not in existing]
+    if missing:
+        with op.batch_alter_table("api_usages") as batch_op:
+            for name in missing:
+                batch_op.add_column(sa.Column(name, sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("api_usages") as batch_op:
+        for name in reversed(USAGE_COLUMNS):
+            batch_op.drop_column(name)
@@ -0,0 +1,47 @@
+"""composite indexes for hot queries
+
+- messages(conversation_id, created_at, id): 组装上下文和消息列表, 按会话过滤并按时间排序
+- conversations(user_id, updated_at): 会话列表, 按用户过滤并按更新时间倒序
+- api_usages(created_at, model): 管理后台用量统计, 按时间范围过滤后按模型/日期分组
+
+用 benchmarks/explain.py 检查这些查询的执行计划是否使用了对应索引
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:03
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_messages_conversation_id_created_at",
+        "messages",
+        ["conversation_id", "created_at", "id"]
+    )
+    op.create_index(
+        "ix_conversations_user_id_updated_at",
+        "conversations",
+        ["user_id", "updated_at"]
+    )
+    op.create_index(
+        "ix_api_usages_created_at_model",
+        "api_usages",
+        ["created_at", "model"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_api_usages_created_at_model", table_name="api_usages")
+    op.drop_index("ix_conversations_user_id_updated_at", table_name="conversations")
+    op.drop_index("ix_messages_conversation_id_created_at", table_name="messages")
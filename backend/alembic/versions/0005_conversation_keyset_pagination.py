@@ -0,0 +1,52 @@
+"""conversation keyset pagination
+
+会话列表按(updated_at, id)游标分页, updated_at不能为空:
+已有会话用created_at回填, 新会话建表时即写入; 复合索引加上id, 同一时间内的排序也由索引提供
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 00:00:04
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("UPDATE conversations SET updated_at = created_at WHERE updated_at IS NULL")
+    with op.batch_alter_table("conversations") as batch_op:
+        batch_op.alter_column(
+            "updated_at",
+            existing_type=sa.DateTime(timezone=True),
+            server_default=sa.func.now()
+        )
+    op.drop_index("ix_conversations_user_id_updated_at", table_name="conversations")
+    op.create_index(
+        "ix_conversations_user_id_updated_at_id",
+        "conversations",
+        ["user_id", "updated_at", "id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_conversations_user_id_updated_at_id", table_name="conversations")
+    op.create_index(
+        "ix_conversations_user_id_updated_at",
+        "conversations",
+        ["user_id", "updated_at"]
+    )
+    with op.batch_alter_table("conversations") as batch_op:
+        batch_op.alter_column(
+            "updated_at",
+            existing_type=sa.DateTime(timezone=True),
+            server_default=None
+        )
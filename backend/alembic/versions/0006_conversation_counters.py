@@ -0,0 +1,72 @@
+"""conversation counters
+
+会话上冗余消息数、Token总数和最后一条消息, 用户上冗余会话数;
+之后由写入路径在同一事务中维护, 这里按现有数据回填
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 00:00:05
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("conversations") as batch_op:
+        batch_op.add_column(sa.Column("message_count", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("total_tokens", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("last_message_at", sa.DateTime(timezone=True), nullable=True))
+        batch_op.add_column(sa.Column("last_message_preview", sa.String(length=200), nullable=True))
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(sa.Column("conversation_count", sa.Integer(), nullable=False, server_default="0"))
+
+    # 回填不经过ORM, updated_at保持不变
+    op.execute(
+        """
+        UPDATE conversations SET
+            message_count = (
+                SELECT COUNT(*) FROM messages WHERE messages.conversation_id = conversations.id
+            ),
+            total_tokens = (
+                SELECT COALESCE(SUM(messages.tokens), 0) FROM messages
+                WHERE messages.conversation_id = conversations.id
+            ),
+            last_message_at = (
+                SELECT MAX(messages.created_at) FROM messages
+                WHERE messages.conversation_id = conversations.id
+            ),
+            last_message_preview = (
+                SELECT SUBSTR(messages.content, 1, 100) FROM messages
+                WHERE messages.conversation_id = conversations.id
+                ORDER BY messages.created_at DESC, messages.id DESC
+                LIMIT 1
+            )
+        """
+    )
+    op.execute(
+        """
+        UPDATE users SET conversation_count = (
+            SELECT COUNT(*) FROM conversations WHERE conversations.user_id = users.id
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("conversation_count")
+    with op.batch_alter_table("conversations") as batch_op:
+        batch_op.drop_column("last_message_preview")
+        batch_op.drop_column("last_message_at")
+        batch_op.drop_column("total_tokens")
+        batch_op.drop_column("message_count")
@@ -0,0 +1,87 @@
+"""message full text search
+
+消息内容的全文索引(见app/services/search_service.py):
+- PostgreSQL: to_tsvector表达式上的GIN索引, 文本检索配置取SEARCH_PG_CONFIG
+- SQLite: FTS5外部内容表(trigram分词), 触发器随消息增删改同步, 建表后按现有消息重建
+- 其他数据库: 不建索引
+
+SQLite上以batch模式重建messages表会丢失触发器, 之后修改messages表的迁移需要重新创建
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 00:00:06
+
+"""
+import re
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SQLITE_UPGRADE = [
+    """
+    CREATE VIRTUAL TABLE messages_fts USING fts5(
+        content, content='messages', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS messages_fts_update",
+    "DROP TRIGGER IF EXISTS messages_fts_delete",
+    "DROP TRIGGER IF EXISTS messages_fts_insert",
+    "DROP TABLE IF EXISTS messages_fts",
+]
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        config = settings.SEARCH_PG_CONFIG
+        if not re.fullmatch(r"\w+", config):
+            raise ValueError(f"无效的文本检索配置: {config}")
+        op.create_index(
+            "ix_messages_content_fts",
+            "messages",
+            [sa.text(f"to_tsvector('{config}'::regconfig, content)")],
+            postgresql_using="gin"
+        )
+    elif dialect == "sqlite":
+        for statement in SQLITE_UPGRADE:
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        op.drop_index("ix_messages_content_fts", table_name="messages")
+    elif dialect == "sqlite":
+        for statement in SQLITE_DOWNGRADE:
+            op.execute(statement)
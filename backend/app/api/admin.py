@@ -1,48 +1,67 @@
 """
 管理后台相关API
 """
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from datetime import datetime, timedelta
-from ..database import get_db
+from ..database import get_async_db
 from ..schemas import UserResponse
 from ..models import User, Conversation, Message, ApiUsage
-from ..utils import get_current_admin_user
+from ..utils import get_current_admin_user, pool_monitor
+from ..utils.pagination import decode_cursor, encode_cursor
+from ..services.llm_service import llm_service
+from ..services.scheduler import scheduler
+from ..services.write_behind import write_behind
 
 router = APIRouter()
 
 
 @router.get("/users", response_model=List[UserResponse])
-def get_users(
+async def get_users(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=200),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_async_db),
     admin_user: User = Depends(get_current_admin_user)
 ):
     """
-    获取用户列表(管理员权限)
+    获取用户列表(管理员权限), 按注册先后倒序
+
+    有更多用户时在X-Next-Cursor响应头返回下一页游标
 
     Args:
-        skip: 跳过的记录数
+        response: 响应(写入分页游标响应头)
+        skip: 跳过的记录数(旧的偏移分页, 指定cursor时忽略)
         limit: 返回的记录数
+        cursor: 上一页返回的X-Next-Cursor
         db: 数据库会话
         admin_user: 管理员用户
 
     Returns:
         List[UserResponse]: 用户列表
     """
-    users = db.query(User).order_by(
-        User.created_at.desc()
-    ).offset(skip).limit(limit).all()
+    # 自增ID与注册时间同序, 直接按主键做键集分页
+    query = select(User).order_by(User.id.desc())
+    after_id = decode_cursor(cursor)
+    if after_id is not None:
+        query = query.where(User.id < after_id)
+    else:
+        query = query.offset(skip)
+
+    users = (await db.scalars(query.limit(limit + 1))).all()
+    if len(users) > limit:
+        users = users[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(users[-1].id)
 
     return [UserResponse.model_validate(user) for user in users]
 
 
 @router.get("/stats")
-def get_stats(
-    db: Session = Depends(get_db),
+async def get_stats(
+    db: AsyncSession = Depends(get_async_db),
     admin_user: User = Depends(get_current_admin_user)
 ):
     """
@@ -56,25 +75,25 @@ def get_stats(
         dict: 统计数据
     """
     # 用户统计
-    total_users = db.query(User).count()
-    active_users = db.query(User).filter(User.is_active == True).count()
+    total_users = await db.scalar(select(func.count()).select_from(User))
+    active_users = await db.scalar(select(func.count()).select_from(User).where(User.is_active == True))
 
     # 会话统计
-    total_conversations = db.query(Conversation).count()
-    total_messages = db.query(Message).count()
+    total_conversations = await db.scalar(select(func.count()).select_from(Conversation))
+    total_messages = await db.scalar(select(func.count()).select_from(Message))
 
     # 今日新增
     today = datetime.utcnow().date()
-    today_users = db.query(User).filter(
-        func.date(User.created_at) == today
-    ).count()
-    today_conversations = db.query(Conversation).filter(
-        func.date(Conversation.created_at) == today
-    ).count()
+    today_users = await db.scalar(
+        select(func.count()).select_from(User).where(func.date(User.created_at) == today)
+    )
+    today_conversations = await db.scalar(
+        select(func.count()).select_from(Conversation).where(func.date(Conversation.created_at) == today)
+    )
 
     # API使用统计
-    total_tokens = db.query(func.sum(ApiUsage.tokens)).scalar() or 0
-    total_cost = db.query(func.sum(ApiUsage.cost)).scalar() or 0
+    total_tokens = await db.scalar(select(func.sum(ApiUsage.tokens))) or 0
+    total_cost = await db.scalar(select(func.sum(ApiUsage.cost))) or 0
 
     return {
         "users": {
@@ -97,9 +116,9 @@ def get_stats(
 
 
 @router.get("/usage")
-def get_usage_stats(
+async def get_usage_stats(
     days: int = Query(7, ge=1, le=90),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     admin_user: User = Depends(get_current_admin_user)
 ):
     """
@@ -116,23 +135,27 @@ def get_usage_stats(
     start_date = datetime.utcnow() - timedelta(days=days)
 
     # 按模型统计
-    model_stats = db.query(
-        ApiUsage.model,
-        func.sum(ApiUsage.tokens).label("total_tokens"),
-        func.sum(ApiUsage.cost).label("total_cost"),
-        func.count(ApiUsage.id).label("request_count")
-    ).filter(
-        ApiUsage.created_at >= start_date
-    ).group_by(ApiUsage.model).all()
+    model_stats = (await db.execute(
+        select(
+            ApiUsage.model,
+            func.sum(ApiUsage.tokens).label("total_tokens"),
+            func.sum(ApiUsage.cost).label("total_cost"),
+            func.count(ApiUsage.id).label("request_count")
+        ).where(
+            ApiUsage.created_at >= start_date
+        ).group_by(ApiUsage.model)
+    )).all()
 
     # 按日期统计
-    daily_stats = db.query(
-        func.date(ApiUsage.created_at).label("date"),
-        func.sum(ApiUsage.tokens).label("tokens"),
-        func.sum(ApiUsage.cost).label("cost")
-    ).filter(
-        ApiUsage.created_at >= start_date
-    ).group_by(func.date(ApiUsage.created_at)).all()
+    daily_stats = (await db.execute(
+        select(
+            func.date(ApiUsage.created_at).label("date"),
+            func.sum(ApiUsage.tokens).label("tokens"),
+            func.sum(ApiUsage.cost).label("cost")
+        ).where(
+            ApiUsage.created_at >= start_date
+        ).group_by(func.date(ApiUsage.created_at))
+    )).all()
 
     return {
         "by_model": [
@@ -156,9 +179,9 @@ def get_usage_stats(
 
 
 @router.put("/users/{user_id}/toggle-active")
-def toggle_user_active(
+async def toggle_user_active(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     admin_user: User = Depends(get_current_admin_user)
 ):
     """
@@ -172,15 +195,141 @@ def toggle_user_active(
     Returns:
         dict: 操作结果
     """
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         return {"success": False, "message": "用户不存在"}
 
     user.is_active = not user.is_active
-    db.commit()
+    await db.commit()
 
     return {
         "success": True,
         "message": f"用户已{'激活' if user.is_active else '禁用'}",
         "is_active": user.is_active
     }
+
+
+@router.put("/users/{user_id}/tier")
+async def set_user_tier(
+    user_id: int,
+    tier: str = Query(..., min_length=1, max_length=20),
+    db: AsyncSession = Depends(get_async_db),
+    admin_user: User = Depends(get_current_admin_user)
+):
+    """
+    设置用户调度等级
+
+    Args:
+        user_id: 用户ID
+        tier: 等级名称, 需在SCHEDULER_TIER_WEIGHTS中配置
+        db: 数据库会话
+        admin_user: 管理员用户
+
+    Returns:
+        dict: 操作结果
+    """
+    if tier not in scheduler.tier_weights:
+        return {"success": False, "message": f"未配置的用户等级: {tier}"}
+
+    user = await db.scalar(select(User).where(User.id == user_id))
+    if not user:
+        return {"success": False, "message": "用户不存在"}
+
+    user.tier = tier
+    await db.commit()
+
+    return {
+        "success": True,
+        "message": f"用户等级已设置为{tier}",
+        "tier": user.tier
+    }
+
+
+@router.get("/cache/stats")
+async def get_cache_stats(
+    admin_user: User = Depends(get_current_admin_user)
+):
+    """
+    获取响应缓存和语义缓存统计
+
+    Args:
+        admin_user: 管理员用户
+
+    Returns:
+        dict: 命中/未命中/淘汰计数
+    """
+    return {
+        "response_cache": llm_service.cache.stats(),
+        "semantic_cache": llm_service.semantic_cache.stats(),
+        "single_flight": llm_service.single_flight.stats()
+    }
+
+
+@router.get("/providers/stats")
+async def get_provider_stats(
+    admin_user: User = Depends(get_current_admin_user)
+):
+    """
+    获取LLM提供商路由统计
+
+    Args:
+        admin_user: 管理员用户
+
+    Returns:
+        dict: 各提供商的首token延迟分位、熔断状态和对冲次数
+    """
+    return {
+        **llm_service.router.stats(),
+        "mock": llm_service.mock_provider.stats()
+    }
+
+
+@router.get("/rate-limits/stats")
+async def get_rate_limit_stats(
+    admin_user: User = Depends(get_current_admin_user)
+):
+    """
+    获取LLM限流统计
+
+    Args:
+        admin_user: 管理员用户
+
+    Returns:
+        dict: 各限流键的队列深度和等待时间
+    """
+    return llm_service.rate_limiter.stats()
+
+
+@router.get("/scheduler/stats")
+async def get_scheduler_stats(
+    admin_user: User = Depends(get_current_admin_user)
+):
+    """
+    获取生成调度统计
+
+    Args:
+        admin_user: 管理员用户
+
+    Returns:
+        dict: 并发数、各优先级队列长度和排队等待时间
+    """
+    return scheduler.stats()
+
+
+@router.get("/db/stats")
+async def get_db_pool_stats(
+    admin_user: User = Depends(get_current_admin_user)
+):
+    """
+    获取数据库连接池统计
+
+    Args:
+        admin_user: 管理员用户
+
+    Returns:
+        dict: 各引擎的连接池状态、当前/峰值借出连接数、连接占用时长分位和延迟写入状态
+    """
+    return {
+        **pool_monitor.stats(),
+        "write_behind": write_behind.stats()
+    }
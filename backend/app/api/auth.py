@@ -3,8 +3,8 @@
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from ..database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db
 from ..schemas import UserCreate, UserLogin, UserResponse, Token
 from ..services import AuthService
 from ..utils import get_current_user
@@ -14,9 +14,9 @@ router = APIRouter()
 
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def register(
+async def register(
     user_data: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     用户注册
@@ -28,14 +28,14 @@ def register(
     Returns:
         UserResponse: 用户信息
     """
-    user = AuthService.register(db, user_data)
+    user = await AuthService.register(db, user_data)
     return user
 
 
 @router.post("/login", response_model=Token)
-def login(
+async def login(
     login_data: UserLogin,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     用户登录
@@ -47,13 +47,13 @@ def login(
     Returns:
         Token: JWT Token
     """
-    return AuthService.login(db, login_data)
+    return await AuthService.login(db, login_data)
 
 
 @router.post("/login/form", response_model=Token)
-def login_form(
+async def login_form(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     表单登录(用于OAuth2密码流)
@@ -66,13 +66,13 @@ def login_form(
         Token: JWT Token
     """
     login_data = UserLogin(username=form_data.username, password=form_data.password)
-    return AuthService.login(db, login_data)
+    return await AuthService.login(db, login_data)
 
 
 @router.post("/refresh", response_model=Token)
-def refresh_token(
+async def refresh_token(
     refresh_token: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     刷新Token
@@ -84,11 +84,11 @@ def refresh_token(
     Returns:
         Token: 新的JWT Token
     """
-    return AuthService.refresh_token(db, refresh_token)
+    return await AuthService.refresh_token(db, refresh_token)
 
 
 @router.get("/me", response_model=UserResponse)
-def get_current_user_info(
+async def get_current_user_info(
     current_user: User = Depends(get_current_user)
 ):
     """
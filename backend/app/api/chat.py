@@ -1,15 +1,29 @@
 """
 聊天相关API
 """
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, status
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from typing import AsyncGenerator
-import json
-from ..database import get_db
-from ..schemas import ChatRequest, ChatResponse, MessageResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncGenerator, Optional, Tuple
+from ..config import settings
+from ..database import AsyncSessionLocal, get_async_db
+from ..schemas import (
+    ChatRequest,
+    ChatResponse,
+    MessageResponse,
+    ContextWindowInfo,
+    StopRequest,
+    BatchChatRequest,
+    BatchJobResponse
+)
 from ..services import ChatService
+from ..services.batch_service import BatchJob, batch_service
+from ..services.generation_registry import Generation, generation_registry
+from ..services.scheduler import scheduler
+from ..services.token_counter import token_counter
 from ..utils import get_current_user
+from ..utils.sse import coalesce, dumps, encode_event
 from ..models import User
 
 router = APIRouter()
@@ -18,7 +32,7 @@ router = APIRouter()
 @router.post("/", response_model=ChatResponse)
 async def chat(
     chat_request: ChatRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -35,7 +49,7 @@ async def chat(
     # 强制非流式
     chat_request.stream = False
 
-    conversation, user_message, response = await ChatService.send_message(
+    conversation, user_message, response, context, usage = await ChatService.send_message(
         db, current_user, chat_request
     )
 
@@ -45,86 +59,224 @@ async def chat(
         conversation.id,
         response,
         chat_request.model,
-        current_user.id
+        current_user.id,
+        usage=usage
     )
 
     return ChatResponse(
         conversation_id=conversation.id,
         message=MessageResponse.model_validate(user_message),
-        assistant_message=MessageResponse.model_validate(assistant_message)
+        assistant_message=MessageResponse.model_validate(assistant_message),
+        context=ContextWindowInfo(**context.info())
     )
 
 
 @router.post("/stream")
 async def chat_stream(
     chat_request: ChatRequest,
-    db: Session = Depends(get_db),
+    last_event_id: Optional[str] = Header(default=None),
     current_user: User = Depends(get_current_user)
 ):
     """
     发送消息(流式)
 
+    生成在后台任务中进行, 事件带ID缓存在内存中; 断线后带Last-Event-ID请求头重连,
+    回放缺失的事件并接上实时输出, 不会重新调用模型
+
+    生成可能持续数十秒, 不使用请求级的数据库会话: 保存用户消息和组装上下文、
+    保存回复各用一个短会话, 生成期间不占用连接
+
     Args:
         chat_request: 聊天请求
-        db: 数据库会话
+        last_event_id: 断线重连时客户端收到的最后一个事件ID
         current_user: 当前用户
 
     Returns:
         StreamingResponse: 服务器发送事件流
     """
+    if last_event_id:
+        generation, after = _resume_target(current_user, last_event_id)
+        return _sse_response(generation.subscribe(after))
+
     # 强制流式
     chat_request.stream = True
 
-    conversation, user_message, response_stream = await ChatService.send_message(
-        db, current_user, chat_request
-    )
+    async with AsyncSessionLocal() as db:
+        conversation, user_message, response_stream, context, usage = await ChatService.send_message(
+            db, current_user, chat_request
+        )
+    generation = generation_registry.register(current_user.id, conversation.id)
+
+    async def produce() -> None:
+        """
+        读取上游并发布事件, 细碎的分块按时间窗口合并后再发布
+
+        停止请求和连接断开超过宽限期都会关闭上游请求, 已生成的部分照常保存并按实际输出计费
+        """
+        chunks = None
+        parts = []
+        token_stream = token_counter.streaming(chat_request.model)
+        settled = False  # 已保存回复或已报告错误
+
+        async def save_partial():
+            # 只保存已发布的内容, Token数即实际消耗的输出Token
+            # 生成可能比请求活得久, 使用独立的短会话
+            nonlocal settled
+            settled = True
+            if not parts:
+                return None
+            async with AsyncSessionLocal() as session:
+                return await ChatService.save_assistant_message(
+                    session,
+                    conversation.id,
+                    "".join(parts),
+                    chat_request.model,
+                    current_user.id,
+                    tokens=token_stream.total,
+                    usage=usage
+                )
 
-    async def event_generator() -> AsyncGenerator[str, None]:
-        """生成SSE事件流"""
         try:
-            # 发送会话ID和用户消息
+            # 发布会话ID和用户消息
             init_data = {
                 "type": "init",
                 "conversation_id": conversation.id,
-                "message": MessageResponse.model_validate(user_message).model_dump()
+                "generation_id": generation.id,
+                "message": MessageResponse.model_validate(user_message).model_dump(mode="json"),
+                "context": context.info()
             }
-            yield f"data: {json.dumps(init_data, ensure_ascii=False)}\n\n"
+            generation.publish(init_data)
 
-            # 流式发送AI回复
-            full_content = ""
-            async for chunk in response_stream:
-                full_content += chunk
+            # 排队期间发布排队位置
+            ticket = getattr(response_stream, "ticket", None)
+            if ticket is not None:
+                async for position in generation.guard(ticket.positions()):
+                    queued_data = {
+                        "type": "queued",
+                        "position": position
+                    }
+                    generation.publish(queued_data)
+
+            # 流式发布AI回复
+            chunks = coalesce(
+                response_stream,
+                window_ms=settings.SSE_COALESCE_WINDOW_MS,
+                max_bytes=settings.SSE_COALESCE_MAX_BYTES
+            )
+            async for chunk in generation.guard(chunks):
+                parts.append(chunk)
+                token_stream.feed(chunk)
                 chunk_data = {
                     "type": "chunk",
                     "content": chunk
                 }
-                yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
-
-            # 保存完整的助手回复
-            assistant_message = await ChatService.save_assistant_message(
-                db,
-                conversation.id,
-                full_content,
-                chat_request.model,
-                current_user.id
-            )
+                generation.publish(chunk_data)
+
+            # 保存助手回复(被停止时为已生成的部分)
+            assistant_message = await save_partial()
 
-            # 发送完成事件
+            # 发布完成事件
             done_data = {
                 "type": "done",
-                "assistant_message": MessageResponse.model_validate(assistant_message).model_dump()
+                "stopped": generation.stopped,
+                "assistant_message": (
+                    MessageResponse.model_validate(assistant_message).model_dump(mode="json")
+                    if assistant_message is not None else None
+                )
             }
-            yield f"data: {json.dumps(done_data, ensure_ascii=False)}\n\n"
+            generation.publish(done_data)
 
         except Exception as e:
+            settled = True
             error_data = {
                 "type": "error",
                 "message": str(e)
             }
-            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+            generation.publish(error_data)
+
+        finally:
+            try:
+                if not settled:
+                    # 任务被取消(服务关闭): 保存已生成的部分
+                    await save_partial()
+            finally:
+                # 撤销排队或归还调度名额, 关闭上游连接
+                await _close_streams(chunks, response_stream)
+                generation_registry.unregister(generation)
 
+    generation.task = asyncio.create_task(produce())
+    return _sse_response(generation.subscribe())
+
+
+@router.get("/subscribe/{conversation_id}")
+async def subscribe_generation(
+    conversation_id: int,
+    last_event_id: Optional[str] = Header(default=None),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    订阅会话中进行中的生成
+
+    在其他标签页或设备上打开同一会话时, 从头回放已生成的事件并接收后续分块,
+    与发起请求的连接共用同一个上游流
+
+    Args:
+        conversation_id: 会话ID
+        last_event_id: 断线重连时客户端收到的最后一个事件ID
+        current_user: 当前用户
+
+    Returns:
+        StreamingResponse: 服务器发送事件流
+
+    Raises:
+        HTTPException: 会话没有进行中的生成
+    """
+    if last_event_id:
+        generation, after = _resume_target(current_user, last_event_id)
+        return _sse_response(generation.subscribe(after))
+
+    generation = generation_registry.active(current_user.id, conversation_id)
+    if generation is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="该会话没有进行中的生成"
+        )
+    return _sse_response(generation.subscribe())
+
+
+def _resume_target(user: User, last_event_id: str) -> Tuple[Generation, int]:
+    """
+    解析Last-Event-ID, 找到要续传的生成
+
+    Args:
+        user: 当前用户
+        last_event_id: "生成ID:序号"
+
+    Returns:
+        Tuple[Generation, int]: 生成和客户端已收到的最后一个序号
+
+    Raises:
+        HTTPException: 格式错误, 或生成不存在/已过期/在其他worker上
+    """
+    generation_id, _, seq = last_event_id.rpartition(":")
+    if not generation_id or not seq.isdigit():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Last-Event-ID格式错误"
+        )
+    generation = generation_registry.get(user.id, generation_id)
+    if generation is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="生成不存在或已过期, 请重新加载会话"
+        )
+    return generation, int(seq)
+
+
+def _sse_response(frames: AsyncGenerator[bytes, None]) -> StreamingResponse:
+    """以服务器发送事件流返回"""
     return StreamingResponse(
-        event_generator(),
+        frames,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -133,15 +285,144 @@ async def chat_stream(
     )
 
 
+async def _close_streams(*streams) -> None:
+    """依次关闭流, 外层的合并流先关闭"""
+    for stream in streams:
+        if stream is not None:
+            await stream.aclose()
+
+
+def _ndjson_response(job: BatchJob) -> StreamingResponse:
+    """以NDJSON流式返回任务进度和结果, 客户端断开不影响任务执行"""
+    async def line_generator() -> AsyncGenerator[bytes, None]:
+        async for event in job.follow():
+            yield dumps(event) + b"\n"
+
+    return StreamingResponse(
+        line_generator(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Batch-Job-Id": job.id}
+    )
+
+
+@router.post("/batch", status_code=status.HTTP_202_ACCEPTED)
+async def create_batch(
+    batch_request: BatchChatRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    提交批量聊天任务
+
+    任务在后台以有限并发执行, 结果批量保存为会话
+
+    Args:
+        batch_request: 批量请求
+        current_user: 当前用户
+
+    Returns:
+        BatchJobResponse | StreamingResponse: 任务状态, stream为True时返回NDJSON进度流
+    """
+    job = batch_service.submit(current_user, batch_request)
+    if batch_request.stream:
+        return _ndjson_response(job)
+    return BatchJobResponse(**job.summary())
+
+
+@router.get("/batch/{job_id}", response_model=BatchJobResponse)
+async def get_batch(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    查询批量任务状态
+
+    Args:
+        job_id: 任务ID
+        current_user: 当前用户
+
+    Returns:
+        BatchJobResponse: 任务状态
+    """
+    job = batch_service.get_job(current_user, job_id)
+    return BatchJobResponse(**job.summary())
+
+
+@router.get("/batch/{job_id}/results")
+async def get_batch_results(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取批量任务结果(NDJSON)
+
+    先返回已完成的结果, 任务未结束时继续推送, 最后一行为done事件
+
+    Args:
+        job_id: 任务ID
+        current_user: 当前用户
+
+    Returns:
+        StreamingResponse: NDJSON结果流
+    """
+    job = batch_service.get_job(current_user, job_id)
+    return _ndjson_response(job)
+
+
+@router.delete("/batch/{job_id}", response_model=BatchJobResponse)
+async def cancel_batch(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    取消批量任务, 已完成的结果保留
+
+    Args:
+        job_id: 任务ID
+        current_user: 当前用户
+
+    Returns:
+        BatchJobResponse: 任务状态
+    """
+    job = batch_service.cancel(current_user, job_id)
+    return BatchJobResponse(**job.summary())
+
+
+@router.get("/queue")
+async def get_queue_status(
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取当前用户的排队状态
+
+    Args:
+        current_user: 当前用户
+
+    Returns:
+        dict: 进行中的生成数、排队中请求的位置, 以及本worker上可订阅的生成
+    """
+    return {
+        **scheduler.user_status(current_user.id),
+        "generations": generation_registry.user_generations(current_user.id)
+    }
+
+
 @router.post("/stop")
 async def stop_generation(
+    stop_request: StopRequest = Body(default_factory=StopRequest),
     current_user: User = Depends(get_current_user)
 ):
     """
     停止生成
 
-    Note: 实际实现需要维护一个生成任务的映射表
-    这里仅提供接口示例
+    取消上游请求, 已生成的部分由流式接口保存;
+    生成在其他worker上时通过广播通知
+
+    Args:
+        stop_request: 停止请求, 不指定会话时停止当前用户的所有生成
+        current_user: 当前用户
+
+    Returns:
+        dict: 本worker上停止的生成数
     """
-    # TODO: 实现停止生成的逻辑
-    return {"message": "停止生成请求已发送"}
+    stopped = await generation_registry.stop(current_user.id, stop_request.conversation_id)
+    return {"message": "停止生成请求已发送", "stopped": stopped}
@@ -1,63 +1,115 @@
 """
 会话管理相关API
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from sqlalchemy import Select, func, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from ..database import get_db
+from ..database import get_async_db
 from ..schemas import (
     ConversationCreate,
     ConversationUpdate,
     ConversationResponse,
     ConversationListResponse,
-    MessageResponse
+    MessageResponse,
+    MessageSearchHit,
+    MessageSearchResponse
 )
 from ..models import User, Conversation, Message
 from ..utils import get_current_user
+from ..utils.pagination import cursor_boundary, decode_keyset_cursor, encode_cursor
 from ..services import ChatService
+from ..services.search_service import message_search
 
 router = APIRouter()
 
 
+async def _conversation_page(
+    db: AsyncSession,
+    query: Select,
+    skip: int,
+    cursor: Optional[str],
+    limit: int,
+    total: Optional[int] = None
+) -> ConversationListResponse:
+    """
+    按更新时间倒序取一页会话
+
+    有游标时从游标所在行之后继续(键集分页, 深翻页不变慢), 否则按skip偏移(兼容旧参数)
+
+    Args:
+        db: 数据库会话
+        query: 已加过滤条件的会话查询
+        skip: 跳过的记录数
+        cursor: 上一页返回的next_cursor
+        limit: 返回的记录数
+        total: 已知的总数, 为None时按查询条件计数
+
+    Returns:
+        ConversationListResponse: 会话列表及下一页游标
+    """
+    if total is None:
+        total = await db.scalar(select(func.count()).select_from(query.subquery()))
+
+    after = decode_keyset_cursor(cursor)
+    if after is not None:
+        query = query.where(
+            tuple_(Conversation.updated_at, Conversation.id) < cursor_boundary(*after)
+        )
+    else:
+        query = query.offset(skip)
+
+    # 多取一条判断是否还有下一页
+    rows = (await db.scalars(
+        query.order_by(
+            Conversation.updated_at.desc(), Conversation.id.desc()
+        ).limit(limit + 1)
+    )).all()
+    conversations = rows[:limit]
+
+    return ConversationListResponse(
+        total=total,
+        conversations=[ConversationResponse.model_validate(c) for c in conversations],
+        next_cursor=encode_cursor(
+            conversations[-1].id, conversations[-1].updated_at
+        ) if len(rows) > limit else None
+    )
+
+
 @router.get("/", response_model=ConversationListResponse)
-def get_conversations(
+async def get_conversations(
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
     获取用户的会话列表
 
     Args:
-        skip: 跳过的记录数
+        skip: 跳过的记录数(旧的偏移分页, 指定cursor时忽略)
         limit: 返回的记录数
+        cursor: 上一页返回的next_cursor
         db: 数据库会话
         current_user: 当前用户
 
     Returns:
         ConversationListResponse: 会话列表
     """
-    total = db.query(Conversation).filter(
-        Conversation.user_id == current_user.id
-    ).count()
-
-    conversations = db.query(Conversation).filter(
+    query = select(Conversation).where(
         Conversation.user_id == current_user.id
-    ).order_by(
-        Conversation.updated_at.desc()
-    ).offset(skip).limit(limit).all()
-
-    return ConversationListResponse(
-        total=total,
-        conversations=[ConversationResponse.model_validate(c) for c in conversations]
+    )
+    # 总数取用户上维护的会话数(认证时已读出), 不再对会话表计数
+    return await _conversation_page(
+        db, query, skip, cursor, limit, total=current_user.conversation_count
     )
 
 
 @router.post("/", response_model=ConversationResponse, status_code=status.HTTP_201_CREATED)
-def create_conversation(
+async def create_conversation(
     conversation_data: ConversationCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -77,15 +129,58 @@ def create_conversation(
         model=conversation_data.model
     )
     db.add(conversation)
-    db.commit()
-    db.refresh(conversation)
+    await db.execute(ChatService.conversation_count_statement(current_user.id, 1))
+    await db.commit()
+    await db.refresh(conversation)
     return conversation
 
 
+@router.get("/search/messages", response_model=MessageSearchResponse)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    skip: int = Query(0, ge=0, le=1000),
+    limit: int = Query(20, ge=1, le=50),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    在当前用户的所有会话中检索消息内容
+    (须在/{conversation_id}/messages之前注册, 否则search会被当作会话ID)
+
+    结果按相关度排序, 摘要为已转义的HTML, 命中部分用<mark>包裹; 多个词之间为"且"
+
+    Args:
+        q: 检索文本
+        skip: 跳过的记录数
+        limit: 返回的记录数
+        db: 数据库会话
+        current_user: 当前用户
+
+    Returns:
+        MessageSearchResponse: 命中总数和一页结果
+    """
+    total, hits = await message_search.search(db, current_user.id, q, limit=limit, offset=skip)
+    return MessageSearchResponse(
+        total=total,
+        hits=[
+            MessageSearchHit(
+                message_id=hit.message.id,
+                conversation_id=hit.message.conversation_id,
+                conversation_title=hit.conversation_title,
+                role=hit.message.role,
+                snippet=hit.snippet,
+                rank=hit.rank,
+                created_at=hit.message.created_at
+            )
+            for hit in hits
+        ]
+    )
+
+
 @router.get("/{conversation_id}", response_model=ConversationResponse)
-def get_conversation(
+async def get_conversation(
     conversation_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -99,10 +194,12 @@ def get_conversation(
     Returns:
         ConversationResponse: 会话详情
     """
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        Conversation.user_id == current_user.id
-    ).first()
+    conversation = await db.scalar(
+        select(Conversation).where(
+            Conversation.id == conversation_id,
+            Conversation.user_id == current_user.id
+        )
+    )
 
     if not conversation:
         raise HTTPException(
@@ -114,10 +211,10 @@ def get_conversation(
 
 
 @router.put("/{conversation_id}", response_model=ConversationResponse)
-def update_conversation(
+async def update_conversation(
     conversation_id: int,
     conversation_data: ConversationUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -132,10 +229,12 @@ def update_conversation(
     Returns:
         ConversationResponse: 更新后的会话
     """
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        Conversation.user_id == current_user.id
-    ).first()
+    conversation = await db.scalar(
+        select(Conversation).where(
+            Conversation.id == conversation_id,
+            Conversation.user_id == current_user.id
+        )
+    )
 
     if not conversation:
         raise HTTPException(
@@ -149,15 +248,15 @@ def update_conversation(
     if conversation_data.model is not None:
         conversation.model = conversation_data.model
 
-    db.commit()
-    db.refresh(conversation)
+    await db.commit()
+    await db.refresh(conversation)
     return conversation
 
 
 @router.delete("/{conversation_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_conversation(
+async def delete_conversation(
     conversation_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -168,10 +267,12 @@ def delete_conversation(
         db: 数据库会话
         current_user: 当前用户
     """
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        Conversation.user_id == current_user.id
-    ).first()
+    conversation = await db.scalar(
+        select(Conversation).where(
+            Conversation.id == conversation_id,
+            Conversation.user_id == current_user.id
+        )
+    )
 
     if not conversation:
         raise HTTPException(
@@ -179,63 +280,98 @@ def delete_conversation(
             detail="会话不存在"
         )
 
-    db.delete(conversation)
-    db.commit()
+    await db.delete(conversation)
+    await db.execute(ChatService.conversation_count_statement(current_user.id, -1))
+    await db.commit()
 
 
 @router.get("/{conversation_id}/messages", response_model=List[MessageResponse])
-def get_conversation_messages(
+async def get_conversation_messages(
     conversation_id: int,
-    db: Session = Depends(get_db),
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    before: Optional[str] = Query(None),
+    after: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    获取会话的所有消息
+    获取会话的消息(按时间正序)
+
+    分页是可选的: 不带limit和游标时返回全部消息。只带limit时返回最近的limit条;
+    向上滚动时用X-Prev-Cursor作为before取更早的消息, 用X-Next-Cursor作为after取更新的消息,
+    只带游标时每页100条; 对应方向没有更多消息时不返回该响应头
 
     Args:
         conversation_id: 会话ID
+        response: 响应(写入分页游标响应头)
+        limit: 返回的记录数, 不分页时为None
+        before: 取该游标之前(更早)的消息
+        after: 取该游标之后(更新)的消息
         db: 数据库会话
         current_user: 当前用户
 
     Returns:
         List[MessageResponse]: 消息列表
+
+    Raises:
+        HTTPException: before和after同时指定
     """
-    messages = ChatService.get_conversation_messages(db, current_user, conversation_id)
+    if before and after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="before和after不能同时指定"
+        )
+
+    before_key = decode_keyset_cursor(before)
+    after_key = decode_keyset_cursor(after)
+    if limit is None and (before_key or after_key):
+        limit = 100
+    messages, has_more = await ChatService.get_conversation_messages(
+        db, current_user, conversation_id,
+        limit=limit, before=before_key, after=after_key
+    )
+
+    if messages:
+        # 向后翻页时游标所在行在这一页之前, 向前翻页时在这一页之后
+        has_older = has_more if after_key is None else True
+        has_newer = has_more if after_key is not None else before_key is not None
+        if has_older:
+            response.headers["X-Prev-Cursor"] = encode_cursor(messages[0].id, messages[0].created_at)
+        if has_newer:
+            response.headers["X-Next-Cursor"] = encode_cursor(messages[-1].id, messages[-1].created_at)
+
     return [MessageResponse.model_validate(msg) for msg in messages]
 
 
 @router.get("/search/", response_model=ConversationListResponse)
-def search_conversations(
+async def search_conversations(
     q: str = Query(..., min_length=1),
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    搜索会话
+    搜索会话: 标题包含关键词, 或有消息内容命中全文检索
 
     Args:
         q: 搜索关键词
-        skip: 跳过的记录数
+        skip: 跳过的记录数(旧的偏移分页, 指定cursor时忽略)
         limit: 返回的记录数
+        cursor: 上一页返回的next_cursor
         db: 数据库会话
         current_user: 当前用户
 
     Returns:
         ConversationListResponse: 搜索结果
     """
-    query = db.query(Conversation).filter(
+    query = select(Conversation).where(
         Conversation.user_id == current_user.id,
-        Conversation.title.contains(q)
-    )
-
-    total = query.count()
-    conversations = query.order_by(
-        Conversation.updated_at.desc()
-    ).offset(skip).limit(limit).all()
-
-    return ConversationListResponse(
-        total=total,
-        conversations=[ConversationResponse.model_validate(c) for c in conversations]
+        or_(
+            Conversation.title.contains(q, autoescape=True),
+            Conversation.id.in_(message_search.conversation_ids(current_user.id, q))
+        )
     )
+    return await _conversation_page(db, query, skip, cursor, limit)
@@ -1,33 +1,117 @@
 """
 数据库配置模块
 SQLAlchemy数据库连接和会话管理
+
+请求处理使用异步引擎(asyncpg/aiosqlite), 数据库往返不阻塞事件循环;
+同步引擎保留给脚本、建表和在线程中执行的批量写入
 """
-from sqlalchemy import create_engine
+from pathlib import Path
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 
-# 创建数据库引擎
+# Alembic配置文件(backend/alembic.ini)
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+# 与最初create_all建表结果一致的迁移版本
+BASELINE_REVISION = "0001"
+
+# 同步驱动 -> 异步驱动
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def async_database_url(url: str) -> str:
+    """
+    由同步连接串推导异步连接串
+
+    Args:
+        url: 同步连接串, 如 postgresql://... 或 postgresql+psycopg2://...
+
+    Returns:
+        str: 异步连接串, 已指定异步驱动时原样返回
+    """
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    driver = ASYNC_DRIVERS.get(backend)
+    if driver is None or parsed.drivername == driver:
+        return url
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+# 创建数据库引擎(同步)
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,  # 连接池预检查
     echo=settings.DEBUG  # 开发模式下打印SQL
 )
 
-# 创建会话工厂
+# 创建会话工厂(同步)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 创建异步数据库引擎
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL),
+    pool_pre_ping=True,
+    echo=settings.DEBUG
+)
+
+# 创建异步会话工厂
+# 提交后不过期对象, 否则提交后访问属性会触发隐式IO
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # 创建基类
 Base = declarative_base()
 
 
 def get_db():
     """
-    获取数据库会话
-    用于FastAPI的依赖注入
+    获取数据库会话(同步)
+    用于脚本和同步代码
     """
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """
+    获取异步数据库会话
+    用于FastAPI的依赖注入
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def upgrade_database(revision: str = "head") -> None:
+    """
+    执行数据库迁移(alembic upgrade)
+
+    此前由create_all建表、还没有版本记录的数据库先标记为基线版本, 再继续升级
+
+    Args:
+        revision: 目标版本
+    """
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(ALEMBIC_INI.parent / "alembic"))
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        tables = set(inspect(connection).get_table_names())
+        if "alembic_version" not in tables and "users" in tables:
+            command.stamp(config, BASELINE_REVISION)
+        command.upgrade(config, revision)
@@ -1,14 +1,26 @@
 """
 FastAPI应用主入口
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from .config import settings
-from .database import engine, Base
+from .database import async_engine, engine, upgrade_database
 from .api import api_router
+from .services.llm_clients import llm_client_pool
+from .services.generation_registry import generation_registry
+from .services.write_behind import write_behind
+from .services.rate_limiter import RateLimitExceededError, rate_limiter
+from .services.llm_router import ProviderUnavailableError
+from .utils.metrics import pool_monitor
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+# 执行数据库迁移(表结构由alembic/versions管理)
+if settings.DATABASE_AUTO_MIGRATE:
+    upgrade_database()
+
+# 统计连接池占用(迁移之后挂载, 不计入启动时的连接)
+pool_monitor.attach("async", async_engine.sync_engine)
+pool_monitor.attach("sync", engine)
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -25,12 +37,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor"],  # 分页游标
 )
 
 # 注册路由
 app.include_router(api_router)
 
 
+@app.exception_handler(RateLimitExceededError)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceededError):
+    """限流排队超时返回429"""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": str(exc)}
+    )
+
+
+@app.exception_handler(ProviderUnavailableError)
+async def provider_unavailable_handler(request: Request, exc: ProviderUnavailableError):
+    """提供商熔断中返回503"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)}
+    )
+
+
+@app.on_event("startup")
+async def startup():
+    """检查限流存储, 开始接收其他worker转发的停止生成请求, 启动延迟写入任务"""
+    await rate_limiter.start()
+    await generation_registry.start()
+    await write_behind.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """写入缓存的使用记录, 关闭共享的LLM连接池"""
+    await generation_registry.aclose()
+    await write_behind.aclose()
+    await llm_client_pool.aclose()
+
+
 @app.get("/")
 def root():
     """健康检查"""
@@ -2,7 +2,7 @@
 API使用统计模型
 记录用户的API调用情况
 """
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from ..database import Base
@@ -12,11 +12,19 @@ class ApiUsage(Base):
     """API使用统计表模型"""
 
     __tablename__ = "api_usages"
+    __table_args__ = (
+        # 按时间范围统计用量, 再按模型/日期分组
+        Index("ix_api_usages_created_at_model", "created_at", "model"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     model = Column(String(50), nullable=False)  # 使用的模型
     tokens = Column(Integer, default=0)  # Token消耗
+    # 以下三列为提供商报告的用量, 未报告时为NULL(与报告了0区分)
+    prompt_tokens = Column(Integer)  # 提示词Token数(含缓存部分)
+    cache_read_tokens = Column(Integer)  # 命中提示词缓存的Token数
+    cache_write_tokens = Column(Integer)  # 写入提示词缓存的Token数
     cost = Column(Float, default=0.0)  # 成本
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -2,7 +2,7 @@
 会话模型
 管理用户的对话会话
 """
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from ..database import Base
@@ -12,13 +12,23 @@ class Conversation(Base):
     """会话表模型"""
 
     __tablename__ = "conversations"
+    __table_args__ = (
+        # 用户的会话列表, 按更新时间倒序(id用于同一时间内的稳定排序和游标分页)
+        Index("ix_conversations_user_id_updated_at_id", "user_id", "updated_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     title = Column(String(200), default="新对话")
     model = Column(String(50), default="gpt-3.5-turbo")  # 使用的模型
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    # 冗余统计, 随消息写入在同一事务中维护, 列表无需再查消息表
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")  # 消息数
+    total_tokens = Column(Integer, nullable=False, default=0, server_default="0")  # 消息Token总数
+    last_message_at = Column(DateTime(timezone=True))  # 最后一条消息的时间
+    last_message_preview = Column(String(200))  # 最后一条消息的摘要
 
     # 关系
     user = relationship("User", back_populates="conversations")
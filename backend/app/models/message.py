@@ -2,7 +2,7 @@
 消息模型
 存储对话中的每条消息
 """
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from ..database import Base
@@ -12,6 +12,11 @@ class Message(Base):
     """消息表模型"""
 
     __tablename__ = "messages"
+    __table_args__ = (
+        # 按会话取消息并按时间排序(组装上下文、消息列表)
+        Index("ix_messages_conversation_id_created_at", "conversation_id", "created_at", "id"),
+        # 内容的全文索引只在迁移中创建(PostgreSQL表达式GIN索引/SQLite FTS5表和触发器), 见search_service
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
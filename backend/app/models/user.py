@@ -6,6 +6,7 @@ from sqlalchemy import Column, Integer, String, Boolean, DateTime
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from ..database import Base
+from ..config import settings
 
 
 class User(Base):
@@ -19,6 +20,8 @@ class User(Base):
     password_hash = Column(String(255), nullable=False)
     is_active = Column(Boolean, default=True)
     is_admin = Column(Boolean, default=False)
+    tier = Column(String(20), nullable=False, default=settings.SCHEDULER_DEFAULT_TIER)  # 调度等级
+    conversation_count = Column(Integer, nullable=False, default=0, server_default="0")  # 会话数(随会话创建和删除维护)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -14,13 +14,20 @@ from .conversation import (
     ConversationCreate,
     ConversationUpdate,
     ConversationResponse,
-    ConversationListResponse
+    ConversationListResponse,
+    MessageSearchHit,
+    MessageSearchResponse
 )
 from .message import (
     MessageCreate,
     MessageResponse,
     ChatRequest,
-    ChatResponse
+    ChatResponse,
+    StopRequest,
+    ContextWindowInfo,
+    BatchChatItem,
+    BatchChatRequest,
+    BatchJobResponse
 )
 
 __all__ = [
@@ -34,8 +41,15 @@ __all__ = [
     "ConversationUpdate",
     "ConversationResponse",
     "ConversationListResponse",
+    "MessageSearchHit",
+    "MessageSearchResponse",
     "MessageCreate",
     "MessageResponse",
     "ChatRequest",
     "ChatResponse",
+    "StopRequest",
+    "ContextWindowInfo",
+    "BatchChatItem",
+    "BatchChatRequest",
+    "BatchJobResponse",
 ]
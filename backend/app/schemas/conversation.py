@@ -26,6 +26,10 @@ class ConversationResponse(BaseModel):
     model: str
     created_at: datetime
     updated_at: Optional[datetime] = None
+    message_count: int = 0
+    total_tokens: int = 0
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -35,3 +39,21 @@ class ConversationListResponse(BaseModel):
     """会话列表响应Schema"""
     total: int
     conversations: List[ConversationResponse]
+    next_cursor: Optional[str] = None  # 下一页游标, 没有更多时为None
+
+
+class MessageSearchHit(BaseModel):
+    """消息检索结果Schema"""
+    message_id: int
+    conversation_id: int
+    conversation_title: str
+    role: str
+    snippet: str  # 已转义的HTML, 命中部分用<mark>包裹
+    rank: float
+    created_at: datetime
+
+
+class MessageSearchResponse(BaseModel):
+    """消息检索响应Schema"""
+    total: int
+    hits: List[MessageSearchHit]
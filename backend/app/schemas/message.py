@@ -1,7 +1,7 @@
 """
 消息相关的Pydantic Schemas
 """
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 
@@ -33,6 +33,22 @@ class ChatRequest(BaseModel):
     message: str
     model: Optional[str] = "gpt-3.5-turbo"
     stream: bool = False  # 是否使用流式响应
+    use_cache: bool = True  # 是否允许使用响应缓存
+
+
+class StopRequest(BaseModel):
+    """停止生成请求Schema"""
+    conversation_id: Optional[int] = None  # 为None时停止当前用户的所有生成
+
+
+class ContextWindowInfo(BaseModel):
+    """上下文窗口信息Schema"""
+    budget_tokens: int  # 历史消息的Token预算
+    used_tokens: int  # 实际发送的提示词Token数
+    included_messages: int  # 发送的消息条数
+    truncated: bool  # 是否有更早的消息未发送
+    elided: bool  # 是否有消息被截断
+    oldest_message_id: Optional[int] = None  # 发送的最早一条消息ID
 
 
 class ChatResponse(BaseModel):
@@ -40,3 +56,34 @@ class ChatResponse(BaseModel):
     conversation_id: int
     message: MessageResponse
     assistant_message: MessageResponse
+    context: Optional[ContextWindowInfo] = None
+
+
+class BatchChatItem(BaseModel):
+    """批量聊天中的单条提示"""
+    message: str = Field(..., min_length=1)
+    system: Optional[str] = None  # 可选的系统提示
+
+
+class BatchChatRequest(BaseModel):
+    """批量聊天请求Schema"""
+    items: List[BatchChatItem] = Field(..., min_length=1)
+    model: Optional[str] = "gpt-3.5-turbo"
+    concurrency: Optional[int] = Field(None, ge=1)  # 并发数, 不超过服务端上限
+    requests_per_minute: Optional[int] = Field(None, ge=1)  # 本任务的请求速率上限
+    use_cache: bool = True  # 是否允许使用响应缓存
+    save: bool = True  # 是否把结果保存为会话
+    stream: bool = False  # 是否以NDJSON流式返回进度和结果
+
+
+class BatchJobResponse(BaseModel):
+    """批量任务状态Schema"""
+    job_id: str
+    status: str  # pending, running, completed, cancelled, failed
+    model: str
+    total: int
+    completed: int
+    failed: int
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
@@ -32,6 +32,8 @@ class UserResponse(BaseModel):
     email: str
     is_active: bool
     is_admin: bool
+    tier: str
+    conversation_count: int = 0
     created_at: datetime
 
     class Config:
@@ -5,5 +5,6 @@
 from .auth_service import AuthService
 from .chat_service import ChatService
 from .llm_service import LLMService
+from .llm_clients import LLMClientPool
 
-__all__ = ["AuthService", "ChatService", "LLMService"]
+__all__ = ["AuthService", "ChatService", "LLMService", "LLMClientPool"]
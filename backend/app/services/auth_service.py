@@ -2,7 +2,9 @@
 认证服务
 处理用户注册、登录等业务逻辑
 """
-from sqlalchemy.orm import Session
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
 from ..models import User
 from ..schemas import UserCreate, UserLogin, Token
@@ -18,7 +20,7 @@ class AuthService:
     """认证服务类"""
 
     @staticmethod
-    def register(db: Session, user_data: UserCreate) -> User:
+    async def register(db: AsyncSession, user_data: UserCreate) -> User:
         """
         用户注册
 
@@ -33,32 +35,32 @@ class AuthService:
             HTTPException: 如果用户名或邮箱已存在
         """
         # 检查用户名是否已存在
-        if db.query(User).filter(User.username == user_data.username).first():
+        if await db.scalar(select(User).where(User.username == user_data.username)):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="用户名已存在"
             )
 
         # 检查邮箱是否已存在
-        if db.query(User).filter(User.email == user_data.email).first():
+        if await db.scalar(select(User).where(User.email == user_data.email)):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="邮箱已被注册"
             )
 
-        # 创建新用户
+        # 创建新用户(bcrypt计算耗时较长, 放到线程中执行, 不阻塞事件循环)
         db_user = User(
             username=user_data.username,
             email=user_data.email,
-            password_hash=get_password_hash(user_data.password)
+            password_hash=await asyncio.to_thread(get_password_hash, user_data.password)
         )
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
         return db_user
 
     @staticmethod
-    def login(db: Session, login_data: UserLogin) -> Token:
+    async def login(db: AsyncSession, login_data: UserLogin) -> Token:
         """
         用户登录
 
@@ -73,15 +75,16 @@ class AuthService:
             HTTPException: 如果用户名或密码错误
         """
         # 查找用户
-        user = db.query(User).filter(User.username == login_data.username).first()
+        user = await db.scalar(select(User).where(User.username == login_data.username))
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="用户名或密码错误"
             )
 
-        # 验证密码
-        if not verify_password(login_data.password, user.password_hash):
+        # 验证密码(在线程中执行), 先结束只读事务, 计算期间不占用连接
+        await db.commit()
+        if not await asyncio.to_thread(verify_password, login_data.password, user.password_hash):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="用户名或密码错误"
@@ -105,7 +108,7 @@ class AuthService:
         )
 
     @staticmethod
-    def refresh_token(db: Session, refresh_token: str) -> Token:
+    async def refresh_token(db: AsyncSession, refresh_token: str) -> Token:
         """
         刷新Token
 
@@ -129,7 +132,7 @@ class AuthService:
             )
 
         user_id = payload.get("user_id")
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.scalar(select(User).where(User.id == user_id))
         if not user or not user.is_active:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,390 @@
+"""
+批量聊天服务
+一次提交多条提示, 后台以有限并发执行, 结果分批批量写入数据库;
+任务与发起请求的连接解耦, 客户端断开后继续运行, 可按任务ID查询
+"""
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import AsyncGenerator, Dict, List, Optional
+from fastapi import HTTPException, status
+from sqlalchemy import func
+from ..config import settings
+from ..database import AsyncSessionLocal
+from ..models import User, Conversation, Message, ApiUsage
+from ..schemas import BatchChatItem, BatchChatRequest
+from .chat_service import ChatService
+from .llm_service import llm_service
+from .prompt_cache import ProviderUsage
+from .scheduler import scheduler
+
+
+@dataclass
+class BatchResult:
+    """单条提示的执行结果"""
+    index: int
+    ok: bool
+    content: Optional[str] = None
+    error: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    usage: Optional[ProviderUsage] = None  # 提供商报告的用量(含提示词缓存读写)
+    conversation_id: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "index": self.index,
+            "ok": self.ok,
+            "content": self.content,
+            "error": self.error,
+            "tokens": self.completion_tokens,
+            "conversation_id": self.conversation_id
+        }
+
+
+@dataclass
+class BatchJob:
+    """一个批量任务"""
+    id: str
+    user_id: int
+    tier: Optional[str]
+    model: str
+    items: List[BatchChatItem]
+    concurrency: int
+    requests_per_minute: Optional[int]
+    use_cache: bool
+    save: bool
+    status: str = "pending"
+    error: Optional[str] = None
+    results: List[BatchResult] = field(default_factory=list)  # 已保存的结果, 按完成顺序
+    completed: int = 0  # 已执行完的提示数(含尚未保存的)
+    failures: int = 0
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: Optional[datetime] = None
+    task: Optional[asyncio.Task] = None
+    _changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "cancelled", "failed")
+
+    def notify(self) -> None:
+        """唤醒所有跟随进度的读取方"""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "model": self.model,
+            "total": len(self.items),
+            "completed": self.completed,
+            "failed": self.failures,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error
+        }
+
+    async def follow(self) -> AsyncGenerator[dict, None]:
+        """
+        先回放已保存的结果, 再跟随后续进度, 任务结束时产出done事件
+
+        每条提示执行完即产出progress事件; result事件在结果写入数据库后产出, 因此带有conversation_id
+        """
+        index = 0
+        completed = 0
+        while True:
+            if index < len(self.results):
+                result = self.results[index]
+                index += 1
+                yield {"type": "result", **result.to_dict()}
+            elif completed != self.completed and not self.done:
+                completed = self.completed
+                yield {
+                    "type": "progress",
+                    "completed": completed,
+                    "failed": self.failures,
+                    "total": len(self.items)
+                }
+            elif self.done:
+                summary = self.summary()
+                summary["created_at"] = summary["created_at"].isoformat()
+                summary["finished_at"] = summary["finished_at"].isoformat() if summary["finished_at"] else None
+                yield {"type": "done", **summary}
+                return
+            else:
+                await self._changed.wait()
+
+
+class BatchService:
+    """批量聊天服务类"""
+
+    def __init__(self):
+        self._jobs: Dict[str, BatchJob] = {}
+
+    def submit(self, user: User, request: BatchChatRequest) -> BatchJob:
+        """
+        创建并启动批量任务
+
+        Args:
+            user: 当前用户
+            request: 批量请求
+
+        Returns:
+            BatchJob: 已启动的任务
+
+        Raises:
+            HTTPException: 提示数超限或用户进行中的任务过多
+        """
+        self._purge_expired()
+        if len(request.items) > settings.BATCH_MAX_ITEMS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"单个任务最多 {settings.BATCH_MAX_ITEMS} 条提示"
+            )
+        active = sum(1 for job in self._jobs.values() if job.user_id == user.id and not job.done)
+        if active >= settings.BATCH_MAX_ACTIVE_JOBS_PER_USER:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="进行中的批量任务过多, 请稍后再试"
+            )
+
+        job = BatchJob(
+            id=uuid.uuid4().hex,
+            user_id=user.id,
+            tier=user.tier,
+            model=request.model,
+            items=request.items,
+            concurrency=min(request.concurrency or settings.BATCH_MAX_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY),
+            requests_per_minute=request.requests_per_minute,
+            use_cache=request.use_cache,
+            save=request.save
+        )
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    def get_job(self, user: User, job_id: str) -> BatchJob:
+        """
+        获取任务
+
+        Args:
+            user: 当前用户
+            job_id: 任务ID
+
+        Returns:
+            BatchJob: 任务
+
+        Raises:
+            HTTPException: 任务不存在或不属于当前用户
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user.id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="批量任务不存在"
+            )
+        return job
+
+    def cancel(self, user: User, job_id: str) -> BatchJob:
+        """
+        取消任务, 已完成的结果保留
+
+        Args:
+            user: 当前用户
+            job_id: 任务ID
+
+        Returns:
+            BatchJob: 任务
+        """
+        job = self.get_job(user, job_id)
+        if not job.done and job.task is not None:
+            job.task.cancel()
+        return job
+
+    def _purge_expired(self) -> None:
+        """移除结束超过保留时间的任务"""
+        now = datetime.now(timezone.utc)
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at and (now - job.finished_at).total_seconds() > settings.BATCH_JOB_TTL_SECONDS
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def _run(self, job: BatchJob) -> None:
+        """执行任务: 有限并发调用LLM, 结果攒批写入数据库"""
+        job.status = "running"
+        pending: List[BatchResult] = []
+        write_lock = asyncio.Lock()
+        indexes = iter(range(len(job.items)))
+        interval = 60 / job.requests_per_minute if job.requests_per_minute else 0.0
+        next_start = time.monotonic()
+
+        async def flush() -> None:
+            async with write_lock:
+                if not pending:
+                    return
+                batch = pending[:]
+                pending.clear()
+                if job.save:
+                    try:
+                        await self._persist(job, batch)
+                    except Exception as e:
+                        # 保存失败不丢弃已生成的结果, 仍然发布给客户端
+                        job.error = f"保存结果失败: {e}"
+                job.results.extend(batch)
+                job.notify()
+
+        async def worker() -> None:
+            nonlocal next_start
+            for index in indexes:
+                # 按任务的速率上限均匀发起请求
+                if interval:
+                    delay = next_start - time.monotonic()
+                    next_start = max(next_start, time.monotonic()) + interval
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                result = await self._execute(job, index)
+                pending.append(result)
+                job.completed += 1
+                job.failures += 0 if result.ok else 1
+                job.notify()
+                if len(pending) >= settings.BATCH_WRITE_SIZE:
+                    await flush()
+
+        final_status = "completed"
+        try:
+            await asyncio.gather(*(worker() for _ in range(job.concurrency)))
+        except asyncio.CancelledError:
+            final_status = "cancelled"
+        except Exception as e:
+            final_status = "failed"
+            job.error = str(e)
+        finally:
+            # 剩余结果写入后才标记结束, 跟随方读到done时结果已完整
+            await asyncio.shield(flush())
+            job.status = final_status
+            job.finished_at = datetime.now(timezone.utc)
+            job.notify()
+
+    async def _execute(self, job: BatchJob, index: int) -> BatchResult:
+        """执行单条提示, 失败时记录错误而不中断整个任务"""
+        item = job.items[index]
+        messages = []
+        if item.system:
+            messages.append({"role": "system", "content": item.system})
+        messages.append({"role": "user", "content": item.message})
+        prompt_tokens = llm_service.token_counter.count_messages(messages, job.model)
+
+        # 以批量优先级排队, 交互式请求优先分发
+        ticket = scheduler.submit(
+            user_id=job.user_id,
+            tier=job.tier,
+            interactive=False,
+            cost=prompt_tokens
+        )
+        usage = ProviderUsage()
+        try:
+            async with ticket:
+                content = await llm_service.chat(
+                    messages=messages,
+                    model=job.model,
+                    stream=False,
+                    use_cache=job.use_cache,
+                    usage=usage
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return BatchResult(index=index, ok=False, error=str(e) or type(e).__name__)
+
+        return BatchResult(
+            index=index,
+            ok=True,
+            content=content,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=llm_service.estimate_tokens(content, job.model),
+            usage=usage if usage.reported else None
+        )
+
+    @staticmethod
+    async def _persist(job: BatchJob, results: List[BatchResult]) -> None:
+        """
+        把一批成功的结果保存为会话, 每批只提交一次
+
+        会话先批量插入取得ID, 再批量插入消息和使用记录; 使用独立的短会话, 写完即归还连接
+        """
+        succeeded = [result for result in results if result.ok]
+        if not succeeded:
+            return
+
+        async with AsyncSessionLocal() as db:
+            messages = []
+            for result in succeeded:
+                item = job.items[result.index]
+                conversation_messages = []
+                if item.system:
+                    conversation_messages.append(Message(
+                        role="system",
+                        content=item.system,
+                        tokens=llm_service.estimate_tokens(item.system, job.model)
+                    ))
+                conversation_messages.append(Message(
+                    role="user",
+                    content=item.message,
+                    tokens=llm_service.estimate_tokens(item.message, job.model)
+                ))
+                conversation_messages.append(Message(
+                    role="assistant",
+                    content=result.content,
+                    tokens=result.completion_tokens
+                ))
+                messages.append(conversation_messages)
+
+            # 新会话直接写入统计值
+            conversations = [
+                Conversation(
+                    user_id=job.user_id,
+                    title=job.items[result.index].message[:30],
+                    model=job.model,
+                    message_count=len(conversation_messages),
+                    total_tokens=sum(m.tokens for m in conversation_messages),
+                    last_message_at=func.now(),
+                    last_message_preview=ChatService.message_preview(conversation_messages[-1].content)
+                )
+                for result, conversation_messages in zip(succeeded, messages)
+            ]
+            db.add_all(conversations)
+            await db.flush()
+
+            rows = []
+            for conversation, result, conversation_messages in zip(conversations, succeeded, messages):
+                for message in conversation_messages:
+                    message.conversation_id = conversation.id
+                rows.extend(conversation_messages)
+                usage_row = ApiUsage(
+                    user_id=job.user_id,
+                    model=job.model,
+                    tokens=result.completion_tokens,
+                    cost=ChatService._calculate_cost(job.model, result.completion_tokens)
+                )
+                # 与聊天路径一致: 提供商未报告用量时这些列留空, 不记为0
+                if result.usage is not None:
+                    usage_row.prompt_tokens = result.usage.input_tokens
+                    usage_row.cache_read_tokens = result.usage.cache_read_tokens
+                    usage_row.cache_write_tokens = result.usage.cache_write_tokens
+                rows.append(usage_row)
+            db.add_all(rows)
+            await db.execute(ChatService.conversation_count_statement(job.user_id, len(conversations)))
+            await db.commit()
+
+            for conversation, result in zip(conversations, succeeded):
+                result.conversation_id = conversation.id
+
+
+# 创建全局实例
+batch_service = BatchService()
@@ -2,12 +2,22 @@
 聊天服务
 处理对话相关的业务逻辑
 """
-from typing import List, AsyncGenerator
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import List, AsyncGenerator, Optional, Sequence, Tuple
+from sqlalchemy import Update, func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
-from ..models import User, Conversation, Message, ApiUsage
+from ..models import User, Conversation, Message
 from ..schemas import ChatRequest
+from ..utils.pagination import cursor_boundary
 from .llm_service import llm_service
+from .context_builder import ContextWindow, context_builder
+from .prompt_cache import ProviderUsage
+from .scheduler import ScheduledStream, scheduler
+from .write_behind import write_behind
+
+# 会话列表中最后一条消息摘要的长度
+PREVIEW_LENGTH = 100
 
 
 class ChatService:
@@ -15,10 +25,10 @@ class ChatService:
 
     @staticmethod
     async def send_message(
-        db: Session,
+        db: AsyncSession,
         user: User,
         chat_request: ChatRequest
-    ) -> tuple[Conversation, Message, str | AsyncGenerator[str, None]]:
+    ) -> tuple[Conversation, Message, str | AsyncGenerator[str, None], ContextWindow, ProviderUsage]:
         """
         发送消息并获取回复
 
@@ -28,17 +38,20 @@ class ChatService:
             chat_request: 聊天请求
 
         Returns:
-            tuple: (会话, 用户消息, AI回复或流)
+            tuple: (会话, 用户消息, AI回复或流, 上下文窗口, 提供商用量)
+                流式请求的用量在流结束后才完整
 
         Raises:
             HTTPException: 如果会话不存在或不属于当前用户
         """
         # 获取或创建会话
         if chat_request.conversation_id:
-            conversation = db.query(Conversation).filter(
-                Conversation.id == chat_request.conversation_id,
-                Conversation.user_id == user.id
-            ).first()
+            conversation = await db.scalar(
+                select(Conversation).where(
+                    Conversation.id == chat_request.conversation_id,
+                    Conversation.user_id == user.id
+                )
+            )
             if not conversation:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -52,39 +65,65 @@ class ChatService:
                 model=chat_request.model
             )
             db.add(conversation)
-            db.commit()
-            db.refresh(conversation)
+            await db.flush()
+            await db.execute(ChatService.conversation_count_statement(user.id, 1))
 
-        # 保存用户消息
+        # 保存用户消息, 与会话统计在同一事务中提交
         user_message = Message(
             conversation_id=conversation.id,
             role="user",
             content=chat_request.message,
-            tokens=llm_service.estimate_tokens(chat_request.message)
+            tokens=llm_service.estimate_tokens(chat_request.message, chat_request.model)
         )
         db.add(user_message)
-        db.commit()
-        db.refresh(user_message)
+        await db.flush()
+        await db.execute(ChatService.message_counter_statement(conversation.id, [user_message]))
+        await db.commit()
+        if not chat_request.conversation_id:
+            await db.refresh(conversation)
+        await db.refresh(user_message)
+
+        # 按Token预算组装历史消息
+        context = await ChatService._get_conversation_messages(db, conversation.id, chat_request.model)
+        # 结束只读事务归还连接, 等待模型回复期间不占用连接池
+        await db.commit()
+
+        # 按用户公平排队后调用LLM获取回复, 流式请求在开始迭代时才等待分发
+        ticket = scheduler.submit(
+            user_id=user.id,
+            tier=user.tier,
+            interactive=chat_request.stream,
+            cost=context.used_tokens
+        )
 
-        # 获取历史消息
-        messages = ChatService._get_conversation_messages(db, conversation.id)
+        usage = ProviderUsage()
 
-        # 调用LLM获取回复
-        response = await llm_service.chat(
-            messages=messages,
-            model=chat_request.model,
-            stream=chat_request.stream
-        )
+        async def generate():
+            return await llm_service.chat(
+                messages=context.messages,
+                model=chat_request.model,
+                stream=chat_request.stream,
+                use_cache=chat_request.use_cache,
+                usage=usage
+            )
 
-        return conversation, user_message, response
+        if chat_request.stream:
+            response = ScheduledStream(ticket, generate)
+        else:
+            async with ticket:
+                response = await generate()
+
+        return conversation, user_message, response, context, usage
 
     @staticmethod
     async def save_assistant_message(
-        db: Session,
+        db: AsyncSession,
         conversation_id: int,
         content: str,
         model: str,
-        user_id: int
+        user_id: int,
+        tokens: Optional[int] = None,
+        usage: Optional[ProviderUsage] = None
     ) -> Message:
         """
         保存AI回复消息
@@ -95,13 +134,16 @@ class ChatService:
             content: 消息内容
             model: 模型名称
             user_id: 用户ID
+            tokens: 已统计的Token数量(流式响应中增量计数), 为None时重新计数
+            usage: 提供商报告的用量, 记录提示词和缓存读写Token数
 
         Returns:
             Message: 保存的消息
         """
-        tokens = llm_service.estimate_tokens(content)
+        if tokens is None:
+            tokens = llm_service.estimate_tokens(content, model)
 
-        # 保存助手消息
+        # 保存助手消息和会话统计, 只等待这一次提交
         assistant_message = Message(
             conversation_id=conversation_id,
             role="assistant",
@@ -109,53 +151,46 @@ class ChatService:
             tokens=tokens
         )
         db.add(assistant_message)
+        await db.flush()
+        await db.execute(ChatService.message_counter_statement(conversation_id, [assistant_message]))
+        await db.commit()
+        await db.refresh(assistant_message)
 
-        # 记录API使用情况
-        api_usage = ApiUsage(
+        # 记录API使用情况, 由后台批量写入
+        usage_values = dict(
             user_id=user_id,
             model=model,
             tokens=tokens,
             cost=ChatService._calculate_cost(model, tokens)
         )
-        db.add(api_usage)
+        if usage is not None and usage.reported:
+            usage_values.update(
+                prompt_tokens=usage.input_tokens,
+                cache_read_tokens=usage.cache_read_tokens,
+                cache_write_tokens=usage.cache_write_tokens
+            )
+        await write_behind.add_usage(**usage_values)
+
+        # 更新会话标题(如果是第一条消息), 由后台执行
+        await write_behind.update_title(conversation_id)
 
-        # 更新会话标题(如果是第一条消息)
-        conversation = db.query(Conversation).filter(
-            Conversation.id == conversation_id
-        ).first()
-        if conversation and conversation.title == "新对话":
-            # 使用用户第一条消息作为标题(截取前30个字符)
-            first_user_message = db.query(Message).filter(
-                Message.conversation_id == conversation_id,
-                Message.role == "user"
-            ).first()
-            if first_user_message:
-                conversation.title = first_user_message.content[:30]
-
-        db.commit()
-        db.refresh(assistant_message)
         return assistant_message
 
     @staticmethod
-    def _get_conversation_messages(db: Session, conversation_id: int) -> List[dict]:
+    async def _get_conversation_messages(db: AsyncSession, conversation_id: int, model: str) -> ContextWindow:
         """
         获取会话的历史消息
+        只取模型Token预算内能放下的最近消息, 系统提示总是保留
 
         Args:
             db: 数据库会话
             conversation_id: 会话ID
+            model: 模型名称
 
         Returns:
-            List[dict]: 消息列表
+            ContextWindow: 组装好的消息列表及窗口信息
         """
-        messages = db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).order_by(Message.created_at.asc()).all()
-
-        return [
-            {"role": msg.role, "content": msg.content}
-            for msg in messages
-        ]
+        return await context_builder.build(db, conversation_id, model)
 
     @staticmethod
     def _calculate_cost(model: str, tokens: int) -> float:
@@ -177,6 +212,8 @@ class ChatService:
             "claude-3-opus": 0.015,
             "claude-3-sonnet": 0.003,
             "claude-3-haiku": 0.00025,
+            "deepseek-chat": 0.0002,
+            "deepseek-reasoner": 0.0005,
         }
 
         base_model = model.split("-")[0:2]
@@ -186,38 +223,121 @@ class ChatService:
         return (tokens / 1000) * price
 
     @staticmethod
-    def get_conversation_messages(
-        db: Session,
+    def message_preview(content: str) -> str:
+        """
+        生成会话列表中显示的消息摘要(合并空白后截取)
+
+        Args:
+            content: 消息内容
+
+        Returns:
+            str: 消息摘要
+        """
+        return " ".join(content.split())[:PREVIEW_LENGTH]
+
+    @staticmethod
+    def message_counter_statement(conversation_id: int, messages: Sequence[Message]) -> Update:
+        """
+        新消息写入后更新会话统计的语句, 须与消息插入在同一事务中执行
+
+        计数用列自增表达式, 并发写入同一会话时不会丢失更新; updated_at随之刷新,
+        有新消息的会话排到列表前面
+
+        Args:
+            conversation_id: 会话ID
+            messages: 本次写入的消息(按时间顺序)
+
+        Returns:
+            Update: UPDATE语句
+        """
+        return update(Conversation).where(
+            Conversation.id == conversation_id
+        ).values(
+            message_count=Conversation.message_count + len(messages),
+            total_tokens=Conversation.total_tokens + sum(m.tokens or 0 for m in messages),
+            last_message_at=func.now(),
+            last_message_preview=ChatService.message_preview(messages[-1].content)
+        ).execution_options(synchronize_session=False)
+
+    @staticmethod
+    def conversation_count_statement(user_id: int, delta: int) -> Update:
+        """
+        会话创建或删除后更新用户会话数的语句, 须与会话写入在同一事务中执行
+
+        Args:
+            user_id: 用户ID
+            delta: 会话数变化量
+
+        Returns:
+            Update: UPDATE语句
+        """
+        return update(User).where(
+            User.id == user_id
+        ).values(
+            conversation_count=User.conversation_count + delta
+        ).execution_options(synchronize_session=False)
+
+    @staticmethod
+    async def get_conversation_messages(
+        db: AsyncSession,
         user: User,
-        conversation_id: int
-    ) -> List[Message]:
+        conversation_id: int,
+        limit: Optional[int] = None,
+        before: Optional[Tuple[datetime, int]] = None,
+        after: Optional[Tuple[datetime, int]] = None
+    ) -> Tuple[List[Message], bool]:
         """
-        获取会话的所有消息
+        获取会话的一页消息(按时间正序)
+
+        按(created_at, id)键集分页: 默认取最近的limit条, before取游标之前的,
+        after取游标之后的
 
         Args:
             db: 数据库会话
             user: 当前用户
             conversation_id: 会话ID
+            limit: 返回的记录数, 为None时返回全部
+            before: 游标消息的(created_at, id), 取更早的消息
+            after: 游标消息的(created_at, id), 取更新的消息
 
         Returns:
-            List[Message]: 消息列表
+            Tuple[List[Message], bool]: 消息列表, 以及翻页方向上是否还有更多消息
 
         Raises:
             HTTPException: 如果会话不存在或不属于当前用户
         """
         # 验证会话所有权
-        conversation = db.query(Conversation).filter(
-            Conversation.id == conversation_id,
-            Conversation.user_id == user.id
-        ).first()
+        conversation = await db.scalar(
+            select(Conversation).where(
+                Conversation.id == conversation_id,
+                Conversation.user_id == user.id
+            )
+        )
         if not conversation:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="会话不存在"
             )
 
-        messages = db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).order_by(Message.created_at.asc()).all()
+        key = tuple_(Message.created_at, Message.id)
+        query = select(Message).where(Message.conversation_id == conversation_id)
+        forward = after is not None
+        cursor = after if forward else before
+        if cursor is not None:
+            boundary = cursor_boundary(*cursor)
+            query = query.where(key > boundary if forward else key < boundary)
 
-        return messages
+        if forward:
+            query = query.order_by(Message.created_at.asc(), Message.id.asc())
+        else:
+            query = query.order_by(Message.created_at.desc(), Message.id.desc())
+        if limit is not None:
+            # 多取一条判断是否还有更多
+            query = query.limit(limit + 1)
+
+        messages = list(await db.scalars(query))
+        has_more = limit is not None and len(messages) > limit
+        messages = messages[:limit]
+        if not forward:
+            messages.reverse()
+        return messages, has_more
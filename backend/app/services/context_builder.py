@@ -0,0 +1,227 @@
+"""
+上下文组装
+按模型的Token预算从数据库中倒序取出历史消息, 保留系统提示和最近的轮次,
+放不下的较早消息直接丢弃; 最新的用户消息总是保留, 必要时截断
+"""
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..config import settings
+from ..models import Message
+from .token_counter import (
+    MESSAGE_OVERHEAD_TOKENS,
+    REPLY_PRIMING_TOKENS,
+    TokenCounter,
+    token_counter
+)
+
+# 模型前缀 -> 上下文窗口大小(按顺序匹配, 更具体的前缀在前)
+MODEL_CONTEXT_WINDOWS: List[Tuple[str, int]] = [
+    ("gpt-4o", 128000),
+    ("gpt-4-turbo", 128000),
+    ("gpt-4-32k", 32768),
+    ("gpt-4", 8192),
+    ("gpt-3.5", 16385),
+    ("claude", 200000),
+    ("deepseek", 64000),
+]
+DEFAULT_CONTEXT_WINDOW = 8192
+
+ELISION_MARKER = "\n\n...[内容过长, 中间部分已省略]...\n\n"
+
+
+@dataclass
+class ContextWindow:
+    """组装结果"""
+    messages: List[Dict[str, str]]
+    budget_tokens: int
+    used_tokens: int
+    truncated: bool = False  # 是否有更早的消息未发送
+    elided: bool = False  # 是否有消息被截断
+    message_ids: List[int] = field(default_factory=list)
+
+    def info(self) -> dict:
+        """返回给客户端的窗口信息"""
+        return {
+            "budget_tokens": self.budget_tokens,
+            "used_tokens": self.used_tokens,
+            "included_messages": len(self.messages),
+            "truncated": self.truncated,
+            "elided": self.elided,
+            "oldest_message_id": self.message_ids[0] if self.message_ids else None
+        }
+
+
+class ContextBuilder:
+    """上下文组装服务类"""
+
+    def __init__(self, counter: TokenCounter = token_counter):
+        self.counter = counter
+
+    @staticmethod
+    def context_window_for_model(model: str) -> int:
+        """
+        获取模型的上下文窗口大小
+
+        Args:
+            model: 模型名称
+
+        Returns:
+            int: 上下文窗口Token数
+        """
+        for prefix, window in MODEL_CONTEXT_WINDOWS:
+            if model.startswith(prefix):
+                return window
+        return DEFAULT_CONTEXT_WINDOW
+
+    @classmethod
+    def budget_for_model(cls, model: str) -> int:
+        """
+        计算历史消息可用的Token预算
+
+        预算 = 上下文窗口 - 预留的输出Token, 再受CONTEXT_MAX_TOKENS上限约束
+
+        Args:
+            model: 模型名称
+
+        Returns:
+            int: Token预算
+        """
+        budget = cls.context_window_for_model(model) - settings.CONTEXT_OUTPUT_RESERVE_TOKENS
+        if settings.CONTEXT_MAX_TOKENS > 0:
+            budget = min(budget, settings.CONTEXT_MAX_TOKENS)
+        return max(budget, 1)
+
+    def _message_tokens(self, msg: Message, model: str) -> int:
+        """消息的Token数, 优先使用写入时已统计的值"""
+        tokens = msg.tokens or self.counter.count(msg.content, model)
+        return tokens + MESSAGE_OVERHEAD_TOKENS
+
+    def _elide(self, content: str, model: str, available: int) -> Tuple[str, int]:
+        """
+        保留首尾、省略中间部分, 使内容不超过可用预算
+        按比例估算几轮后仍放不下时, 改为只保留能放下的最长开头部分
+
+        Returns:
+            Tuple[str, int]: (截断后的内容, Token数)
+        """
+        original = content
+        tokens = self.counter.count(content, model)
+        for _ in range(3):
+            if tokens <= available:
+                break
+            keep = max(0, int(len(content) * available / tokens / 2) - len(ELISION_MARKER))
+            if keep == 0:
+                content = ELISION_MARKER.strip()
+            else:
+                content = content[:keep] + ELISION_MARKER + content[-keep:]
+            tokens = self.counter.count(content, model)
+        if tokens <= available:
+            return content, tokens
+
+        # 硬截断: 二分查找不超过预算的最长前缀, 空串总能放下
+        low, high = 0, len(original)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.counter.count(original[:middle], model, memoize=False) <= available:
+                low = middle
+            else:
+                high = middle - 1
+        content = original[:low]
+        return content, self.counter.count(content, model, memoize=False)
+
+    async def build(self, db: AsyncSession, conversation_id: int, model: str) -> ContextWindow:
+        """
+        组装发送给模型的消息列表
+
+        Args:
+            db: 数据库会话
+            conversation_id: 会话ID
+            model: 模型名称
+
+        Returns:
+            ContextWindow: 组装结果
+
+        Raises:
+            HTTPException: 系统提示占满预算, 最新的用户消息截断后也放不下
+        """
+        budget = self.budget_for_model(model)
+        used = REPLY_PRIMING_TOKENS
+
+        # 系统提示总是保留
+        system_rows = (await db.scalars(
+            select(Message).where(
+                Message.conversation_id == conversation_id,
+                Message.role == "system"
+            ).order_by(Message.created_at.asc(), Message.id.asc())
+        )).all()
+        for row in system_rows:
+            used += self._message_tokens(row, model)
+
+        # 只取需要的行: 最新的在前, 带上限
+        limit = settings.CONTEXT_MAX_HISTORY_MESSAGES
+        rows = (await db.scalars(
+            select(Message).where(
+                Message.conversation_id == conversation_id,
+                Message.role != "system"
+            ).order_by(
+                Message.created_at.desc(), Message.id.desc()
+            ).limit(limit + 1)
+        )).all()
+
+        truncated = len(rows) > limit
+        rows = rows[:limit]
+        # 最新的用户消息就是本次提问, 不能丢弃
+        latest_user = next((index for index, row in enumerate(rows) if row.role == "user"), None)
+
+        selected: List[Tuple[Message, str, int]] = []
+        for index, row in enumerate(rows):
+            tokens = self._message_tokens(row, model)
+            if used + tokens <= budget:
+                selected.append((row, row.content, tokens))
+                used += tokens
+                continue
+
+            # 最近的几条必须保留, 放不下时截断中间部分
+            if index < settings.CONTEXT_MIN_RECENT_MESSAGES or index == latest_user:
+                available = budget - used - MESSAGE_OVERHEAD_TOKENS
+                content, content_tokens = "", 0
+                if available > 0:
+                    content, content_tokens = self._elide(row.content, model, available)
+                # 截到一个字符都放不下时不发送空消息
+                if content:
+                    tokens = content_tokens + MESSAGE_OVERHEAD_TOKENS
+                    selected.append((row, content, tokens))
+                    used += tokens
+            truncated = True
+            break
+
+        if latest_user is not None and latest_user >= len(selected):
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="上下文过长: 系统提示已占满模型的Token预算, 无法放入当前消息"
+            )
+
+        selected.reverse()
+        # 历史需从用户消息开始(Anthropic要求), 去掉开头孤立的助手回复
+        while selected and selected[0][0].role != "user":
+            used -= selected.pop(0)[2]
+            truncated = True
+
+        elided = any(content is not row.content for row, content, _ in selected)
+        ordered = [(row, row.content) for row in system_rows]
+        ordered += [(row, content) for row, content, _ in selected]
+        return ContextWindow(
+            messages=[{"role": row.role, "content": content} for row, content in ordered],
+            budget_tokens=budget,
+            used_tokens=used,
+            truncated=truncated,
+            elided=elided,
+            message_ids=[row.id for row, _, _ in selected]
+        )
+
+
+# 创建全局实例
+context_builder = ContextBuilder()
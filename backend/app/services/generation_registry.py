@@ -0,0 +1,427 @@
+"""
+进行中生成的登记表
+按(用户, 会话)登记流式生成, 停止请求据此取消上游请求并保存已生成的部分;
+多个uvicorn worker时停止请求通过Redis发布订阅广播到持有该生成的worker
+
+生成的事件缓存在本worker内存中, 断线重连需要回到同一个worker
+"""
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from typing import AsyncGenerator, Callable, Deque, Dict, List, Optional, Tuple
+from ..config import settings
+from ..utils.sse import encode_event
+
+
+class Generation:
+    """
+    一次进行中的流式生成
+
+    生成与HTTP连接解耦: 事件编号后写入有界的环形缓冲区, 每个连接都是订阅方,
+    断线重连时按Last-Event-ID回放缺失的事件, 再接上实时输出
+
+    一个生成只有一个上游流和一个发布任务, 任意多个订阅方(多个标签页/设备)
+    各自按游标读取共享的缓冲区: 发布从不等待订阅方, 读得慢的订阅方只会落后自己,
+    落后超过缓冲区时以快照追上
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        conversation_id: int,
+        buffer_size: int = 2000,
+        grace_seconds: float = 0.0
+    ):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.reason: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self._stopped = asyncio.Event()
+        self._grace_seconds = grace_seconds
+        self._grace_timer: Optional[asyncio.TimerHandle] = None
+        self._subscribers = 0
+        # (序号, 已编码的帧, 分块文本), 序号从1开始连续递增
+        self._events: Deque[Tuple[int, bytes, Optional[str]]] = deque(maxlen=max(1, buffer_size))
+        self._evicted_content: List[str] = []  # 已移出缓冲区的分块文本
+        self._seq = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def stop(self, reason: str = "stopped") -> None:
+        """标记停止, 正在guard中读取的流随即结束"""
+        if not self.stopped:
+            self.reason = reason
+            self._stopped.set()
+
+    async def guard(self, stream: AsyncGenerator) -> AsyncGenerator:
+        """
+        读取上游流, 停止时立即结束
+
+        停止时取消挂起的读取, 上游生成器在取消中执行清理(关闭提供商连接),
+        不需要等到下一个分块到达
+
+        Args:
+            stream: 上游流
+
+        Returns:
+            AsyncGenerator: 与上游相同的流, 停止后不再产出
+        """
+        if self.stopped:
+            return
+        stop_wait = asyncio.ensure_future(self._stopped.wait())
+        try:
+            while True:
+                next_item = asyncio.ensure_future(stream.__anext__())
+                await asyncio.wait((next_item, stop_wait), return_when=asyncio.FIRST_COMPLETED)
+                if not next_item.done():
+                    next_item.cancel()
+                    await asyncio.gather(next_item, return_exceptions=True)
+                    return
+                try:
+                    item = next_item.result()
+                except StopAsyncIteration:
+                    return
+                yield item
+        finally:
+            stop_wait.cancel()
+
+    def publish(self, data: dict) -> None:
+        """
+        发布一个事件, 编码一次后由所有订阅方共享
+
+        Args:
+            data: 事件数据, chunk事件的content会在移出缓冲区时留作快照
+        """
+        if len(self._events) == self._events.maxlen:
+            evicted = self._events[0][2]
+            if evicted:
+                self._evicted_content.append(evicted)
+        self._seq += 1
+        content = data.get("content") if data.get("type") == "chunk" else None
+        self._events.append((self._seq, encode_event(data, event_id=f"{self.id}:{self._seq}"), content))
+        self._notify()
+
+    def finish(self) -> None:
+        """生成结束, 订阅方读完缓冲区后退出"""
+        self.finished_at = time.monotonic()
+        if self._grace_timer is not None:
+            self._grace_timer.cancel()
+            self._grace_timer = None
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self, after: int = 0) -> AsyncGenerator[bytes, None]:
+        """
+        订阅事件流
+
+        先回放序号大于after的缓存事件, 再跟随实时输出, 生成结束后退出;
+        需要的事件已移出缓冲区时, 先发送一个snapshot事件, 包含此前的完整回复文本
+
+        最后一个订阅方断开后, 生成在宽限期内继续进行, 期间无人重连则按停止处理
+
+        Args:
+            after: 客户端已收到的最后一个事件序号
+
+        Returns:
+            AsyncGenerator: SSE帧
+        """
+        self._subscribers += 1
+        if self._grace_timer is not None:
+            self._grace_timer.cancel()
+            self._grace_timer = None
+        try:
+            next_seq = after + 1
+            while True:
+                while next_seq <= self._seq:
+                    first = self._events[0][0]
+                    if next_seq < first:
+                        yield encode_event(
+                            {"type": "snapshot", "content": "".join(self._evicted_content)},
+                            event_id=f"{self.id}:{first - 1}"
+                        )
+                        next_seq = first
+                        continue
+                    yield self._events[next_seq - first][1]
+                    next_seq += 1
+                if self.finished:
+                    return
+                await self._changed.wait()
+        finally:
+            self._subscribers -= 1
+            if self._subscribers == 0 and not self.finished:
+                if self._grace_seconds > 0:
+                    self._grace_timer = asyncio.get_running_loop().call_later(
+                        self._grace_seconds, self.stop, "disconnected"
+                    )
+                else:
+                    self.stop("disconnected")
+
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "conversation_id": self.conversation_id,
+            "subscribers": self._subscribers,
+            "elapsed_seconds": round(time.monotonic() - self.started_at, 1)
+        }
+
+
+class StopBroadcast:
+    """
+    停止请求广播基类
+
+    publish把停止请求发给其他worker, start后收到其他worker的请求时调用handler
+    """
+
+    async def start(self, handler: Callable[[int, Optional[int]], int]) -> None:
+        pass
+
+    async def publish(self, user_id: int, conversation_id: Optional[int]) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+
+class LocalBroadcast(StopBroadcast):
+    """单进程(默认), 不需要广播"""
+
+
+class RedisBroadcast(StopBroadcast):
+    """Redis发布订阅, 多个uvicorn worker之间转发停止请求"""
+
+    def __init__(self, url: str, channel: str = "llm:generation:stop"):
+        try:
+            from redis import asyncio as redis_asyncio
+        except ImportError:
+            raise RuntimeError("GENERATION_STOP_BACKEND=redis 需要安装redis包(pip install -r requirements.txt)")
+
+        self._url = url
+        self._redis = redis_asyncio.from_url(url)
+        self._channel = channel
+        self._origin = uuid.uuid4().hex  # 跳过本worker发出的消息
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, handler: Callable[[int, Optional[int]], int]) -> None:
+        # 启动时连接并订阅, 配置错误时直接启动失败, 而不是停止请求默默地只在本worker生效
+        try:
+            await self._redis.ping()
+            self._pubsub = self._redis.pubsub()
+            await self._pubsub.subscribe(self._channel)
+        except Exception as e:
+            raise RuntimeError(f"无法连接Redis停止请求广播 {self._url}: {e}") from e
+        self._listener = asyncio.create_task(self._listen(handler))
+
+    async def _listen(self, handler: Callable[[int, Optional[int]], int]) -> None:
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = json.loads(message["data"])
+                    if data.get("origin") != self._origin:
+                        handler(data["user_id"], data.get("conversation_id"))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 连接断开时稍后重试, 重连后redis客户端会自动重新订阅
+                await asyncio.sleep(1)
+
+    async def publish(self, user_id: int, conversation_id: Optional[int]) -> None:
+        await self._redis.publish(self._channel, json.dumps({
+            "origin": self._origin,
+            "user_id": user_id,
+            "conversation_id": conversation_id
+        }))
+
+    async def aclose(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        if self._pubsub is not None:
+            await self._pubsub.close()
+        await self._redis.close()
+
+
+class GenerationRegistry:
+    """进行中生成的登记表, 结束的生成保留一段时间供断线重连"""
+
+    def __init__(
+        self,
+        broadcast: StopBroadcast,
+        buffer_size: int = 2000,
+        grace_seconds: float = 0.0,
+        ttl_seconds: float = 300.0
+    ):
+        self._broadcast = broadcast
+        self._buffer_size = buffer_size
+        self._grace_seconds = grace_seconds
+        self._ttl_seconds = ttl_seconds
+        # 生成ID -> 生成, 同一会话可能在多个标签页同时生成
+        self._generations: Dict[str, Generation] = {}
+
+    async def start(self) -> None:
+        """开始接收其他worker的停止请求"""
+        await self._broadcast.start(self.stop_local)
+
+    async def aclose(self) -> None:
+        await self._broadcast.aclose()
+
+    def register(self, user_id: int, conversation_id: int) -> Generation:
+        """
+        登记一次生成
+
+        Args:
+            user_id: 用户ID
+            conversation_id: 会话ID
+
+        Returns:
+            Generation: 生成句柄, 结束后需调用unregister
+        """
+        self._purge_expired()
+        generation = Generation(
+            user_id,
+            conversation_id,
+            buffer_size=self._buffer_size,
+            grace_seconds=self._grace_seconds
+        )
+        self._generations[generation.id] = generation
+        return generation
+
+    def unregister(self, generation: Generation) -> None:
+        """标记生成结束, 保留到过期后移除"""
+        generation.finish()
+        if self._ttl_seconds <= 0:
+            self._generations.pop(generation.id, None)
+
+    def get(self, user_id: int, generation_id: str) -> Optional[Generation]:
+        """
+        查找生成(含已结束未过期的)
+
+        Args:
+            user_id: 用户ID
+            generation_id: 生成ID
+
+        Returns:
+            Optional[Generation]: 不存在、已过期或不属于该用户时为None
+        """
+        self._purge_expired()
+        generation = self._generations.get(generation_id)
+        if generation is None or generation.user_id != user_id:
+            return None
+        return generation
+
+    def active(self, user_id: int, conversation_id: int) -> Optional[Generation]:
+        """
+        查找会话中进行中的生成, 有多个时取最近开始的
+
+        Args:
+            user_id: 用户ID
+            conversation_id: 会话ID
+
+        Returns:
+            Optional[Generation]: 没有进行中的生成时为None
+        """
+        candidates = [
+            generation for generation in self._generations.values()
+            if generation.user_id == user_id
+            and generation.conversation_id == conversation_id
+            and not generation.finished
+        ]
+        return max(candidates, key=lambda generation: generation.started_at, default=None)
+
+    def _purge_expired(self) -> None:
+        """移除结束超过保留时间的生成"""
+        deadline = time.monotonic() - self._ttl_seconds
+        expired = [
+            generation_id for generation_id, generation in self._generations.items()
+            if generation.finished and generation.finished_at < deadline
+        ]
+        for generation_id in expired:
+            del self._generations[generation_id]
+
+    def stop_local(self, user_id: int, conversation_id: Optional[int] = None) -> int:
+        """
+        停止本worker上的生成
+
+        Args:
+            user_id: 用户ID
+            conversation_id: 会话ID, 为None时停止该用户的所有生成
+
+        Returns:
+            int: 停止的生成数
+        """
+        stopped = 0
+        for generation in list(self._generations.values()):
+            if generation.user_id != user_id or generation.finished or generation.stopped:
+                continue
+            if conversation_id is not None and generation.conversation_id != conversation_id:
+                continue
+            generation.stop()
+            stopped += 1
+        return stopped
+
+    async def stop(self, user_id: int, conversation_id: Optional[int] = None) -> int:
+        """
+        停止生成, 同时通知其他worker
+
+        Args:
+            user_id: 用户ID
+            conversation_id: 会话ID, 为None时停止该用户的所有生成
+
+        Returns:
+            int: 本worker上停止的生成数
+        """
+        stopped = self.stop_local(user_id, conversation_id)
+        await self._broadcast.publish(user_id, conversation_id)
+        return stopped
+
+    def user_generations(self, user_id: int) -> List[dict]:
+        """本worker上该用户进行中的生成"""
+        return [
+            generation.info()
+            for generation in self._generations.values()
+            if generation.user_id == user_id and not generation.finished
+        ]
+
+
+def build_broadcast(name: str) -> StopBroadcast:
+    """
+    根据配置名称创建停止请求广播
+
+    Args:
+        name: memory 或 redis
+
+    Returns:
+        StopBroadcast: 停止请求广播
+    """
+    if name == "memory":
+        return LocalBroadcast()
+    elif name == "redis":
+        return RedisBroadcast(settings.REDIS_URL)
+    else:
+        raise ValueError(f"不支持的停止请求广播后端: {name}")
+
+
+# 创建全局实例
+generation_registry = GenerationRegistry(
+    broadcast=build_broadcast(settings.GENERATION_STOP_BACKEND),
+    buffer_size=settings.SSE_REPLAY_BUFFER_EVENTS,
+    grace_seconds=settings.SSE_RESUME_GRACE_SECONDS,
+    ttl_seconds=settings.SSE_RESUME_TTL_SECONDS
+)
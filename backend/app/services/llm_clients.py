@@ -0,0 +1,266 @@
+"""
+LLM客户端池
+所有提供商的异步客户端共享同一个长连接httpx连接池,
+TLS握手和建连成本在每个worker进程内只付一次
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import httpx
+from openai import AsyncOpenAI
+from anthropic import AsyncAnthropic
+from ..config import settings
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:  # pragma: no cover - 未安装httpx[http2]时退回HTTP/1.1
+    HTTP2_AVAILABLE = False
+
+
+class _ReleasingByteStream(httpx.AsyncByteStream):
+    """响应体读取完毕或关闭时释放主机并发配额"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, semaphore: asyncio.Semaphore):
+        self._stream = stream
+        self._semaphore = semaphore
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._semaphore.release()
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    按主机限制并发的传输层
+
+    httpx.Limits只能限制连接池总量, 这里为每个主机加一个信号量,
+    防止单个提供商占满整个连接池。流式响应在关闭时才归还配额。
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_per_host: int):
+        self._transport = transport
+        self._max_per_host = max_per_host
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _semaphore_for(self, host: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._max_per_host)
+            self._semaphores[host] = semaphore
+        return semaphore
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self._max_per_host <= 0:
+            return await self._transport.handle_async_request(request)
+
+        semaphore = self._semaphore_for(request.url.host)
+        pool_timeout = request.extensions.get("timeout", {}).get("pool")
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=pool_timeout)
+        except asyncio.TimeoutError:
+            raise httpx.PoolTimeout(
+                f"等待主机 {request.url.host} 的连接配额超时", request=request
+            )
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingByteStream(response.stream, semaphore),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+@dataclass
+class CompatibleProvider:
+    """OpenAI兼容接口的提供商"""
+    name: str
+    base_url: str
+    api_key: str = ""
+    model_prefixes: List[str] = field(default_factory=list)
+    api_key_required: bool = False  # 本地推理服务通常不需要密钥
+
+    def matches(self, model: str) -> bool:
+        """模型是否路由到该提供商"""
+        if model.startswith(f"{self.name}/"):
+            return True
+        return any(model.startswith(prefix) for prefix in self.model_prefixes)
+
+    def upstream_model(self, model: str) -> str:
+        """去掉路由用的 "<名称>/" 前缀, 得到上游的模型名"""
+        prefix = f"{self.name}/"
+        return model[len(prefix):] if model.startswith(prefix) else model
+
+
+# 内置提供商名称, 兼容提供商不能与之重名
+RESERVED_PROVIDER_NAMES = ("openai", "anthropic", "mock")
+
+
+def load_compatible_providers() -> Dict[str, CompatibleProvider]:
+    """
+    根据配置加载OpenAI兼容提供商, DeepSeek总是注册
+
+    Returns:
+        Dict[str, CompatibleProvider]: 名称 -> 提供商
+
+    Raises:
+        ValueError: 提供商名称与内置提供商冲突
+    """
+    providers = {
+        "deepseek": CompatibleProvider(
+            name="deepseek",
+            base_url=settings.DEEPSEEK_BASE_URL,
+            api_key=settings.DEEPSEEK_API_KEY,
+            model_prefixes=["deepseek"],
+            api_key_required=True,
+        )
+    }
+    for name, spec in settings.OPENAI_COMPATIBLE_PROVIDERS.items():
+        if name in RESERVED_PROVIDER_NAMES:
+            raise ValueError(f"OpenAI兼容提供商不能使用保留名称: {name}")
+        providers[name] = CompatibleProvider(name=name, **spec)
+    return providers
+
+
+def build_timeout() -> httpx.Timeout:
+    """根据配置构建httpx超时"""
+    return httpx.Timeout(
+        connect=settings.LLM_HTTP_CONNECT_TIMEOUT,
+        read=settings.LLM_HTTP_READ_TIMEOUT,
+        write=settings.LLM_HTTP_WRITE_TIMEOUT,
+        pool=settings.LLM_HTTP_POOL_TIMEOUT,
+    )
+
+
+class LLMClientPool:
+    """LLM客户端池类"""
+
+    def __init__(self, compatible_providers: Optional[Dict[str, CompatibleProvider]] = None):
+        """
+        延迟创建, 第一次使用时才建立连接池
+
+        Args:
+            compatible_providers: OpenAI兼容提供商, 默认从配置加载
+        """
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._clients: Dict[str, object] = {}
+        self.compatible_providers = (
+            compatible_providers if compatible_providers is not None else load_compatible_providers()
+        )
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """共享的httpx异步客户端"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = self._build_http_client()
+            self._clients.clear()
+        return self._http_client
+
+    @staticmethod
+    def _build_http_client() -> httpx.AsyncClient:
+        """构建带连接池限制的httpx客户端"""
+        limits = httpx.Limits(
+            max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+        )
+        transport = HostLimitedTransport(
+            httpx.AsyncHTTPTransport(
+                limits=limits,
+                http2=settings.LLM_HTTP2 and HTTP2_AVAILABLE,
+            ),
+            max_per_host=settings.LLM_HTTP_MAX_CONNECTIONS_PER_HOST,
+        )
+        return httpx.AsyncClient(transport=transport, timeout=build_timeout())
+
+    @property
+    def openai(self) -> Optional[AsyncOpenAI]:
+        """OpenAI异步客户端, 未配置密钥时为None"""
+        if not settings.OPENAI_API_KEY:
+            return None
+        http_client = self.http_client
+        client = self._clients.get("openai")
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                http_client=http_client,
+                timeout=build_timeout(),
+                max_retries=settings.LLM_MAX_RETRIES,
+            )
+            self._clients["openai"] = client
+        return client
+
+    @property
+    def anthropic(self) -> Optional[AsyncAnthropic]:
+        """Anthropic异步客户端, 未配置密钥时为None"""
+        if not settings.ANTHROPIC_API_KEY:
+            return None
+        http_client = self.http_client
+        client = self._clients.get("anthropic")
+        if client is None:
+            client = AsyncAnthropic(
+                api_key=settings.ANTHROPIC_API_KEY,
+                base_url=settings.ANTHROPIC_BASE_URL or None,
+                http_client=http_client,
+                timeout=build_timeout(),
+                max_retries=settings.LLM_MAX_RETRIES,
+            )
+            self._clients["anthropic"] = client
+        return client
+
+    def compatible(self, name: str) -> Optional[AsyncOpenAI]:
+        """
+        OpenAI兼容提供商的异步客户端, 与其他提供商共享连接池
+
+        Args:
+            name: 提供商名称
+
+        Returns:
+            Optional[AsyncOpenAI]: 客户端, 需要密钥但未配置时为None
+        """
+        provider = self.compatible_providers[name]
+        if provider.api_key_required and not provider.api_key:
+            return None
+        http_client = self.http_client
+        key = f"compatible:{name}"
+        client = self._clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                # SDK要求非空密钥, 无需认证的本地服务使用占位值
+                api_key=provider.api_key or "EMPTY",
+                base_url=provider.base_url,
+                http_client=http_client,
+                timeout=build_timeout(),
+                max_retries=settings.LLM_MAX_RETRIES,
+            )
+            self._clients[key] = client
+        return client
+
+    async def aclose(self) -> None:
+        """关闭连接池(应用关闭时调用)"""
+        self._clients.clear()
+        if self._http_client is not None and not self._http_client.is_closed:
+            await self._http_client.aclose()
+        self._http_client = None
+
+
+# 创建全局实例
+llm_client_pool = LLMClientPool()
@@ -0,0 +1,407 @@
+"""
+LLM路由
+在提供商调用外层实现熔断、故障转移和对冲请求:
+首个token超过截止时间仍未到达时, 再发起一个对冲请求, 先产出的胜出, 另一个取消
+"""
+import asyncio
+import time
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+from ..config import settings
+from ..utils.metrics import LatencyTracker, to_ms
+from .rate_limiter import RateLimitExceededError
+
+# 提供商调用: (messages, model, stream) -> 回复或流
+ProviderCall = Callable[[List[Dict[str, str]], str, bool], Awaitable[str | AsyncGenerator[str, None]]]
+
+
+class ProviderUnavailableError(RuntimeError):
+    """提供商熔断中或所有候选模型都失败"""
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败达到阈值后打开, 冷却期内拒绝请求;
+    冷却期结束后进入半开状态, 放行一个试探请求, 成功则关闭
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        """当前是否可以放行请求(只读, 不占用半开试探名额)"""
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._probing)
+
+    def allow(self) -> bool:
+        """申请发起请求, 半开状态下占用唯一的试探名额; 须在实际发起请求前调用"""
+        if not self.available():
+            return False
+        if self.state == "half_open":
+            self._probing = True
+        return True
+
+    def release(self) -> None:
+        """归还试探名额: 试探请求未得出成功或失败的结论(取消、本地限流、提前关闭)"""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class ProviderStats:
+    """单个提供商的路由状态"""
+
+    def __init__(self):
+        self.first_token = LatencyTracker(settings.LLM_LATENCY_WINDOW)
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.LLM_BREAKER_FAILURE_THRESHOLD,
+            cooldown_seconds=settings.LLM_BREAKER_COOLDOWN_SECONDS
+        )
+        self.requests = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "breaker": self.breaker.state,
+            "first_token_ms": {
+                "samples": len(self.first_token),
+                "p50": to_ms(self.first_token.percentile(50)),
+                "p95": to_ms(self.first_token.percentile(95)),
+                "p99": to_ms(self.first_token.percentile(99))
+            }
+        }
+
+
+class LLMRouter:
+    """LLM路由类"""
+
+    def __init__(
+        self,
+        provider_for_model: Callable[[str], str],
+        mode: str = "direct",
+        fallback_models: Optional[Dict[str, str]] = None
+    ):
+        """
+        初始化路由
+
+        Args:
+            provider_for_model: 模型名称 -> 提供商名称
+            mode: direct(直连) / failover(故障转移) / hedged(故障转移+对冲请求)
+            fallback_models: 模型 -> 等价的备用模型
+        """
+        self.provider_for_model = provider_for_model
+        self.mode = mode
+        self.fallback_models = fallback_models or {}
+        self._providers: Dict[str, ProviderStats] = {}
+
+    def _stats(self, model: str) -> ProviderStats:
+        provider = self.provider_for_model(model)
+        stats = self._providers.get(provider)
+        if stats is None:
+            stats = ProviderStats()
+            self._providers[provider] = stats
+        return stats
+
+    def hedge_delay(self, model: str) -> float:
+        """
+        对冲请求的等待时间(秒)
+
+        未配置固定值时取该提供商首token延迟的分位数, 并限制在上下界内
+
+        Args:
+            model: 模型名称
+
+        Returns:
+            float: 等待秒数
+        """
+        if settings.LLM_HEDGE_DELAY_MS > 0:
+            return settings.LLM_HEDGE_DELAY_MS / 1000
+        tracker = self._stats(model).first_token
+        observed = None
+        if len(tracker) >= settings.LLM_HEDGE_MIN_SAMPLES:
+            observed = tracker.percentile(settings.LLM_HEDGE_PERCENTILE)
+        if observed is None:
+            observed = settings.LLM_HEDGE_MAX_DELAY_MS / 1000
+        return min(
+            max(observed, settings.LLM_HEDGE_MIN_DELAY_MS / 1000),
+            settings.LLM_HEDGE_MAX_DELAY_MS / 1000
+        )
+
+    def _candidates(self, model: str) -> List[str]:
+        """按优先级排列的候选模型"""
+        candidates = [model]
+        fallback = self.fallback_models.get(model)
+        if fallback and fallback != model and self.mode != "direct":
+            candidates.append(fallback)
+        return candidates
+
+    async def dispatch(
+        self,
+        call: ProviderCall,
+        messages: List[Dict[str, str]],
+        model: str,
+        stream: bool
+    ) -> str | AsyncGenerator[str, None]:
+        """
+        路由一次调用
+
+        Args:
+            call: 实际调用提供商的函数
+            messages: 消息列表
+            model: 请求的模型
+            stream: 是否流式
+
+        Returns:
+            str | AsyncGenerator: 回复内容或流式生成器
+        """
+        if self.mode == "direct":
+            return await call(messages, model, stream)
+
+        # 只读检查, 试探名额在实际发起请求时才占用(_attempt)
+        candidates = [m for m in self._candidates(model) if self._stats(m).breaker.available()]
+        if not candidates:
+            raise ProviderUnavailableError(f"模型 {model} 的提供商暂不可用(熔断中)")
+
+        last_error: Optional[BaseException] = None
+        while candidates:
+            primary = candidates.pop(0)
+            hedge_model = None
+            if self.mode == "hedged":
+                hedge_model = candidates[0] if candidates else primary
+            try:
+                model_used, result = await self._race(call, messages, primary, hedge_model, stream)
+            except Exception as e:
+                last_error = e
+                continue
+            if stream:
+                return self._tail(model_used, result)
+            return result[0]
+
+        raise last_error
+
+    async def _attempt(
+        self,
+        call: ProviderCall,
+        messages: List[Dict[str, str]],
+        model: str,
+        stream: bool
+    ) -> Tuple[str | AsyncGenerator[str, None], Optional[str], bool]:
+        """
+        发起一次调用, 等到首个token(流式)或完整回复(非流式)
+
+        Returns:
+            Tuple: (回复或流, 流式时已读出的首个分块, 是否占用了半开试探名额)
+
+        Raises:
+            ProviderUnavailableError: 熔断器不放行(试探名额已被其他请求占用)
+        """
+        stats = self._stats(model)
+        breaker = stats.breaker
+        probe = breaker.state == "half_open"
+        if not breaker.allow():
+            raise ProviderUnavailableError(f"模型 {model} 的提供商暂不可用(熔断中)")
+        stats.requests += 1
+        started = time.monotonic()
+
+        async def first_token():
+            response = await call(messages, model, stream)
+            if not stream:
+                return response, None
+            try:
+                return response, await response.__anext__()
+            except StopAsyncIteration:
+                return response, ""
+            except BaseException:
+                await response.aclose()
+                raise
+
+        # 非流式要等完整回复, 用首token超时会把正常的长回复判为失败并计入熔断
+        timeout = settings.LLM_FIRST_TOKEN_TIMEOUT if stream else settings.LLM_RESPONSE_TIMEOUT
+        try:
+            response, first = await asyncio.wait_for(first_token(), timeout=timeout)
+        except (asyncio.CancelledError, RateLimitExceededError):
+            # 被取消(对冲落败、客户端断开)或本地限流排队超时不是提供商故障, 不计入熔断
+            if probe:
+                breaker.release()
+            raise
+        except Exception:
+            stats.failures += 1
+            breaker.record_failure()
+            raise
+
+        if stream:
+            # 非流式的耗时是整个回复的生成时间, 混入会抬高对冲等待时间
+            stats.first_token.record(time.monotonic() - started)
+        else:
+            breaker.record_success()
+        return response, first, probe
+
+    async def _race(
+        self,
+        call: ProviderCall,
+        messages: List[Dict[str, str]],
+        model: str,
+        hedge_model: Optional[str],
+        stream: bool
+    ) -> Tuple[str, Tuple[str | AsyncGenerator[str, None], Optional[str], bool]]:
+        """
+        主请求超过对冲等待时间仍未产出时, 发起对冲请求, 取先完成的一个
+
+        Returns:
+            Tuple: (实际使用的模型, (回复或流, 首个分块, 是否占用了试探名额))
+        """
+        primary = asyncio.ensure_future(self._attempt(call, messages, model, stream))
+        # 已发起且尚未交给调用方或收尾的请求 -> 模型
+        attempts = {primary: model}
+        try:
+            if hedge_model is None:
+                return model, await primary
+
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay(model))
+            if done and primary.exception() is None:
+                return model, primary.result()
+            if done or not self._stats(hedge_model).breaker.available():
+                return model, await primary
+
+            self._stats(model).hedges += 1
+            hedge = asyncio.ensure_future(self._attempt(call, messages, hedge_model, stream))
+            attempts[hedge] = hedge_model
+            pending = {primary, hedge}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._stats(model).hedge_wins += 1
+                        winner = attempts.pop(task)
+                        # 同时完成的另一个请求也可能已拿到流, 在后台关闭
+                        for aclose in self._abandon(attempts):
+                            asyncio.ensure_future(aclose)
+                        return winner, task.result()
+                    error = task.exception()
+            raise error
+        except asyncio.CancelledError:
+            # 调用方被取消(客户端断开): 取消仍在进行的请求, 已经拿到的流立即关闭
+            closing = self._abandon(attempts)
+            await asyncio.gather(*closing, return_exceptions=True)
+            raise
+
+    def _abandon(self, attempts: Dict[asyncio.Task, str]) -> List[Awaitable[None]]:
+        """
+        放弃不再需要的请求
+
+        进行中的请求被取消, 结束后由_close_loser收尾; 已拿到流的请求归还试探名额。
+        处理过的请求从attempts中移除, 避免重复归还名额
+
+        Returns:
+            List[Awaitable]: 关闭已拿到的流的协程, 由调用方等待或放到后台执行
+        """
+        closing = []
+        while attempts:
+            task, model = attempts.popitem()
+            if not task.done():
+                task.cancel()
+                task.add_done_callback(lambda done_task, loser=model: self._close_loser(loser, done_task))
+                continue
+            aclose = self._discard(model, task)
+            if aclose is not None:
+                closing.append(aclose)
+        return closing
+
+    def _discard(self, model: str, task: asyncio.Task) -> Optional[Awaitable[None]]:
+        """
+        丢弃一个已结束的请求: 拿到了流则归还其占用的试探名额
+
+        Returns:
+            Optional[Awaitable]: 关闭流的协程, 没有需要关闭的流时为None
+        """
+        if task.cancelled() or task.exception() is not None:
+            return None
+        response, _, probe = task.result()
+        if not hasattr(response, "aclose"):
+            return None
+        if probe:
+            self._stats(model).breaker.release()
+        return response.aclose()
+
+    def _close_loser(self, model: str, task: asyncio.Task) -> None:
+        """被取消的请求如果已经拿到流, 关闭它以释放连接"""
+        aclose = self._discard(model, task)
+        if aclose is not None:
+            asyncio.ensure_future(aclose)
+
+    async def _tail(
+        self,
+        model: str,
+        result: Tuple[AsyncGenerator[str, None], Optional[str], bool]
+    ) -> AsyncGenerator[str, None]:
+        """
+        先输出已读取的首个分块, 再透传剩余部分; 中途出错同样计入熔断
+
+        用户停止或客户端断开时流以GeneratorExit/CancelledError结束, 不算成功也不算失败,
+        在finally中归还试探名额, 否则熔断器会一直停在试探中
+        """
+        response, first, probe = result
+        breaker = self._stats(model).breaker
+        settled = False
+        try:
+            if first:
+                yield first
+            async for chunk in response:
+                yield chunk
+        except Exception:
+            settled = True
+            breaker.record_failure()
+            raise
+        else:
+            settled = True
+            breaker.record_success()
+        finally:
+            if probe and not settled:
+                breaker.release()
+            await response.aclose()
+
+    def stats(self) -> dict:
+        """
+        获取路由统计
+
+        Returns:
+            dict: 每个提供商的请求数、熔断状态和首token延迟分位
+        """
+        return {
+            "mode": self.mode,
+            "fallback_models": self.fallback_models,
+            "providers": {
+                provider: stats.snapshot()
+                for provider, stats in self._providers.items()
+            }
+        }
@@ -2,36 +2,70 @@
 LLM服务
 统一封装不同LLM提供商的接口
 """
-from typing import List, Dict, AsyncGenerator
-import openai
-from anthropic import Anthropic, AsyncAnthropic
+from functools import partial
+from typing import List, Dict, AsyncGenerator, Optional
+from openai import AsyncOpenAI
+from anthropic import AsyncAnthropic
 from ..config import settings
+from .llm_clients import LLMClientPool, llm_client_pool
+from .response_cache import ResponseCache, response_cache
+from .semantic_cache import SemanticCache, semantic_cache
+from .token_counter import TokenCounter, token_counter
+from .single_flight import SingleFlight, single_flight
+from .llm_router import LLMRouter
+from .rate_limiter import RateLimiter, rate_limiter
+from .mock_provider import MockProvider, mock_provider
+from .prompt_cache import EPHEMERAL, PromptCachePlanner, ProviderUsage, prompt_cache_planner
 
 
 class LLMService:
     """LLM服务类"""
 
-    def __init__(self):
-        """初始化LLM客户端"""
-        self.openai_client = None
-        self.anthropic_client = None
-        self.anthropic_async_client = None
-
-        # 初始化OpenAI客户端
-        if settings.OPENAI_API_KEY:
-            openai.api_key = settings.OPENAI_API_KEY
-            self.openai_client = openai
+    def __init__(
+        self,
+        client_pool: LLMClientPool = llm_client_pool,
+        cache: ResponseCache = response_cache,
+        semantic: SemanticCache = semantic_cache,
+        counter: TokenCounter = token_counter,
+        flights: SingleFlight = single_flight,
+        limiter: RateLimiter = rate_limiter,
+        mock: MockProvider = mock_provider,
+        planner: PromptCachePlanner = prompt_cache_planner
+    ):
+        """
+        初始化LLM服务
 
-        # 初始化Anthropic客户端
-        if settings.ANTHROPIC_API_KEY:
-            self.anthropic_client = Anthropic(api_key=settings.ANTHROPIC_API_KEY)
-            self.anthropic_async_client = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
+        Args:
+            client_pool: 共享连接池的提供商客户端池
+            cache: 精确匹配响应缓存
+            semantic: 语义缓存
+            counter: Token计数器
+            flights: 并发相同请求的合并器
+            limiter: 提供商限流器
+            mock: 模拟提供商(压测用)
+            planner: 提示词缓存断点规划
+        """
+        self.client_pool = client_pool
+        self.cache = cache
+        self.semantic_cache = semantic
+        self.token_counter = counter
+        self.single_flight = flights
+        self.rate_limiter = limiter
+        self.mock_provider = mock
+        self.prompt_cache = planner
+        self.router = LLMRouter(
+            provider_for_model=self.provider_for_model,
+            mode=settings.LLM_ROUTING_MODE,
+            fallback_models=settings.LLM_FALLBACK_MODELS
+        )
 
     async def chat(
         self,
         messages: List[Dict[str, str]],
         model: str = "gpt-3.5-turbo",
-        stream: bool = False
+        stream: bool = False,
+        use_cache: bool = True,
+        usage: Optional[ProviderUsage] = None
     ) -> str | AsyncGenerator[str, None]:
         """
         聊天接口
@@ -40,134 +74,346 @@ class LLMService:
             messages: 消息列表
             model: 模型名称
             stream: 是否流式响应
+            use_cache: 是否允许使用响应缓存
+            usage: 接收提供商报告的用量(含提示词缓存读写), 流式响应在流结束时填入;
+                命中响应缓存或合并到其他请求时不会调用提供商, 保持为空
 
         Returns:
             str | AsyncGenerator: 回复内容或流式生成器
         """
-        # 判断模型类型
+        if not use_cache:
+            return await self._dispatch(messages, model, stream, usage)
+
+        cached = await self._cache_lookup(messages, model)
+        if cached is not None:
+            return self._replay_stream(cached) if stream else cached
+
+        # 相同请求并发到达时只发起一次上游生成
+        flight_key = self.cache.make_key(model, messages)
+        if stream:
+            return self.single_flight.stream(
+                flight_key,
+                lambda: self._generate_stream(messages, model, usage)
+            )
+        return await self.single_flight.call(
+            flight_key,
+            lambda: self._generate(messages, model, usage)
+        )
+
+    async def _generate(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        usage: Optional[ProviderUsage] = None
+    ) -> str:
+        """调用上游生成完整回复并写入缓存"""
+        response = await self._dispatch(messages, model, False, usage)
+        await self._cache_store(messages, model, response)
+        return response
+
+    async def _generate_stream(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        usage: Optional[ProviderUsage] = None
+    ) -> AsyncGenerator[str, None]:
+        """调用上游流式生成, 完整结束后写入缓存"""
+        response_stream = await self._dispatch(messages, model, True, usage)
+        return self._caching_stream(response_stream, messages, model)
+
+    async def _cache_lookup(
+        self,
+        messages: List[Dict[str, str]],
+        model: str
+    ) -> str | None:
+        """先查精确缓存, 再查语义缓存; 语义命中回填精确缓存"""
+        cache_key = None
+        if self.cache.enabled:
+            cache_key = self.cache.make_key(model, messages)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        if self.semantic_cache.enabled:
+            cached = await self.semantic_cache.lookup(model, messages)
+            if cached is not None:
+                if cache_key is not None:
+                    self.cache.set(cache_key, cached)
+                return cached
+
+        return None
+
+    async def _cache_store(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        response: str
+    ) -> None:
+        """把完整回复写入各级缓存"""
+        if self.cache.enabled:
+            self.cache.set(self.cache.make_key(model, messages), response)
+        if self.semantic_cache.enabled:
+            await self.semantic_cache.store(model, messages, response)
+
+    def provider_for_model(self, model: str) -> str:
+        """
+        根据模型名称前缀判断提供商
+        "<名称>/" 形式的模型名优先路由到同名的OpenAI兼容提供商
+
+        Args:
+            model: 模型名称
+
+        Returns:
+            str: 提供商名称
+
+        Raises:
+            ValueError: 不支持的模型
+        """
+        compatible = self.client_pool.compatible_providers
+        name = model.split("/", 1)[0]
+        if "/" in model and name in compatible:
+            return name
+
         if model.startswith("gpt"):
-            return await self._openai_chat(messages, model, stream)
+            return "openai"
         elif model.startswith("claude"):
-            return await self._anthropic_chat(messages, model, stream)
-        elif model.startswith("deepseek"):
-            return await self._deepseek_chat(messages, model, stream)
-        else:
-            raise ValueError(f"不支持的模型: {model}")
+            return "anthropic"
+        elif model.startswith("mock") and settings.MOCK_LLM_ENABLED:
+            return "mock"
+
+        for provider in compatible.values():
+            if provider.matches(model):
+                return provider.name
+        raise ValueError(f"不支持的模型: {model}")
+
+    async def _dispatch(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        stream: bool,
+        usage: Optional[ProviderUsage] = None
+    ) -> str | AsyncGenerator[str, None]:
+        """经路由(熔断/故障转移/对冲)调用提供商"""
+        call = partial(self._call_provider, usage=usage) if usage is not None else self._call_provider
+        return await self.router.dispatch(call, messages, model, stream)
+
+    async def _call_provider(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        stream: bool,
+        usage: Optional[ProviderUsage] = None
+    ) -> str | AsyncGenerator[str, None]:
+        """按模型前缀分发到对应的提供商"""
+        handlers = {
+            "openai": self._openai_chat,
+            "anthropic": self._anthropic_chat,
+            "mock": self.mock_provider.chat,
+        }
+        provider = self.provider_for_model(model)
+        handler = handlers.get(provider) or partial(self._compatible_chat, provider)
+
+        # 按提示词Token+预期输出预估本次消耗, 额度不足时排队
+        estimated_tokens = (
+            self.token_counter.count_messages(messages, model)
+            + settings.LLM_RATE_LIMIT_OUTPUT_TOKENS
+        )
+        await self.rate_limiter.acquire(provider, model, estimated_tokens)
+
+        return await handler(messages, model, stream, usage)
+
+    async def _replay_stream(self, content: str) -> AsyncGenerator[str, None]:
+        """把缓存的回复切块回放为流"""
+        chunk_size = max(1, settings.RESPONSE_CACHE_REPLAY_CHUNK_SIZE)
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    async def _caching_stream(
+        self,
+        response_stream: AsyncGenerator[str, None],
+        messages: List[Dict[str, str]],
+        model: str
+    ) -> AsyncGenerator[str, None]:
+        """透传流式回复, 完整结束后写入缓存(中断的回复不缓存)"""
+        parts = []
+        async for chunk in response_stream:
+            parts.append(chunk)
+            yield chunk
+        await self._cache_store(messages, model, "".join(parts))
 
     async def _openai_chat(
         self,
         messages: List[Dict[str, str]],
         model: str,
-        stream: bool
+        stream: bool,
+        usage: Optional[ProviderUsage] = None
     ) -> str | AsyncGenerator[str, None]:
-        """OpenAI聊天"""
-        if not self.openai_client:
+        """OpenAI聊天(超过1024 Token的提示词前缀由OpenAI自动缓存)"""
+        client = self.client_pool.openai
+        if not client:
             raise ValueError("OpenAI API密钥未配置")
 
+        return await self._openai_completion(client, messages, model, stream, usage)
+
+    async def _compatible_chat(
+        self,
+        provider: str,
+        messages: List[Dict[str, str]],
+        model: str,
+        stream: bool,
+        usage: Optional[ProviderUsage] = None
+    ) -> str | AsyncGenerator[str, None]:
+        """
+        OpenAI兼容接口聊天(DeepSeek, vLLM, llama.cpp等)
+        与OpenAI共用请求和流式解析逻辑, 仅base_url和密钥不同
+        """
+        client = self.client_pool.compatible(provider)
+        if not client:
+            raise ValueError(f"{provider} API密钥未配置")
+
+        upstream_model = self.client_pool.compatible_providers[provider].upstream_model(model)
+        return await self._openai_completion(client, messages, upstream_model, stream, usage)
+
+    async def _openai_completion(
+        self,
+        client: AsyncOpenAI,
+        messages: List[Dict[str, str]],
+        model: str,
+        stream: bool,
+        usage: Optional[ProviderUsage] = None
+    ) -> str | AsyncGenerator[str, None]:
+        """调用Chat Completions接口"""
         if stream:
-            return self._openai_stream(messages, model)
+            return self._openai_stream(client, messages, model, usage)
         else:
-            response = await self.openai_client.ChatCompletion.acreate(
+            response = await client.chat.completions.create(
                 model=model,
                 messages=messages
             )
-            return response.choices[0].message.content
+            if usage is not None:
+                usage.record_openai(response.usage)
+            return response.choices[0].message.content or ""
 
     async def _openai_stream(
         self,
+        client: AsyncOpenAI,
         messages: List[Dict[str, str]],
-        model: str
+        model: str,
+        usage: Optional[ProviderUsage] = None
     ) -> AsyncGenerator[str, None]:
-        """OpenAI流式响应"""
-        response = await self.openai_client.ChatCompletion.acreate(
+        """OpenAI流式响应, 需要用量时请求在最后一个分块中返回"""
+        response = await client.chat.completions.create(
             model=model,
             messages=messages,
-            stream=True
+            stream=True,
+            # 当前SDK版本没有stream_options参数, 通过请求体传入
+            extra_body={"stream_options": {"include_usage": True}} if usage is not None else None
         )
 
-        async for chunk in response:
-            if chunk.choices[0].delta.get("content"):
-                yield chunk.choices[0].delta.content
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                elif usage is not None and getattr(chunk, "usage", None):
+                    usage.record_openai(chunk.usage)
+        finally:
+            # 提前退出时关闭响应, 把连接归还连接池
+            await response.response.aclose()
 
     async def _anthropic_chat(
         self,
         messages: List[Dict[str, str]],
         model: str,
-        stream: bool
+        stream: bool,
+        usage: Optional[ProviderUsage] = None
     ) -> str | AsyncGenerator[str, None]:
-        """Anthropic聊天"""
-        if not self.anthropic_async_client:
+        """Anthropic聊天, 长会话的稳定前缀加cache_control断点"""
+        client = self.client_pool.anthropic
+        if not client:
             raise ValueError("Anthropic API密钥未配置")
 
-        # 转换消息格式
+        # 转换消息格式, 断点所在的消息改为带cache_control的内容块
+        breakpoints = set(self.prompt_cache.plan(messages, model))
         anthropic_messages = []
         system_message = None
 
-        for msg in messages:
+        for index, msg in enumerate(messages):
+            content = msg["content"]
+            if index in breakpoints:
+                content = [{"type": "text", "text": content, "cache_control": EPHEMERAL}]
             if msg["role"] == "system":
-                system_message = msg["content"]
+                system_message = content
             else:
                 anthropic_messages.append({
                     "role": msg["role"],
-                    "content": msg["content"]
+                    "content": content
                 })
 
+        # 提示词缓存的SDK接口仍在beta命名空间下
+        api = client.beta.prompt_caching.messages if breakpoints else client.messages
         if stream:
-            return self._anthropic_stream(anthropic_messages, model, system_message)
+            return self._anthropic_stream(api, anthropic_messages, model, system_message, usage)
         else:
-            response = await self.anthropic_async_client.messages.create(
+            response = await api.create(
                 model=model,
                 max_tokens=4096,
-                system=system_message,
-                messages=anthropic_messages
+                messages=anthropic_messages,
+                **self._anthropic_system_kwargs(system_message)
             )
+            if usage is not None:
+                usage.record_anthropic(response.usage)
             return response.content[0].text
 
     async def _anthropic_stream(
         self,
+        api,
         messages: List[Dict[str, str]],
         model: str,
-        system_message: str = None
+        system_message: str | list | None = None,
+        usage: Optional[ProviderUsage] = None
     ) -> AsyncGenerator[str, None]:
-        """Anthropic流式响应"""
-        async with self.anthropic_async_client.messages.stream(
+        """
+        Anthropic流式响应
+
+        提示词用量(含缓存读写)在message_start事件中返回, 输出Token数在message_delta中,
+        提前停止时也能记录已知的部分
+        """
+        async with api.stream(
             model=model,
             max_tokens=4096,
-            system=system_message,
-            messages=messages
+            messages=messages,
+            **self._anthropic_system_kwargs(system_message)
         ) as stream:
-            async for text in stream.text_stream:
-                yield text
+            output_tokens = 0
+            async for event in stream:
+                if event.type == "text":
+                    yield event.text
+                elif event.type == "message_start" and usage is not None:
+                    usage.record_anthropic(event.message.usage)
+                    output_tokens = event.message.usage.output_tokens or 0
+                elif event.type == "message_delta" and usage is not None:
+                    # message_delta中的输出Token数是累计值
+                    usage.add(output_tokens=event.usage.output_tokens - output_tokens)
+                    output_tokens = event.usage.output_tokens
 
-    async def _deepseek_chat(
-        self,
-        messages: List[Dict[str, str]],
-        model: str,
-        stream: bool
-    ) -> str | AsyncGenerator[str, None]:
-        """
-        DeepSeek聊天
-        DeepSeek使用OpenAI兼容接口
-        """
-        # DeepSeek使用OpenAI兼容的API
-        # 这里需要设置自定义的base_url
-        raise NotImplementedError("DeepSeek集成待实现")
+    @staticmethod
+    def _anthropic_system_kwargs(system_message: str | list | None) -> dict:
+        """Anthropic不接受system=None, 没有系统提示时不传该参数"""
+        return {"system": system_message} if system_message else {}
 
-    def estimate_tokens(self, text: str) -> int:
+    def estimate_tokens(self, text: str, model: str | None = None) -> int:
         """
-        估算Token数量
-        简单估算: 中文1字=2tokens, 英文1词≈1.3tokens
+        计算Token数量
+        有本地BPE词表时精确计数, 否则使用向量化启发式估算, 结果按内容哈希缓存
 
         Args:
             text: 文本内容
+            model: 模型名称, 决定使用哪个分词器
 
         Returns:
-            int: 估算的Token数量
+            int: Token数量
         """
-        # 简单估算逻辑
-        chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-        other_chars = len(text) - chinese_chars
-        return int(chinese_chars * 2 + other_chars * 0.3)
+        return self.token_counter.count(text, model)
 
 
 # 创建全局实例
@@ -0,0 +1,297 @@
+"""
+模拟LLM提供商
+用于压测和离线基准测试: 不访问网络, 按配置的分布模拟首token延迟、输出速度、
+回复长度和错误率, 相同的请求总是产出相同的文本
+"""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import AsyncGenerator, Dict, List, Optional
+from ..config import settings
+from .prompt_cache import ProviderUsage
+
+# 生成文本使用的词表, 每个词约为1个token
+_WORDS = (
+    "the of and to in is that for it as with was on be by this are from at or "
+    "an have not which but all they we can more one has will their about there "
+    "model token stream latency request response cache queue provider service "
+    "context message user system answer question data result value time first"
+).split()
+
+
+class MockProviderError(RuntimeError):
+    """模拟的提供商错误"""
+
+
+class Distribution:
+    """
+    单个随机变量的分布
+
+    规格字符串格式:
+        fixed:V               固定值
+        uniform:LOW,HIGH      均匀分布
+        normal:MEAN,STD       正态分布
+        lognormal:MEDIAN,SIGMA  对数正态分布(长尾延迟)
+        exponential:MEAN      指数分布
+    纯数字等价于fixed, 采样结果截断为非负数
+    """
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+    def __init__(self, kind: str, params: List[float]):
+        if kind not in self.KINDS:
+            raise ValueError(f"不支持的分布类型: {kind}")
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1}[kind]
+        if len(params) != expected:
+            raise ValueError(f"{kind} 分布需要 {expected} 个参数")
+        self.kind = kind
+        self.params = params
+
+    @classmethod
+    def parse(cls, spec: str | float | int) -> "Distribution":
+        """
+        解析分布规格
+
+        Args:
+            spec: 规格字符串或数字
+
+        Returns:
+            Distribution: 分布
+        """
+        if isinstance(spec, (int, float)):
+            return cls("fixed", [float(spec)])
+        kind, _, args = spec.strip().partition(":")
+        if not args:
+            return cls("fixed", [float(kind)])
+        return cls(kind.strip().lower(), [float(arg) for arg in args.split(",")])
+
+    def sample(self, rng: random.Random) -> float:
+        """
+        采样一次
+
+        Args:
+            rng: 随机数生成器
+
+        Returns:
+            float: 非负的样本值
+        """
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = rng.gauss(p[0], p[1])
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(math.log(max(p[0], 1e-9)), p[1])
+        else:
+            value = rng.expovariate(1 / p[0]) if p[0] > 0 else 0.0
+        return max(value, 0.0)
+
+    def __repr__(self) -> str:
+        return f"{self.kind}:{','.join(f'{v:g}' for v in self.params)}"
+
+
+@dataclass
+class MockProfile:
+    """一组模拟参数"""
+    ttft_ms: Distribution
+    tokens_per_second: Distribution
+    output_tokens: Distribution
+    error_rate: float = 0.0  # 首token前失败的概率
+    midstream_error_rate: float = 0.0  # 输出中途断开的概率
+    chunk_tokens: int = 1  # 每个流式分块包含的token数
+
+    @classmethod
+    def from_settings(cls, overrides: Optional[Dict[str, str | float]] = None) -> "MockProfile":
+        """
+        从全局配置创建, 可按模型覆盖部分参数
+
+        Args:
+            overrides: 覆盖的参数, 键为字段名
+
+        Returns:
+            MockProfile: 模拟参数
+        """
+        values = {
+            "ttft_ms": settings.MOCK_LLM_TTFT_MS,
+            "tokens_per_second": settings.MOCK_LLM_TOKENS_PER_SECOND,
+            "output_tokens": settings.MOCK_LLM_OUTPUT_TOKENS,
+            "error_rate": settings.MOCK_LLM_ERROR_RATE,
+            "midstream_error_rate": settings.MOCK_LLM_MIDSTREAM_ERROR_RATE,
+            "chunk_tokens": settings.MOCK_LLM_CHUNK_TOKENS,
+        }
+        values.update(overrides or {})
+        return cls(
+            ttft_ms=Distribution.parse(values["ttft_ms"]),
+            tokens_per_second=Distribution.parse(values["tokens_per_second"]),
+            output_tokens=Distribution.parse(values["output_tokens"]),
+            error_rate=float(values["error_rate"]),
+            midstream_error_rate=float(values["midstream_error_rate"]),
+            chunk_tokens=max(int(values["chunk_tokens"]), 1)
+        )
+
+
+@dataclass
+class _MockPlan:
+    """一次调用的采样结果"""
+    ttft: float
+    interval: float  # 每个token的间隔(秒)
+    words: List[str]
+    fail_at: Optional[int]  # 输出该数量的token后失败, None表示成功
+
+
+class MockProvider:
+    """模拟LLM提供商类"""
+
+    def __init__(
+        self,
+        profile: Optional[MockProfile] = None,
+        profiles: Optional[Dict[str, MockProfile]] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        初始化模拟提供商
+
+        Args:
+            profile: 默认模拟参数
+            profiles: 模型名称 -> 专用模拟参数(如 mock-slow)
+            seed: 时序随机数种子, 设置后整轮压测可复现
+        """
+        self.profile = profile or MockProfile.from_settings()
+        self.profiles = profiles or {}
+        self._rng = random.Random(seed)
+
+        self.requests = 0
+        self.errors = 0
+        self.tokens = 0
+
+    def profile_for_model(self, model: str) -> MockProfile:
+        """获取模型对应的模拟参数"""
+        return self.profiles.get(model, self.profile)
+
+    @staticmethod
+    def _request_rng(messages: List[Dict[str, str]], model: str) -> random.Random:
+        """按请求内容派生随机数生成器, 保证相同请求产出相同文本"""
+        payload = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+        digest = hashlib.blake2b(payload.encode("utf-8"), digest_size=8).digest()
+        return random.Random(int.from_bytes(digest, "big"))
+
+    def _plan(self, messages: List[Dict[str, str]], model: str) -> _MockPlan:
+        """采样本次调用的延迟、长度、文本和失败位置"""
+        profile = self.profile_for_model(model)
+        text_rng = self._request_rng(messages, model)
+        length = max(int(round(profile.output_tokens.sample(text_rng))), 1)
+        words = [text_rng.choice(_WORDS) for _ in range(length)]
+
+        rng = self._rng
+        ttft = profile.ttft_ms.sample(rng) / 1000
+        rate = profile.tokens_per_second.sample(rng)
+        interval = 1 / rate if rate > 0 else 0.0
+
+        fail_at = None
+        if rng.random() < profile.error_rate:
+            fail_at = 0
+        elif length > 1 and rng.random() < profile.midstream_error_rate:
+            fail_at = rng.randrange(1, length)
+        return _MockPlan(ttft=ttft, interval=interval, words=words, fail_at=fail_at)
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        stream: bool,
+        usage: Optional[ProviderUsage] = None
+    ) -> str | AsyncGenerator[str, None]:
+        """
+        模拟一次聊天调用
+
+        Args:
+            messages: 消息列表
+            model: 模型名称
+            stream: 是否流式
+            usage: 接收模拟的输出Token数
+
+        Returns:
+            str | AsyncGenerator: 回复内容或流式生成器
+
+        Raises:
+            MockProviderError: 按错误率模拟的失败
+        """
+        self.requests += 1
+        plan = self._plan(messages, model)
+        if stream:
+            return self._stream(plan, self.profile_for_model(model).chunk_tokens, usage)
+
+        await asyncio.sleep(plan.ttft + plan.interval * len(plan.words))
+        if plan.fail_at is not None:
+            self.errors += 1
+            raise MockProviderError("模拟的提供商错误")
+        self.tokens += len(plan.words)
+        if usage is not None:
+            usage.add(output_tokens=len(plan.words))
+        return " ".join(plan.words)
+
+    async def _stream(
+        self,
+        plan: _MockPlan,
+        chunk_tokens: int,
+        usage: Optional[ProviderUsage] = None
+    ) -> AsyncGenerator[str, None]:
+        """按计划的时间点输出分块, 以绝对时间对齐避免sleep误差累积"""
+        started = time.monotonic()
+        await asyncio.sleep(plan.ttft)
+        if plan.fail_at == 0:
+            self.errors += 1
+            raise MockProviderError("模拟的提供商错误")
+
+        total = len(plan.words)
+        for index in range(0, total, chunk_tokens):
+            if plan.fail_at is not None and index >= plan.fail_at:
+                self.errors += 1
+                raise MockProviderError("模拟的提供商连接中断")
+
+            end = min(index + chunk_tokens, total)
+            delay = started + plan.ttft + plan.interval * end - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            chunk = " ".join(plan.words[index:end])
+            self.tokens += end - index
+            if usage is not None:
+                usage.add(output_tokens=end - index)
+            yield chunk if index == 0 else " " + chunk
+
+    def stats(self) -> dict:
+        """
+        获取模拟统计
+
+        Returns:
+            dict: 调用数、错误数、产出的token数和当前参数
+        """
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "tokens": self.tokens,
+            "profile": {
+                "ttft_ms": repr(self.profile.ttft_ms),
+                "tokens_per_second": repr(self.profile.tokens_per_second),
+                "output_tokens": repr(self.profile.output_tokens),
+                "error_rate": self.profile.error_rate,
+                "midstream_error_rate": self.profile.midstream_error_rate
+            },
+            "models": sorted(self.profiles)
+        }
+
+
+# 创建全局实例
+mock_provider = MockProvider(
+    profiles={
+        model: MockProfile.from_settings(overrides)
+        for model, overrides in settings.MOCK_LLM_PROFILES.items()
+    },
+    seed=settings.MOCK_LLM_SEED
+)
@@ -0,0 +1,165 @@
+"""
+提供商提示词缓存
+长会话每轮都重发相同的历史前缀, 按Token边界在稳定的前缀末尾放置缓存断点
+(Anthropic cache_control), 并汇总提供商返回的缓存读写Token数;
+OpenAI和DeepSeek的前缀缓存是自动的, 只需读取用量中的命中Token数
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List
+from ..config import settings
+from .token_counter import MESSAGE_OVERHEAD_TOKENS, TokenCounter, token_counter
+
+# Anthropic的缓存断点标记
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def _field(obj: Any, name: str) -> Any:
+    """读取SDK模型或字典中的字段(旧版SDK未声明的字段以字典形式保留)"""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+@dataclass
+class ProviderUsage:
+    """
+    一次调用中提供商报告的Token用量
+
+    input_tokens为提示词总Token数(含缓存读写部分), 与各提供商的计数口径无关
+    """
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    reported: bool = False  # 提供商是否返回了用量
+
+    def add(
+        self,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        cache_read_tokens: int = 0,
+        cache_write_tokens: int = 0
+    ) -> None:
+        self.reported = True
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cache_read_tokens += cache_read_tokens
+        self.cache_write_tokens += cache_write_tokens
+
+    def record_anthropic(self, usage: Any) -> None:
+        """Anthropic: input_tokens不含缓存读写部分, 三者相加才是提示词总数"""
+        if usage is None:
+            return
+        cache_read = _field(usage, "cache_read_input_tokens") or 0
+        cache_write = _field(usage, "cache_creation_input_tokens") or 0
+        self.add(
+            input_tokens=(_field(usage, "input_tokens") or 0) + cache_read + cache_write,
+            output_tokens=_field(usage, "output_tokens") or 0,
+            cache_read_tokens=cache_read,
+            cache_write_tokens=cache_write
+        )
+
+    def record_openai(self, usage: Any) -> None:
+        """OpenAI及兼容接口: 命中数在prompt_tokens_details.cached_tokens, DeepSeek为prompt_cache_hit_tokens"""
+        if usage is None:
+            return
+        cache_read = (
+            _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+            or _field(usage, "prompt_cache_hit_tokens")
+            or 0
+        )
+        self.add(
+            input_tokens=_field(usage, "prompt_tokens") or 0,
+            output_tokens=_field(usage, "completion_tokens") or 0,
+            cache_read_tokens=cache_read
+        )
+
+
+class PromptCachePlanner:
+    """
+    缓存断点规划
+
+    断点放在消息边界上:
+    - 系统提示足够长时单独一个断点, 相同系统提示的不同会话共享
+    - 累计Token每跨过block_tokens的整数倍放一个锚点, 只要历史前缀不变, 锚点位置每轮都相同
+    - 最后一条消息一个断点, 写入完整前缀, 下一轮作为前缀命中
+    Anthropic每次请求最多4个断点, 锚点多于可用数量时保留最靠后的
+    """
+
+    def __init__(
+        self,
+        counter: TokenCounter = token_counter,
+        enabled: bool = True,
+        min_tokens: int = 1024,
+        block_tokens: int = 4096,
+        max_breakpoints: int = 4
+    ):
+        """
+        初始化
+
+        Args:
+            counter: Token计数器
+            enabled: 是否启用
+            min_tokens: 提示词少于该值时不加断点(提供商的最小可缓存长度)
+            block_tokens: 锚点间隔Token数
+            max_breakpoints: 每次请求的断点上限
+        """
+        self.counter = counter
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self.block_tokens = max(1, block_tokens)
+        self.max_breakpoints = max_breakpoints
+
+    def plan(self, messages: List[Dict[str, str]], model: str) -> List[int]:
+        """
+        计算要加缓存断点的消息下标
+
+        Args:
+            messages: 消息列表(含系统提示)
+            model: 模型名称
+
+        Returns:
+            List[int]: 升序的消息下标, 不需要缓存时为空
+        """
+        if not self.enabled or not messages or self.max_breakpoints <= 0:
+            return []
+
+        totals = []
+        total = 0
+        for msg in messages:
+            total += self.counter.count(msg["content"], model) + MESSAGE_OVERHEAD_TOKENS
+            totals.append(total)
+        if total < self.min_tokens:
+            return []
+
+        last = len(messages) - 1
+        points: List[int] = []
+        leading_system = 0
+        while leading_system < last and messages[leading_system]["role"] == "system":
+            leading_system += 1
+        if leading_system and totals[leading_system - 1] >= self.min_tokens:
+            points.append(leading_system - 1)
+
+        anchors = []
+        boundary = max(self.block_tokens, self.min_tokens)
+        for index in range(leading_system, last):
+            if totals[index] >= boundary:
+                anchors.append(index)
+                boundary = (totals[index] // self.block_tokens + 1) * self.block_tokens
+
+        room = self.max_breakpoints - len(points) - 1
+        if room > 0:
+            points.extend(anchors[-room:])
+        points.append(last)
+        return points[-self.max_breakpoints:]
+
+
+# 创建全局实例
+prompt_cache_planner = PromptCachePlanner(
+    enabled=settings.PROMPT_CACHE_ENABLED,
+    min_tokens=settings.PROMPT_CACHE_MIN_TOKENS,
+    block_tokens=settings.PROMPT_CACHE_BLOCK_TOKENS,
+    max_breakpoints=settings.PROMPT_CACHE_MAX_BREAKPOINTS
+)
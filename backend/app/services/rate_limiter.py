@@ -0,0 +1,280 @@
+"""
+提供商限流
+按提供商/模型同时限制每分钟请求数(RPM)和每分钟Token数(TPM),
+额度不足时在截止时间内排队等待, 而不是直接失败
+"""
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from ..config import settings
+from ..utils.metrics import LatencyTracker, to_ms
+
+
+class RateLimitExceededError(RuntimeError):
+    """排队超过截止时间仍未获得额度"""
+
+
+@dataclass
+class RateLimit:
+    """单个限流键的额度, 0表示该维度不限制"""
+    rpm: int = 0
+    tpm: int = 0
+
+
+class RateLimitBackend(ABC):
+    """
+    限流状态存储基类
+
+    try_acquire需原子地同时扣减请求和Token两个桶,
+    成功返回0, 否则返回建议的等待秒数
+    """
+
+    @abstractmethod
+    async def try_acquire(self, key: str, limit: RateLimit, tokens: int) -> float:
+        ...
+
+    async def start(self) -> None:
+        """启动时检查存储是否可用"""
+
+
+class InMemoryBackend(RateLimitBackend):
+    """进程内令牌桶(默认), 多个worker各自独立计数"""
+
+    def __init__(self):
+        # key -> (请求桶余量, Token桶余量, 上次补充时间)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+
+    async def try_acquire(self, key: str, limit: RateLimit, tokens: int) -> float:
+        now = time.monotonic()
+        requests_left, tokens_left, updated = self._buckets.get(
+            key, (float(limit.rpm), float(limit.tpm), now)
+        )
+        elapsed = now - updated
+        requests_left = min(limit.rpm, requests_left + elapsed * limit.rpm / 60)
+        tokens_left = min(limit.tpm, tokens_left + elapsed * limit.tpm / 60)
+
+        # 单次请求超过桶容量时按容量计, 否则永远等不到
+        tokens = min(tokens, limit.tpm)
+        wait = 0.0
+        if limit.rpm and requests_left < 1:
+            wait = max(wait, (1 - requests_left) * 60 / limit.rpm)
+        if limit.tpm and tokens_left < tokens:
+            wait = max(wait, (tokens - tokens_left) * 60 / limit.tpm)
+
+        if wait == 0:
+            requests_left -= 1 if limit.rpm else 0
+            tokens_left -= tokens if limit.tpm else 0
+        self._buckets[key] = (requests_left, tokens_left, now)
+        return wait
+
+
+# 原子地补充并扣减两个令牌桶; 返回0表示成功, 否则返回等待秒数
+_REDIS_ACQUIRE_SCRIPT = """
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local cost = math.min(tonumber(ARGV[3]), tpm)
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'updated')
+local requests = tonumber(state[1]) or rpm
+local tokens = tonumber(state[2]) or tpm
+local updated = tonumber(state[3]) or now
+local elapsed = math.max(0, now - updated)
+requests = math.min(rpm, requests + elapsed * rpm / 60)
+tokens = math.min(tpm, tokens + elapsed * tpm / 60)
+local wait = 0
+if rpm > 0 and requests < 1 then
+  wait = math.max(wait, (1 - requests) * 60 / rpm)
+end
+if tpm > 0 and tokens < cost then
+  wait = math.max(wait, (cost - tokens) * 60 / tpm)
+end
+if wait == 0 then
+  if rpm > 0 then requests = requests - 1 end
+  if tpm > 0 then tokens = tokens - cost end
+end
+redis.call('HSET', KEYS[1], 'requests', requests, 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(wait)
+"""
+
+
+class RedisBackend(RateLimitBackend):
+    """Redis令牌桶, 多个uvicorn worker共享额度"""
+
+    def __init__(self, url: str, prefix: str = "llm:ratelimit:"):
+        try:
+            from redis import asyncio as redis_asyncio
+        except ImportError:
+            raise RuntimeError("LLM_RATE_LIMIT_BACKEND=redis 需要安装redis包(pip install -r requirements.txt)")
+
+        self._url = url
+        self._redis = redis_asyncio.from_url(url)
+        self._script = self._redis.register_script(_REDIS_ACQUIRE_SCRIPT)
+        self._prefix = prefix
+
+    async def start(self) -> None:
+        # from_url不会建立连接, 启动时连一次, 配置错误时直接启动失败而不是在首次限流时报错
+        try:
+            await self._redis.ping()
+        except Exception as e:
+            raise RuntimeError(f"无法连接Redis限流后端 {self._url}: {e}") from e
+
+    async def try_acquire(self, key: str, limit: RateLimit, tokens: int) -> float:
+        result = await self._script(keys=[self._prefix + key], args=[limit.rpm, limit.tpm, tokens])
+        return float(result)
+
+
+class _KeyStats:
+    """单个限流键的排队统计"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # 先到先得
+        self.waiting = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.wait_time = LatencyTracker(settings.LLM_LATENCY_WINDOW)
+
+    def snapshot(self) -> dict:
+        return {
+            "queue_depth": self.waiting,
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "wait_ms": {
+                "p50": to_ms(self.wait_time.percentile(50)),
+                "p95": to_ms(self.wait_time.percentile(95)),
+                "max": to_ms(self.wait_time.percentile(100))
+            }
+        }
+
+
+class RateLimiter:
+    """提供商限流类"""
+
+    def __init__(
+        self,
+        limits: Dict[str, Dict[str, int]],
+        backend: RateLimitBackend,
+        max_wait_seconds: float = 30.0
+    ):
+        """
+        初始化限流器
+
+        Args:
+            limits: 限流配置, 键为 "提供商" 或 "提供商:模型", 值为 {"rpm": .., "tpm": ..}
+            backend: 限流状态存储
+            max_wait_seconds: 默认排队截止时间(秒)
+        """
+        self.limits = {key: RateLimit(**value) for key, value in limits.items()}
+        self.backend = backend
+        self.max_wait_seconds = max_wait_seconds
+        self._stats: Dict[str, _KeyStats] = {}
+
+    async def start(self) -> None:
+        """检查限流存储是否可用(应用启动时调用)"""
+        await self.backend.start()
+
+    def _resolve(self, provider: str, model: str) -> Optional[Tuple[str, RateLimit]]:
+        """模型级配置优先于提供商级配置"""
+        for key in (f"{provider}:{model}", provider):
+            limit = self.limits.get(key)
+            if limit is not None and (limit.rpm or limit.tpm):
+                return key, limit
+        return None
+
+    async def acquire(
+        self,
+        provider: str,
+        model: str,
+        tokens: int,
+        max_wait_seconds: Optional[float] = None
+    ) -> float:
+        """
+        获取一次调用的额度, 不足时排队等待
+
+        Args:
+            provider: 提供商名称
+            model: 模型名称
+            tokens: 预估的Token数(提示词+预期输出)
+            max_wait_seconds: 排队截止时间, 默认使用全局配置
+
+        Returns:
+            float: 实际等待的秒数
+
+        Raises:
+            RateLimitExceededError: 截止时间内未获得额度
+        """
+        resolved = self._resolve(provider, model)
+        if resolved is None:
+            return 0.0
+
+        key, limit = resolved
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = _KeyStats()
+            self._stats[key] = stats
+
+        started = time.monotonic()
+        deadline = started + (max_wait_seconds if max_wait_seconds is not None else self.max_wait_seconds)
+        stats.waiting += 1
+        try:
+            async with stats.lock:
+                while True:
+                    wait = await self.backend.try_acquire(key, limit, tokens)
+                    if wait == 0:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if wait > remaining:
+                        stats.rejected += 1
+                        raise RateLimitExceededError(
+                            f"{key} 请求过于频繁, 排队超时, 请稍后重试"
+                        )
+                    await asyncio.sleep(wait)
+        finally:
+            stats.waiting -= 1
+
+        waited = time.monotonic() - started
+        stats.acquired += 1
+        stats.wait_time.record(waited)
+        return waited
+
+    def stats(self) -> dict:
+        """
+        获取限流统计
+
+        Returns:
+            dict: 每个限流键的队列深度和等待时间
+        """
+        return {
+            "backend": type(self.backend).__name__,
+            "limits": {key: vars(limit) for key, limit in self.limits.items()},
+            "keys": {key: stats.snapshot() for key, stats in self._stats.items()}
+        }
+
+
+def build_backend(name: str) -> RateLimitBackend:
+    """
+    根据配置名称创建限流后端
+
+    Args:
+        name: memory 或 redis
+
+    Returns:
+        RateLimitBackend: 限流后端
+    """
+    if name == "memory":
+        return InMemoryBackend()
+    elif name == "redis":
+        return RedisBackend(settings.REDIS_URL)
+    else:
+        raise ValueError(f"不支持的限流后端: {name}")
+
+
+# 创建全局实例
+rate_limiter = RateLimiter(
+    limits=settings.LLM_RATE_LIMITS,
+    backend=build_backend(settings.LLM_RATE_LIMIT_BACKEND),
+    max_wait_seconds=settings.LLM_RATE_LIMIT_MAX_WAIT_SECONDS
+)
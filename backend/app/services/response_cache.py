@@ -0,0 +1,170 @@
+"""
+响应缓存
+按模型和规范化后的消息列表精确匹配LLM回复, 支持LRU + TTL淘汰和内存预算
+"""
+import hashlib
+import json
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from ..config import settings
+
+
+@dataclass
+class _CacheEntry:
+    """缓存条目"""
+    value: str
+    expires_at: float
+    size: int
+
+
+class ResponseCache:
+    """精确匹配响应缓存类"""
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 3600.0,
+        enabled: bool = True
+    ):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 最大条目数
+            max_bytes: 内存预算(字节)
+            ttl_seconds: 条目存活时间(秒)
+            enabled: 是否启用
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]]) -> str:
+        """
+        生成缓存键
+
+        角色统一小写, 内容去掉首尾空白, 以保证格式上的细微差异不影响命中
+
+        Args:
+            model: 模型名称
+            messages: 消息列表
+
+        Returns:
+            str: 缓存键(SHA-256十六进制)
+        """
+        normalized = [
+            [msg["role"].strip().lower(), msg["content"].strip()]
+            for msg in messages
+        ]
+        payload = json.dumps(
+            [model, normalized],
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        读取缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[str]: 命中返回缓存的回复, 否则返回None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def set(self, key: str, value: str) -> None:
+        """
+        写入缓存, 超出条目数或内存预算时按LRU淘汰
+
+        Args:
+            key: 缓存键
+            value: 回复内容
+        """
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = _CacheEntry(
+            value=value,
+            expires_at=time.monotonic() + self.ttl_seconds,
+            size=size
+        )
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        获取缓存统计
+
+        Returns:
+            dict: 命中、未命中、淘汰等计数
+        """
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def _remove(self, key: str) -> None:
+        """删除条目并更新内存占用"""
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+
+# 创建全局实例
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+    enabled=settings.RESPONSE_CACHE_ENABLED
+)
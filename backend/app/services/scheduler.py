@@ -0,0 +1,344 @@
+"""
+LLM生成调度
+按用户(及其等级权重)做加权公平排队(WFQ), 在全局并发上限内分发生成任务;
+交互式流式请求优先于批量请求
+"""
+import asyncio
+import heapq
+import itertools
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+from ..config import settings
+from ..utils.metrics import LatencyTracker, to_ms
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+
+class Ticket:
+    """一次排队中的生成任务"""
+
+    def __init__(
+        self,
+        scheduler: "FairScheduler",
+        user_id: int,
+        priority: str,
+        finish_tag: float,
+        start_tag: float,
+        seq: int
+    ):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.priority = priority
+        self.finish_tag = finish_tag
+        self.start_tag = start_tag
+        self.seq = seq
+        self.granted = asyncio.Event()
+        self.released = False
+        self.enqueued_at = asyncio.get_running_loop().time()
+        self._changed = asyncio.Event()
+
+    def __lt__(self, other: "Ticket") -> bool:
+        return (self.finish_tag, self.seq) < (other.finish_tag, other.seq)
+
+    @property
+    def position(self) -> int:
+        """排队位置(从1开始), 已分发为0"""
+        return self.scheduler.position(self)
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self) -> None:
+        """等待分发"""
+        await self.granted.wait()
+
+    async def positions(self) -> AsyncGenerator[int, None]:
+        """等待分发期间, 每当排队位置变化时产出新位置"""
+        last = None
+        while not self.granted.is_set():
+            position = self.position
+            if position != last:
+                last = position
+                yield position
+            changed = self._changed
+            waiter = asyncio.ensure_future(changed.wait())
+            granted = asyncio.ensure_future(self.granted.wait())
+            try:
+                await asyncio.wait({waiter, granted}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+                granted.cancel()
+
+    def release(self) -> None:
+        """结束生成或放弃排队, 归还并发名额"""
+        self.scheduler.release(self)
+
+    async def __aenter__(self) -> "Ticket":
+        try:
+            await self.wait()
+        except BaseException:
+            self.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+
+class FairScheduler:
+    """加权公平调度类"""
+
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        tier_weights: Optional[Dict[str, float]] = None,
+        enabled: bool = True
+    ):
+        """
+        初始化调度器
+
+        Args:
+            max_concurrency: 全局同时进行的生成数上限
+            tier_weights: 用户等级 -> 权重, 权重越大分到的份额越多
+            enabled: 是否启用, 关闭时直接放行
+        """
+        self.max_concurrency = max_concurrency
+        self.tier_weights = tier_weights or {}
+        self.enabled = enabled
+
+        self._queues: Dict[str, List[Ticket]] = {INTERACTIVE: [], BATCH: []}
+        self._virtual_time: Dict[str, float] = {INTERACTIVE: 0.0, BATCH: 0.0}
+        self._max_finish: Dict[str, float] = {INTERACTIVE: 0.0, BATCH: 0.0}
+        # 只记录完成时间晚于虚拟时间的流, 其余的流下一个任务从虚拟时间开始
+        self._last_finish: Dict[Tuple[str, int], float] = {}
+        self._seq = itertools.count()
+        self._running = 0
+        self._running_by_user: Dict[int, int] = {}
+
+        self.dispatched = 0
+        self.abandoned = 0
+        self.queue_wait = LatencyTracker(settings.LLM_LATENCY_WINDOW)
+
+    def weight_for_tier(self, tier: Optional[str]) -> float:
+        """获取等级权重, 未配置的等级权重为1"""
+        return max(float(self.tier_weights.get(tier or "", 1.0)), 0.01)
+
+    def submit(
+        self,
+        user_id: int,
+        tier: Optional[str] = None,
+        interactive: bool = True,
+        cost: float = 1.0
+    ) -> Ticket:
+        """
+        提交一个生成任务
+
+        虚拟完成时间 = max(当前虚拟时间, 该用户上一个任务的完成时间) + 代价 / 权重,
+        按虚拟完成时间从小到大分发。虚拟时间在分发时推进到任务的开始时间,
+        队列排空时推进到已分发任务的最大完成时间
+
+        Args:
+            user_id: 用户ID
+            tier: 用户等级
+            interactive: 是否为交互式(流式)请求
+            cost: 任务代价(预估Token数)
+
+        Returns:
+            Ticket: 排队凭证
+        """
+        priority = INTERACTIVE if interactive else BATCH
+        flow = (priority, user_id)
+        start = max(self._virtual_time[priority], self._last_finish.get(flow, 0.0))
+        finish = start + max(cost, 1.0) / self.weight_for_tier(tier)
+
+        ticket = Ticket(self, user_id, priority, finish, start, next(self._seq))
+        if not self.enabled:
+            self._grant(ticket)
+            return ticket
+
+        self._last_finish[flow] = finish
+        heapq.heappush(self._queues[priority], ticket)
+        self._dispatch()
+        return ticket
+
+    def _grant(self, ticket: Ticket) -> None:
+        self._running += 1
+        self._running_by_user[ticket.user_id] = self._running_by_user.get(ticket.user_id, 0) + 1
+        self.dispatched += 1
+        self.queue_wait.record(asyncio.get_running_loop().time() - ticket.enqueued_at)
+        ticket.granted.set()
+
+    def _dispatch(self) -> None:
+        """在并发上限内按优先级和虚拟完成时间分发"""
+        dispatched = False
+        while self._running < self.max_concurrency:
+            queue = self._queues[INTERACTIVE] or self._queues[BATCH]
+            if not queue:
+                break
+            ticket = heapq.heappop(queue)
+            self._advance(ticket.priority, ticket.start_tag)
+            self._max_finish[ticket.priority] = max(self._max_finish[ticket.priority], ticket.finish_tag)
+            self._grant(ticket)
+            dispatched = True
+
+        # 队列排空(空闲)时虚拟时间追上已分发的任务, 不排队的用户不会留下记录
+        for priority, queue in self._queues.items():
+            if not queue:
+                self._advance(priority, self._max_finish[priority])
+
+        if dispatched:
+            # 排队位置变化, 通知等待中的任务
+            for queue in self._queues.values():
+                for waiting in queue:
+                    waiting._notify()
+
+    def _advance(self, priority: str, virtual_time: float) -> None:
+        """推进虚拟时间, 并移除完成时间不晚于它的流"""
+        if virtual_time <= self._virtual_time[priority]:
+            return
+        self._virtual_time[priority] = virtual_time
+        finished = [
+            flow for flow, finish in self._last_finish.items()
+            if flow[0] == priority and finish <= virtual_time
+        ]
+        for flow in finished:
+            del self._last_finish[flow]
+
+    def release(self, ticket: Ticket) -> None:
+        """
+        归还名额或撤销排队
+
+        Args:
+            ticket: 排队凭证
+        """
+        if ticket.released:
+            return
+        ticket.released = True
+
+        if ticket.granted.is_set():
+            self._running -= 1
+            remaining = self._running_by_user.get(ticket.user_id, 1) - 1
+            if remaining:
+                self._running_by_user[ticket.user_id] = remaining
+            else:
+                self._running_by_user.pop(ticket.user_id, None)
+        else:
+            queue = self._queues[ticket.priority]
+            if ticket in queue:
+                queue.remove(ticket)
+                heapq.heapify(queue)
+                self.abandoned += 1
+            for waiting in itertools.chain.from_iterable(self._queues.values()):
+                waiting._notify()
+
+        if self.enabled:
+            self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """
+        计算排队位置
+
+        Args:
+            ticket: 排队凭证
+
+        Returns:
+            int: 从1开始的位置, 已分发或已撤销返回0
+        """
+        if ticket.granted.is_set() or ticket.released:
+            return 0
+        ahead = sum(1 for other in self._queues[ticket.priority] if other < ticket)
+        if ticket.priority == BATCH:
+            ahead += len(self._queues[INTERACTIVE])
+        return ahead + 1
+
+    def user_status(self, user_id: int) -> dict:
+        """
+        获取用户的排队状态
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            dict: 进行中的任务数和排队中任务的位置
+        """
+        waiting = [
+            ticket for ticket in itertools.chain.from_iterable(self._queues.values())
+            if ticket.user_id == user_id
+        ]
+        return {
+            "running": self._running_by_user.get(user_id, 0),
+            "queued": sorted(
+                ({"priority": t.priority, "position": self.position(t)} for t in waiting),
+                key=lambda item: item["position"]
+            ),
+            "queue_length": sum(len(queue) for queue in self._queues.values())
+        }
+
+    def stats(self) -> dict:
+        """
+        获取调度统计
+
+        Returns:
+            dict: 并发、队列长度和排队等待时间
+        """
+        return {
+            "enabled": self.enabled,
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "queued": {priority: len(queue) for priority, queue in self._queues.items()},
+            "tracked_flows": len(self._last_finish),
+            "dispatched": self.dispatched,
+            "abandoned": self.abandoned,
+            "tier_weights": self.tier_weights,
+            "queue_wait_ms": {
+                "p50": to_ms(self.queue_wait.percentile(50)),
+                "p95": to_ms(self.queue_wait.percentile(95)),
+                "p99": to_ms(self.queue_wait.percentile(99))
+            }
+        }
+
+
+class ScheduledStream:
+    """
+    排队后才开始的流式生成
+
+    ticket暴露给SSE层以推送排队位置; 迭代时先等待分发, 结束或中断时归还名额
+    """
+
+    def __init__(
+        self,
+        ticket: Ticket,
+        factory: Callable[[], Awaitable[AsyncGenerator[str, None]]]
+    ):
+        self.ticket = ticket
+        self._factory = factory
+        self._iterator = self._run()
+
+    async def _run(self) -> AsyncGenerator[str, None]:
+        async with self.ticket:
+            stream = await self._factory()
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+
+    def __aiter__(self) -> "ScheduledStream":
+        return self
+
+    async def __anext__(self) -> str:
+        return await self._iterator.__anext__()
+
+    async def aclose(self) -> None:
+        # 未开始迭代时生成器的finally不会执行, 需要直接归还名额
+        await self._iterator.aclose()
+        self.ticket.release()
+
+
+# 创建全局实例
+scheduler = FairScheduler(
+    max_concurrency=settings.SCHEDULER_MAX_CONCURRENCY,
+    tier_weights=settings.SCHEDULER_TIER_WEIGHTS,
+    enabled=settings.SCHEDULER_ENABLED
+)
@@ -0,0 +1,292 @@
+"""
+全文检索
+按消息内容搜索用户的会话, 结果按相关度排序并带高亮摘要
+
+索引由数据库维护, 消息写入时在同一事务中增量更新, 写入路径不需要额外处理:
+- PostgreSQL: to_tsvector(content)上的GIN表达式索引
+- SQLite: FTS5外部内容表messages_fts(trigram分词), 由触发器同步
+- 其他数据库: 不建索引, 逐行匹配
+"""
+import html
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from sqlalchemy import ColumnElement, Select, column, func, literal, literal_column, select, table
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..config import settings
+from ..database import engine
+from ..models import Conversation, Message
+
+# 数据库生成摘要时标记命中部分, 转义后替换为<mark>
+MARK_START = "\x02"
+MARK_END = "\x03"
+SNIPPET_TOKENS = 32  # 摘要长度(词数, trigram分词时约为字符数)
+SNIPPET_CONTEXT_CHARS = 40  # 逐行匹配时命中位置前后保留的字符数
+
+
+@dataclass
+class SearchHit:
+    """命中的一条消息"""
+    message: Message
+    conversation_title: str
+    rank: float
+    snippet: str  # 已转义的HTML, 命中部分用<mark>包裹
+
+
+def render_snippet(snippet: str) -> str:
+    """
+    把带标记的摘要转成HTML: 内容转义, 标记替换为<mark>
+
+    Args:
+        snippet: 用MARK_START/MARK_END标记命中部分的摘要
+
+    Returns:
+        str: 可直接渲染的HTML
+    """
+    return html.escape(snippet).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+def highlight(content: str, terms: List[str]) -> str:
+    """
+    在Python中生成摘要: 截取第一处命中的前后文, 标记其中所有命中
+
+    Args:
+        content: 消息内容
+        terms: 检索词
+
+    Returns:
+        str: 可直接渲染的HTML
+    """
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    first = pattern.search(content)
+    start = max(0, first.start() - SNIPPET_CONTEXT_CHARS) if first else 0
+    end = min(len(content), (first.end() if first else 0) + SNIPPET_CONTEXT_CHARS)
+    excerpt = pattern.sub(lambda m: MARK_START + m.group(0) + MARK_END, " ".join(content[start:end].split()))
+    return render_snippet(("…" if start > 0 else "") + excerpt + ("…" if end < len(content) else ""))
+
+
+class SearchBackend(ABC):
+    """
+    全文检索后端基类
+
+    子类提供匹配条件、相关度和摘要表达式, 检索流程(限定用户、计数、排序、分页)在基类中
+    """
+
+    name = ""
+    index_name: Optional[str] = None  # 检索使用的索引(执行计划检查用)
+
+    @staticmethod
+    def terms(text: str) -> List[str]:
+        """按空白拆分检索词"""
+        return text.split()
+
+    def for_text(self, text: str) -> "SearchBackend":
+        """选择处理该检索文本的后端(索引不适用时可退回逐行匹配)"""
+        return self
+
+    @abstractmethod
+    def matches(self, query: Select, text: str) -> Select:
+        """给以messages为主表的查询加上内容匹配条件"""
+
+    @abstractmethod
+    def rank(self, text: str) -> ColumnElement:
+        """相关度表达式, 越大越相关"""
+
+    def snippet(self, text: str) -> Optional[ColumnElement]:
+        """摘要表达式, 为None时在Python中生成"""
+        return None
+
+    def conversation_ids(self, user_id: int, text: str) -> Select:
+        """
+        用户会话中有消息命中的会话ID, 用作会话搜索的子查询
+
+        Args:
+            user_id: 用户ID
+            text: 检索文本
+
+        Returns:
+            Select: 会话ID查询
+        """
+        backend = self.for_text(text)
+        return backend.matches(
+            select(Message.conversation_id).join(
+                Conversation, Conversation.id == Message.conversation_id
+            ).where(Conversation.user_id == user_id),
+            text
+        )
+
+    async def search(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        text: str,
+        limit: int,
+        offset: int = 0
+    ) -> Tuple[int, List[SearchHit]]:
+        """
+        在用户的所有会话中检索消息
+
+        Args:
+            db: 数据库会话
+            user_id: 用户ID
+            text: 检索文本, 多个词之间为"且"
+            limit: 返回的记录数
+            offset: 跳过的记录数
+
+        Returns:
+            Tuple[int, List[SearchHit]]: 命中总数, 按相关度排序的一页结果
+        """
+        terms = self.terms(text)
+        if not terms:
+            return 0, []
+        backend = self.for_text(text)
+
+        def scoped(*columns) -> Select:
+            return backend.matches(
+                select(*columns).join(
+                    Conversation, Conversation.id == Message.conversation_id
+                ).where(Conversation.user_id == user_id),
+                text
+            )
+
+        total = await db.scalar(select(func.count()).select_from(scoped(Message.id).subquery()))
+        if not total:
+            return 0, []
+
+        rank = backend.rank(text).label("rank")
+        snippet = backend.snippet(text)
+        columns = [Message, Conversation.title, rank]
+        if snippet is not None:
+            columns.append(snippet.label("snippet"))
+        rows = (await db.execute(
+            scoped(*columns).order_by(rank.desc(), Message.id.desc()).limit(limit).offset(offset)
+        )).all()
+
+        return total, [
+            SearchHit(
+                message=row[0],
+                conversation_title=row[1],
+                rank=float(row[2] or 0),
+                snippet=render_snippet(row[3]) if snippet is not None else highlight(row[0].content, terms)
+            )
+            for row in rows
+        ]
+
+
+class LikeSearch(SearchBackend):
+    """逐行匹配(不区分大小写的子串), 不需要索引, 按时间倒序"""
+
+    name = "like"
+
+    def matches(self, query: Select, text: str) -> Select:
+        return query.where(*(
+            Message.content.icontains(term, autoescape=True) for term in self.terms(text)
+        ))
+
+    def rank(self, text: str) -> ColumnElement:
+        return literal(0.0)
+
+
+class SqliteSearch(SearchBackend):
+    """
+    SQLite FTS5(trigram分词)
+
+    trigram按字符切分, 中文也能按子串检索; 每个检索词至少3个字符才能使用索引,
+    含更短的词时退回逐行匹配
+    """
+
+    name = "sqlite"
+    index_name = "messages_fts"
+    MIN_TERM_LENGTH = 3
+
+    def __init__(self):
+        self._fts = table("messages_fts", column("rowid"))
+        self._fts_ref = literal_column("messages_fts")
+        self._fallback = LikeSearch()
+
+    def for_text(self, text: str) -> SearchBackend:
+        if all(len(term) >= self.MIN_TERM_LENGTH for term in self.terms(text)):
+            return self
+        return self._fallback
+
+    def _fts_query(self, text: str) -> str:
+        # 每个词作为短语加引号, 用户输入中的FTS5语法不生效
+        return " ".join('"' + term.replace('"', '""') + '"' for term in self.terms(text))
+
+    def matches(self, query: Select, text: str) -> Select:
+        return query.join(
+            self._fts, self._fts.c.rowid == Message.id
+        ).where(self._fts_ref.match(self._fts_query(text)))
+
+    def rank(self, text: str) -> ColumnElement:
+        # bm25越小越相关
+        return -func.bm25(self._fts_ref)
+
+    def snippet(self, text: str) -> ColumnElement:
+        return func.snippet(self._fts_ref, 0, MARK_START, MARK_END, "…", SNIPPET_TOKENS)
+
+
+class PostgresSearch(SearchBackend):
+    """
+    PostgreSQL全文检索(tsvector + GIN表达式索引)
+
+    查询中的to_tsvector表达式须与索引定义完全一致才能使用索引, 文本检索配置因此直接写入SQL
+    """
+
+    name = "postgres"
+    index_name = "ix_messages_content_fts"
+
+    def __init__(self, config: str):
+        if not re.fullmatch(r"\w+", config):
+            raise ValueError(f"无效的文本检索配置: {config}")
+        self._config = literal_column(f"'{config}'::regconfig")
+        self._headline_options = (
+            f"StartSel={MARK_START}, StopSel={MARK_END}, "
+            f"MaxWords={SNIPPET_TOKENS}, MinWords={SNIPPET_TOKENS // 4}, "
+            f"MaxFragments=2, FragmentDelimiter=…"
+        )
+
+    def _document(self) -> ColumnElement:
+        return func.to_tsvector(self._config, Message.content)
+
+    def _query(self, text: str) -> ColumnElement:
+        # 支持"短语"、or和-排除, 不会因用户输入报语法错误
+        return func.websearch_to_tsquery(self._config, text)
+
+    def matches(self, query: Select, text: str) -> Select:
+        return query.where(self._document().op("@@")(self._query(text)))
+
+    def rank(self, text: str) -> ColumnElement:
+        return func.ts_rank_cd(self._document(), self._query(text))
+
+    def snippet(self, text: str) -> ColumnElement:
+        return func.ts_headline(self._config, Message.content, self._query(text), self._headline_options)
+
+
+def build_search_backend(name: str, dialect: str) -> SearchBackend:
+    """
+    根据配置名称创建全文检索后端
+
+    Args:
+        name: auto / postgres / sqlite / like
+        dialect: 数据库方言名称, auto时据此选择
+
+    Returns:
+        SearchBackend: 全文检索后端
+    """
+    if name == "auto":
+        name = {"postgresql": "postgres", "sqlite": "sqlite"}.get(dialect, "like")
+
+    if name == "postgres":
+        return PostgresSearch(settings.SEARCH_PG_CONFIG)
+    elif name == "sqlite":
+        return SqliteSearch()
+    elif name == "like":
+        return LikeSearch()
+    else:
+        raise ValueError(f"不支持的全文检索后端: {name}")
+
+
+# 创建全局实例
+message_search = build_search_backend(settings.SEARCH_BACKEND, engine.dialect.name)
@@ -0,0 +1,361 @@
+"""
+语义缓存
+对最后一轮用户提问做向量化, 在按模型划分的余弦相似度索引中查找近似问题,
+命中时直接复用之前的回复
+"""
+import hashlib
+import logging
+import re
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from ..config import settings
+from .llm_clients import LLMClientPool, llm_client_pool
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]")
+
+
+class Embedder(ABC):
+    """
+    向量化器基类
+
+    子类实现embed, 返回L2归一化后的float32向量
+    """
+
+    dim: int = 0
+
+    @abstractmethod
+    async def embed(self, text: str) -> np.ndarray:
+        ...
+
+
+class HashingEmbedder(Embedder):
+    """
+    本地哈希向量化器
+
+    特征: 英文单词、相邻词二元组、单词内字符三元组、中文单字及二元组,
+    通过特征哈希映射到固定维度, 词频做对数平滑。无需网络和训练数据。
+    """
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[Tuple[str, float]]:
+        """提取(特征, 权重)列表"""
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        features = [(token, 1.0) for token in tokens]
+        features.extend(
+            (f"{a} {b}", 1.0) for a, b in zip(tokens, tokens[1:])
+        )
+        for token in tokens:
+            if len(token) > 3:
+                padded = f"<{token}>"
+                features.extend(
+                    (padded[i:i + 3], 0.3) for i in range(len(padded) - 2)
+                )
+        return features
+
+    def embed_sync(self, text: str) -> np.ndarray:
+        """同步向量化"""
+        features = self._features(text)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not features:
+            return vector
+
+        hashes = np.fromiter(
+            (zlib.crc32(feature.encode("utf-8")) for feature, _ in features),
+            dtype=np.uint32,
+            count=len(features)
+        )
+        weights = np.fromiter(
+            (weight for _, weight in features),
+            dtype=np.float32,
+            count=len(features)
+        )
+        # 最高位决定符号, 降低哈希冲突带来的偏差
+        signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+        counts = np.bincount(
+            hashes % self.dim,
+            weights=weights * signs,
+            minlength=self.dim
+        ).astype(np.float32)
+
+        vector = np.sign(counts) * np.log1p(np.abs(counts))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    async def embed(self, text: str) -> np.ndarray:
+        return self.embed_sync(text)
+
+
+class OpenAIEmbedder(Embedder):
+    """使用OpenAI Embeddings接口的向量化器"""
+
+    def __init__(
+        self,
+        model: str = "text-embedding-3-small",
+        dim: int = 1536,
+        client_pool: LLMClientPool = llm_client_pool
+    ):
+        self.model = model
+        self.dim = dim
+        self.client_pool = client_pool
+
+    async def embed(self, text: str) -> np.ndarray:
+        client = self.client_pool.openai
+        if not client:
+            raise ValueError("OpenAI API密钥未配置")
+        response = await client.embeddings.create(model=self.model, input=text)
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+class SimilarityIndex:
+    """
+    单个作用域内的余弦相似度索引
+
+    向量预分配在连续的NumPy矩阵中, 查询是一次矩阵-向量乘法。
+    达到容量后覆盖最久未使用的槽位。
+    """
+
+    def __init__(self, dim: int, capacity: int):
+        self.capacity = capacity
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._expires_at = np.zeros(capacity, dtype=np.float64)
+        self._values: List[Optional[str]] = [None] * capacity
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def search(self, query: np.ndarray, threshold: float) -> Optional[Tuple[str, float]]:
+        """
+        查找最相似的条目
+
+        Returns:
+            Optional[Tuple[str, float]]: (回复, 相似度), 低于阈值或已过期返回None
+        """
+        if self._size == 0:
+            return None
+
+        now = time.monotonic()
+        scores = self._vectors[:self._size] @ query
+        scores[self._expires_at[:self._size] <= now] = -1.0
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if score < threshold:
+            return None
+
+        self._last_used[best] = now
+        return self._values[best], score
+
+    def add(self, vector: np.ndarray, value: str, ttl_seconds: float) -> bool:
+        """
+        添加条目
+
+        Returns:
+            bool: 是否淘汰了旧条目
+        """
+        now = time.monotonic()
+        evicted = False
+        if self._size < self.capacity:
+            slot = self._size
+            self._size += 1
+        else:
+            # 优先覆盖已过期的条目, 否则覆盖最久未使用的
+            expired = np.flatnonzero(self._expires_at <= now)
+            slot = int(expired[0]) if expired.size else int(np.argmin(self._last_used))
+            evicted = True
+
+        self._vectors[slot] = vector
+        self._values[slot] = value
+        self._last_used[slot] = now
+        self._expires_at[slot] = now + ttl_seconds
+        return evicted
+
+
+class SemanticCache:
+    """语义缓存类"""
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        threshold: float = 0.92,
+        max_entries_per_model: int = 5000,
+        ttl_seconds: float = 86400.0,
+        max_user_turns: int = 1,
+        enabled: bool = False
+    ):
+        """
+        初始化语义缓存
+
+        Args:
+            embedder: 向量化器
+            threshold: 余弦相似度阈值
+            max_entries_per_model: 每个模型作用域的条目上限
+            ttl_seconds: 条目存活时间(秒)
+            max_user_turns: 只缓存用户轮数不超过该值的请求(避免上下文不同的追问误命中)
+            enabled: 是否启用
+        """
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries_per_model = max_entries_per_model
+        self.ttl_seconds = ttl_seconds
+        self.max_user_turns = max_user_turns
+        self.enabled = enabled
+
+        self._indexes: Dict[str, SimilarityIndex] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """
+        向量化, 失败时记录并返回None
+
+        远程向量化器超时或被限流时缓存按未命中处理, 不影响聊天请求本身
+        """
+        try:
+            return await self.embedder.embed(text)
+        except Exception:
+            self.errors += 1
+            logger.warning("语义缓存向量化失败, 按未命中处理", exc_info=True)
+            return None
+
+    def _scope(self, model: str, messages: List[Dict[str, str]]) -> Optional[Tuple[str, str]]:
+        """
+        计算作用域和待向量化的文本
+
+        作用域 = 模型 + 系统提示哈希; 多轮对话不参与语义缓存
+
+        Returns:
+            Optional[Tuple[str, str]]: (作用域, 最后一轮用户提问)
+        """
+        user_turns = [msg["content"] for msg in messages if msg["role"] == "user"]
+        if not user_turns or len(user_turns) > self.max_user_turns:
+            return None
+        if messages[-1]["role"] != "user":
+            return None
+
+        system_prompt = "\n".join(
+            msg["content"] for msg in messages if msg["role"] == "system"
+        )
+        system_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+        return f"{model}:{system_hash}", user_turns[-1]
+
+    async def lookup(self, model: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        """
+        查找语义相近的缓存回复
+
+        Args:
+            model: 模型名称
+            messages: 消息列表
+
+        Returns:
+            Optional[str]: 命中返回回复, 否则返回None
+        """
+        scope = self._scope(model, messages)
+        if scope is None:
+            return None
+
+        scope_key, text = scope
+        index = self._indexes.get(scope_key)
+        if index is None or len(index) == 0:
+            self.misses += 1
+            return None
+
+        vector = await self._embed(text)
+        result = index.search(vector, self.threshold) if vector is not None else None
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return result[0]
+
+    async def store(self, model: str, messages: List[Dict[str, str]], response: str) -> None:
+        """
+        写入缓存
+
+        Args:
+            model: 模型名称
+            messages: 消息列表
+            response: 回复内容
+        """
+        scope = self._scope(model, messages)
+        if scope is None or not response:
+            return
+
+        scope_key, text = scope
+        vector = await self._embed(text)
+        if vector is None:
+            return
+
+        index = self._indexes.get(scope_key)
+        if index is None:
+            index = SimilarityIndex(self.embedder.dim, self.max_entries_per_model)
+            self._indexes[scope_key] = index
+
+        if index.add(vector, response, self.ttl_seconds):
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._indexes.clear()
+
+    def stats(self) -> dict:
+        """
+        获取缓存统计
+
+        Returns:
+            dict: 命中、未命中、淘汰、向量化失败等计数
+        """
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "scopes": len(self._indexes),
+            "entries": sum(len(index) for index in self._indexes.values()),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+def build_embedder(name: str) -> Embedder:
+    """
+    根据配置名称创建向量化器
+
+    Args:
+        name: hashing 或 openai
+
+    Returns:
+        Embedder: 向量化器实例
+    """
+    if name == "hashing":
+        return HashingEmbedder(dim=settings.SEMANTIC_CACHE_HASHING_DIM)
+    elif name == "openai":
+        return OpenAIEmbedder(model=settings.SEMANTIC_CACHE_OPENAI_MODEL)
+    else:
+        raise ValueError(f"不支持的向量化器: {name}")
+
+
+# 创建全局实例
+semantic_cache = SemanticCache(
+    embedder=build_embedder(settings.SEMANTIC_CACHE_EMBEDDER),
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    max_entries_per_model=settings.SEMANTIC_CACHE_MAX_ENTRIES_PER_MODEL,
+    ttl_seconds=settings.SEMANTIC_CACHE_TTL_SECONDS,
+    max_user_turns=settings.SEMANTIC_CACHE_MAX_USER_TURNS,
+    enabled=settings.SEMANTIC_CACHE_ENABLED
+)
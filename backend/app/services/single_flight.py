@@ -0,0 +1,191 @@
+"""
+请求合并(single-flight)
+同一模型、同一消息列表的并发请求共享一次上游生成
+"""
+import asyncio
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional
+from ..config import settings
+
+
+class _StreamFlight:
+    """
+    一次进行中的流式生成
+
+    生产者任务把上游分块追加到缓冲区, 每个订阅者从头读取已产生的分块,
+    再等待后续分块。生产者在第一个订阅者开始迭代时才启动, 所有订阅者都离开后取消上游生成。
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Awaitable[AsyncGenerator[str, None]]],
+        on_done: Callable[["_StreamFlight"], None]
+    ):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._factory = factory
+        self._on_done = on_done
+        self._changed = asyncio.Event()
+
+    def _start(self) -> None:
+        """启动生产者任务(只启动一次)"""
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.produce(self._factory))
+            self.task.add_done_callback(lambda _: self._on_done(self))
+
+    def _notify(self) -> None:
+        """唤醒所有等待中的订阅者"""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def produce(self, factory: Callable[[], Awaitable[AsyncGenerator[str, None]]]) -> None:
+        """消费上游流并写入缓冲区"""
+        stream = None
+        try:
+            stream = await factory()
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = RuntimeError("生成已取消")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            if stream is not None:
+                await stream.aclose()
+            self.done = True
+            self._notify()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        """
+        先回放已产生的分块, 再跟随实时输出
+
+        生成器体在首次__anext__时才执行: 调用方拿到生成器后从未迭代就丢弃,
+        不会留下无人读取的上游请求
+        """
+        self.subscribers += 1
+        self._start()
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    index += 1
+                    yield chunk
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                self.task.cancel()
+
+
+class SingleFlight:
+    """请求合并类"""
+
+    def __init__(self, enabled: bool = True):
+        """
+        初始化
+
+        Args:
+            enabled: 是否启用, 关闭时每个请求独立调用上游
+        """
+        self.enabled = enabled
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+
+        self.leaders = 0
+        self.followers = 0
+
+    async def call(self, key: str, factory: Callable[[], Awaitable[str]]) -> str:
+        """
+        非流式调用: 相同key的并发请求等待同一个结果
+
+        Args:
+            key: 请求标识
+            factory: 发起上游调用的协程工厂
+
+        Returns:
+            str: 回复内容
+        """
+        if not self.enabled:
+            return await factory()
+
+        future = self._calls.get(key)
+        if future is None:
+            self.leaders += 1
+            future = asyncio.ensure_future(factory())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.followers += 1
+
+        # shield: 单个调用方取消不影响其他等待者
+        return await asyncio.shield(future)
+
+    def stream(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[AsyncGenerator[str, None]]]
+    ) -> AsyncGenerator[str, None]:
+        """
+        流式调用: 后到的请求先收到已产生的分块, 再跟随实时输出
+
+        Args:
+            key: 请求标识
+            factory: 返回上游流的协程工厂
+
+        Returns:
+            AsyncGenerator: 分块流
+        """
+        if not self.enabled:
+            return self._direct_stream(factory)
+
+        flight = self._streams.get(key)
+        if flight is None or flight.done:
+            self.leaders += 1
+            flight = _StreamFlight(factory, lambda done: self._remove_stream(key, done))
+            self._streams[key] = flight
+        else:
+            self.followers += 1
+
+        return flight.subscribe()
+
+    @staticmethod
+    async def _direct_stream(
+        factory: Callable[[], Awaitable[AsyncGenerator[str, None]]]
+    ) -> AsyncGenerator[str, None]:
+        """不合并时直接透传上游流"""
+        async for chunk in await factory():
+            yield chunk
+
+    def _remove_stream(self, key: str, flight: _StreamFlight) -> None:
+        """生成结束后移除, 之后的相同请求重新发起"""
+        if self._streams.get(key) is flight:
+            del self._streams[key]
+
+    def stats(self) -> dict:
+        """
+        获取合并统计
+
+        Returns:
+            dict: 进行中的请求数和合并次数
+        """
+        return {
+            "enabled": self.enabled,
+            "in_flight_calls": len(self._calls),
+            "in_flight_streams": len(self._streams),
+            "leaders": self.leaders,
+            "followers": self.followers
+        }
+
+
+# 创建全局实例
+single_flight = SingleFlight(enabled=settings.SINGLE_FLIGHT_ENABLED)
@@ -0,0 +1,331 @@
+"""
+Token计数服务
+按模型家族使用本地加载的BPE词表(tiktoken格式)精确计数,
+词表不可用时退回向量化的启发式估算; 结果按内容哈希缓存
+"""
+import base64
+import hashlib
+import logging
+import math
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from ..config import settings
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - 未安装tiktoken时只使用启发式估算
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# tiktoken编码的预分词正则和特殊token
+_CL100K_PAT_STR = (
+    r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}|"""
+    r""" ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+_O200K_PAT_STR = "|".join([
+    r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]*[\p{Ll}\p{Lm}\p{Lo}\p{M}]+(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+    r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]+[\p{Ll}\p{Lm}\p{Lo}\p{M}]*(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+    r"""\p{N}{1,3}""",
+    r""" ?[^\s\p{L}\p{N}]+[\r\n/]*""",
+    r"""\s*[\r\n]+""",
+    r"""\s+(?!\S)""",
+    r"""\s+""",
+])
+
+ENCODING_SPECS: Dict[str, Tuple[str, Dict[str, int]]] = {
+    "cl100k_base": (_CL100K_PAT_STR, {
+        "<|endoftext|>": 100257,
+        "<|fim_prefix|>": 100258,
+        "<|fim_middle|>": 100259,
+        "<|fim_suffix|>": 100260,
+        "<|endofprompt|>": 100276,
+    }),
+    "o200k_base": (_O200K_PAT_STR, {
+        "<|endoftext|>": 199999,
+        "<|endofprompt|>": 200018,
+    }),
+}
+
+# 模型前缀 -> 编码(按顺序匹配, 更具体的前缀在前)
+# Anthropic和DeepSeek没有公开的tiktoken词表, 使用cl100k_base近似
+MODEL_ENCODINGS: List[Tuple[str, str]] = [
+    ("gpt-4o", "o200k_base"),
+    ("o1", "o200k_base"),
+    ("gpt-4", "cl100k_base"),
+    ("gpt-3.5", "cl100k_base"),
+    ("claude", "cl100k_base"),
+    ("deepseek", "cl100k_base"),
+]
+DEFAULT_ENCODING = "cl100k_base"
+
+# 启发式估算时每个CJK字符对应的token数
+_HEURISTIC_CJK_RATIO = {
+    "cl100k_base": 1.4,
+    "o200k_base": 1.0,
+}
+
+# 流式计数时可安全断开的字符(预分词在这些字符之前断开)
+_STREAM_BOUNDARY_CHARS = frozenset(" \t\n，。！？；：、")
+# 长时间没有断点时强制结算的尾部长度
+_STREAM_MAX_PENDING = 256
+
+# 聊天格式中每条消息和回复引导的额外token
+MESSAGE_OVERHEAD_TOKENS = 3
+REPLY_PRIMING_TOKENS = 3
+
+
+def load_tiktoken_vocab(path: str) -> Dict[bytes, int]:
+    """
+    读取tiktoken格式的词表文件(每行: base64编码的token 空格 rank)
+
+    Args:
+        path: 词表文件路径
+
+    Returns:
+        Dict[bytes, int]: token字节串到rank的映射
+    """
+    ranks = {}
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            token, rank = line.split()
+            ranks[base64.b64decode(token)] = int(rank)
+    return ranks
+
+
+def heuristic_count(text: str, encoding_name: str = DEFAULT_ENCODING) -> int:
+    """
+    向量化启发式估算
+
+    按码点一次性分类: ASCII约4字符1个token, CJK按编码的经验比例,
+    其余非ASCII字符约2字符1个token
+
+    Args:
+        text: 文本内容
+        encoding_name: 编码名称
+
+    Returns:
+        int: 估算的Token数量
+    """
+    if not text:
+        return 0
+
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    ascii_count = int(np.count_nonzero(codes < 0x80))
+    cjk_count = int(np.count_nonzero(
+        ((codes >= 0x4E00) & (codes <= 0x9FFF))
+        | ((codes >= 0x3400) & (codes <= 0x4DBF))
+        | ((codes >= 0x3040) & (codes <= 0x30FF))
+        | ((codes >= 0xAC00) & (codes <= 0xD7AF))
+    ))
+    other_count = codes.size - ascii_count - cjk_count
+
+    cjk_ratio = _HEURISTIC_CJK_RATIO.get(encoding_name, 1.4)
+    return max(1, math.ceil(ascii_count / 4 + cjk_count * cjk_ratio + other_count / 2))
+
+
+class StreamingTokenCounter:
+    """
+    流式增量计数器
+
+    BPE的合并不会跨越预分词边界, 而预分词在空白和标点之前断开,
+    因此只对最后一个断点之前的已稳定部分计数, 剩余尾部留到下一次
+    """
+
+    def __init__(self, counter: "TokenCounter", model: Optional[str] = None):
+        self._counter = counter
+        self._model = model
+        self._counted = 0
+        self._pending = ""
+
+    def feed(self, delta: str) -> None:
+        """
+        追加一段流式输出
+
+        Args:
+            delta: 新增的文本
+        """
+        self._pending += delta
+        pending = self._pending
+
+        # 之前的断点都已结算, 只需要扫描新增部分
+        cut = 0
+        for i in range(len(pending) - 1, max(0, len(pending) - len(delta) - 1), -1):
+            if pending[i] in _STREAM_BOUNDARY_CHARS:
+                cut = i
+                break
+        if cut == 0 and len(pending) > _STREAM_MAX_PENDING:
+            cut = len(pending)
+
+        if cut > 0:
+            self._counted += self._counter.count(pending[:cut], self._model, memoize=False)
+            self._pending = pending[cut:]
+
+    @property
+    def total(self) -> int:
+        """当前累计的Token数量"""
+        if not self._pending:
+            return self._counted
+        return self._counted + self._counter.count(self._pending, self._model, memoize=False)
+
+
+class TokenCounter:
+    """Token计数服务类"""
+
+    def __init__(self, vocab_dir: str = "", memo_size: int = 4096):
+        """
+        初始化计数器
+
+        Args:
+            vocab_dir: 存放 <编码名>.tiktoken 词表文件的目录
+            memo_size: 按内容哈希缓存的计数结果条数
+        """
+        self.vocab_dir = vocab_dir
+        self.memo_size = memo_size
+        self._encodings: Dict[str, Optional[object]] = {}
+        self._memo: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+    @staticmethod
+    def encoding_for_model(model: Optional[str]) -> str:
+        """
+        获取模型使用的编码名称
+
+        Args:
+            model: 模型名称
+
+        Returns:
+            str: 编码名称
+        """
+        if model:
+            for prefix, encoding_name in MODEL_ENCODINGS:
+                if model.startswith(prefix):
+                    return encoding_name
+        return DEFAULT_ENCODING
+
+    def _get_encoding(self, encoding_name: str):
+        """延迟加载BPE编码, 不可用时缓存None以便直接走启发式"""
+        if encoding_name in self._encodings:
+            return self._encodings[encoding_name]
+
+        encoding = None
+        path = os.path.join(self.vocab_dir, f"{encoding_name}.tiktoken") if self.vocab_dir else ""
+        if tiktoken is None:
+            logger.info("未安装tiktoken, Token计数使用启发式估算")
+        elif encoding_name not in ENCODING_SPECS:
+            logger.warning("未知编码 %s, Token计数使用启发式估算", encoding_name)
+        elif not path or not os.path.exists(path):
+            logger.info("未找到词表文件 %s, Token计数使用启发式估算", path or encoding_name)
+        else:
+            pat_str, special_tokens = ENCODING_SPECS[encoding_name]
+            encoding = tiktoken.Encoding(
+                name=encoding_name,
+                pat_str=pat_str,
+                mergeable_ranks=load_tiktoken_vocab(path),
+                special_tokens=special_tokens,
+            )
+
+        self._encodings[encoding_name] = encoding
+        return encoding
+
+    def is_exact(self, model: Optional[str] = None) -> bool:
+        """模型是否使用真实BPE词表计数"""
+        return self._get_encoding(self.encoding_for_model(model)) is not None
+
+    def count(self, text: str, model: Optional[str] = None, memoize: bool = True) -> int:
+        """
+        计算文本的Token数量
+
+        Args:
+            text: 文本内容
+            model: 模型名称
+            memoize: 是否使用按内容哈希的缓存
+
+        Returns:
+            int: Token数量
+        """
+        if not text:
+            return 0
+
+        encoding_name = self.encoding_for_model(model)
+        key = None
+        if memoize:
+            digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+            key = (encoding_name, digest)
+            cached = self._memo.get(key)
+            if cached is not None:
+                self._memo.move_to_end(key)
+                self.memo_hits += 1
+                return cached
+            self.memo_misses += 1
+
+        encoding = self._get_encoding(encoding_name)
+        if encoding is not None:
+            tokens = len(encoding.encode_ordinary(text))
+        else:
+            tokens = heuristic_count(text, encoding_name)
+
+        if key is not None:
+            self._memo[key] = tokens
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return tokens
+
+    def count_messages(self, messages: List[Dict[str, str]], model: Optional[str] = None) -> int:
+        """
+        计算聊天消息列表作为提示词时的Token数量
+
+        Args:
+            messages: 消息列表
+            model: 模型名称
+
+        Returns:
+            int: Token数量(含每条消息的格式开销)
+        """
+        total = REPLY_PRIMING_TOKENS
+        for msg in messages:
+            total += MESSAGE_OVERHEAD_TOKENS + self.count(msg["content"], model)
+        return total
+
+    def streaming(self, model: Optional[str] = None) -> StreamingTokenCounter:
+        """
+        创建流式增量计数器
+
+        Args:
+            model: 模型名称
+
+        Returns:
+            StreamingTokenCounter: 增量计数器
+        """
+        return StreamingTokenCounter(self, model)
+
+    def stats(self) -> dict:
+        """
+        获取计数器统计
+
+        Returns:
+            dict: 已加载的编码和缓存命中情况
+        """
+        return {
+            "encodings": {
+                name: encoding is not None
+                for name, encoding in self._encodings.items()
+            },
+            "memo_entries": len(self._memo),
+            "memo_hits": self.memo_hits,
+            "memo_misses": self.memo_misses
+        }
+
+
+# 创建全局实例
+token_counter = TokenCounter(
+    vocab_dir=settings.TOKENIZER_VOCAB_DIR,
+    memo_size=settings.TOKENIZER_MEMO_SIZE
+)
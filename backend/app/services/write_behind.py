@@ -0,0 +1,192 @@
+"""
+延迟写入
+使用记录和会话标题等非关键写入先缓存在内存中, 由后台任务按数量或时间批量写入,
+回复消息本身仍在请求中同步写入; 写入失败的数据放回缓冲区下次重试, 关闭时全部写入(至少一次)
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Set
+from sqlalchemy import func, insert, select, update
+from ..config import settings
+from ..database import AsyncSessionLocal
+from ..models import ApiUsage, Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+# 新会话的默认标题, 收到第一条回复后改为第一条用户消息
+DEFAULT_TITLE = "新对话"
+TITLE_LENGTH = 30
+
+
+class WriteBehindBuffer:
+    """
+    延迟写入缓冲区
+
+    - 使用记录: 攒够batch_size条或每隔flush_interval秒批量插入
+    - 会话标题: 记录待更新的会话ID, 去重后一条UPDATE语句完成
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_pending: int = 100000
+    ):
+        """
+        初始化
+
+        Args:
+            enabled: 是否启用, 关闭时每次记录后立即写入
+            batch_size: 缓存的使用记录达到该数量时立即写入
+            flush_interval: 定时写入间隔(秒)
+            max_pending: 数据库不可用时最多保留的使用记录数, 超出时丢弃最早的
+        """
+        self.enabled = enabled
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._usages: List[Dict[str, Any]] = []
+        self._titles: Set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._worker = None
+        self.flushed_usages = 0
+        self.flushed_titles = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+
+    async def start(self) -> None:
+        """启动后台写入任务"""
+        if self.enabled and self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def aclose(self) -> None:
+        """停止后台任务并写入剩余数据"""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        await self.flush()
+
+    async def add_usage(self, **values: Any) -> None:
+        """
+        记录一次API使用
+
+        Args:
+            values: ApiUsage的列值
+        """
+        values.setdefault("created_at", datetime.now(timezone.utc))
+        self._usages.append(values)
+        await self._after_add(len(self._usages) >= self.batch_size)
+
+    async def update_title(self, conversation_id: int) -> None:
+        """
+        标记会话需要更新标题(仍为默认标题时改为第一条用户消息)
+
+        Args:
+            conversation_id: 会话ID
+        """
+        self._titles.add(conversation_id)
+        await self._after_add(False)
+
+    async def _after_add(self, full: bool) -> None:
+        if not self.enabled or self._worker is None:
+            # 未启用或后台任务未运行(脚本中使用)时直接写入
+            await self.flush()
+        elif full:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 已在flush中放回缓冲区, 下个周期重试
+                logger.exception("延迟写入失败, 稍后重试")
+
+    async def flush(self) -> None:
+        """写入当前缓存的所有数据, 失败时放回缓冲区并抛出异常"""
+        async with self._flush_lock:
+            usages, self._usages = self._usages, []
+            titles, self._titles = self._titles, set()
+            if not usages and not titles:
+                return
+
+            try:
+                async with AsyncSessionLocal() as db:
+                    if usages:
+                        await db.execute(insert(ApiUsage), usages)
+                    if titles:
+                        await db.execute(self._title_statement(titles))
+                    await db.commit()
+            except BaseException:
+                self.failures += 1
+                self._usages[:0] = usages
+                self._titles |= titles
+                overflow = len(self._usages) - self.max_pending
+                if overflow > 0:
+                    del self._usages[:overflow]
+                    self.dropped += overflow
+                    logger.error("延迟写入积压过多, 丢弃%d条使用记录", overflow)
+                raise
+
+            self.flushes += 1
+            self.flushed_usages += len(usages)
+            self.flushed_titles += len(titles)
+
+    @staticmethod
+    def _title_statement(conversation_ids: Set[int]):
+        """仍为默认标题的会话改用第一条用户消息(截取前30个字符)作为标题"""
+        first_user_message = select(
+            Message.content
+        ).where(
+            Message.conversation_id == Conversation.id,
+            Message.role == "user"
+        ).order_by(
+            Message.id.asc()
+        ).limit(1).scalar_subquery()
+
+        return update(Conversation).where(
+            Conversation.id.in_(sorted(conversation_ids)),
+            Conversation.title == DEFAULT_TITLE
+        ).values(
+            title=func.substr(first_user_message, 1, TITLE_LENGTH)
+        ).execution_options(synchronize_session=False)
+
+    def stats(self) -> dict:
+        """
+        获取延迟写入统计
+
+        Returns:
+            dict: 待写入数量和累计写入/失败次数
+        """
+        return {
+            "enabled": self.enabled,
+            "running": self._worker is not None,
+            "pending_usages": len(self._usages),
+            "pending_titles": len(self._titles),
+            "flushes": self.flushes,
+            "flushed_usages": self.flushed_usages,
+            "flushed_titles": self.flushed_titles,
+            "failures": self.failures,
+            "dropped": self.dropped
+        }
+
+
+# 创建全局实例
+write_behind = WriteBehindBuffer(
+    enabled=settings.WRITE_BEHIND_ENABLED,
+    batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=settings.WRITE_BEHIND_FLUSH_INTERVAL,
+    max_pending=settings.WRITE_BEHIND_MAX_PENDING
+)
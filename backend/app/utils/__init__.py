@@ -9,6 +9,7 @@ from .security import (
     decode_token
 )
 from .dependencies import get_current_user, get_current_admin_user
+from .metrics import LatencyTracker, PoolMonitor, pool_monitor
 
 __all__ = [
     "verify_password",
@@ -18,4 +19,7 @@ __all__ = [
     "decode_token",
     "get_current_user",
     "get_current_admin_user",
+    "LatencyTracker",
+    "PoolMonitor",
+    "pool_monitor",
 ]
@@ -3,8 +3,8 @@ FastAPI依赖注入函数
 """
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from ..database import get_db
+from sqlalchemy import select
+from ..database import AsyncSessionLocal
 from ..models import User
 from .security import decode_token
 
@@ -13,15 +13,16 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 
 async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    token: str = Depends(oauth2_scheme)
 ) -> User:
     """
     获取当前登录用户
 
+    使用独立的短会话, 查询完立即归还连接; 依赖会话要到响应结束才关闭,
+    流式接口会因此在整个响应期间占用连接
+
     Args:
         token: JWT Token
-        db: 数据库会话
 
     Returns:
         User: 当前用户对象
@@ -43,7 +44,8 @@ async def get_current_user(
     if user_id is None:
         raise credentials_exception
 
-    user = db.query(User).filter(User.id == user_id).first()
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(User).where(User.id == user_id))
     if user is None:
         raise credentials_exception
 
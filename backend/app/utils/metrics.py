@@ -0,0 +1,121 @@
+"""
+指标工具
+滑动窗口延迟统计、数据库连接池占用统计等
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+import numpy as np
+
+
+class LatencyTracker:
+    """滑动窗口延迟统计(秒)"""
+
+    def __init__(self, window: int = 500):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        计算延迟分位数
+
+        Args:
+            p: 分位(0-100)
+
+        Returns:
+            Optional[float]: 分位延迟, 没有样本时返回None
+        """
+        if not self._samples:
+            return None
+        return float(np.percentile(np.fromiter(self._samples, dtype=np.float64), p))
+
+
+def to_ms(seconds: Optional[float]) -> Optional[float]:
+    """秒转毫秒(保留一位小数), None原样返回"""
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class PoolMonitor:
+    """
+    数据库连接池占用统计
+
+    通过连接池事件记录每次借出到归还的占用时长和当前借出数,
+    用于发现长时间持有连接的代码路径
+    """
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._window = window
+        self._engines: Dict[str, Any] = {}
+        self._checked_out: Dict[str, int] = {}
+        self._peak: Dict[str, int] = {}
+        self._checkouts: Dict[str, int] = {}
+        self._hold_time: Dict[str, LatencyTracker] = {}
+
+    def attach(self, name: str, engine: Any) -> None:
+        """
+        监听引擎的连接池事件
+
+        Args:
+            name: 统计中显示的引擎名称
+            engine: 同步引擎(异步引擎传入其sync_engine)
+        """
+        from sqlalchemy import event
+
+        self._engines[name] = engine
+        self._checked_out[name] = 0
+        self._peak[name] = 0
+        self._checkouts[name] = 0
+        self._hold_time[name] = LatencyTracker(self._window)
+
+        def on_checkout(dbapi_connection, record, proxy) -> None:
+            record.info["pool_checkout_at"] = time.perf_counter()
+            with self._lock:
+                self._checkouts[name] += 1
+                self._checked_out[name] += 1
+                self._peak[name] = max(self._peak[name], self._checked_out[name])
+
+        def on_checkin(dbapi_connection, record) -> None:
+            started = record.info.pop("pool_checkout_at", None)
+            if started is None:
+                return
+            with self._lock:
+                self._checked_out[name] -= 1
+                self._hold_time[name].record(time.perf_counter() - started)
+
+        event.listen(engine, "checkout", on_checkout)
+        event.listen(engine, "checkin", on_checkin)
+
+    def stats(self) -> dict:
+        """
+        获取连接池统计
+
+        Returns:
+            dict: 各引擎的连接池状态、当前/峰值借出数和连接占用时长
+        """
+        with self._lock:
+            return {
+                name: {
+                    "pool": engine.pool.status(),
+                    "checked_out": self._checked_out[name],
+                    "peak_checked_out": self._peak[name],
+                    "checkouts": self._checkouts[name],
+                    "hold_ms": {
+                        "p50": to_ms(self._hold_time[name].percentile(50)),
+                        "p95": to_ms(self._hold_time[name].percentile(95)),
+                        "p99": to_ms(self._hold_time[name].percentile(99)),
+                        "max": to_ms(self._hold_time[name].percentile(100))
+                    }
+                }
+                for name, engine in self._engines.items()
+            }
+
+
+# 创建全局实例
+pool_monitor = PoolMonitor()
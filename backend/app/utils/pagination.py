@@ -0,0 +1,134 @@
+"""
+游标分页
+游标携带上一页边界行的排序键和ID, 对客户端不透明; 查询直接与游标中的值比较,
+边界行被删除或排序键(如会话的updated_at)变化后仍从原位置继续
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, timezone
+from typing import Any, Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import ColumnElement, DateTime, String, literal, tuple_
+from sqlalchemy.types import TypeDecorator
+
+
+class CursorTimestamp(TypeDecorator):
+    """
+    游标中排序时间的绑定类型
+
+    SQLite以文本存储时间, server_default(CURRENT_TIMESTAMP)写入的值不带微秒,
+    而DateTime类型绑定参数时总是补上".000000", 按文本比较时相同的时间不相等;
+    这里按存储格式生成文本, 有微秒时才带上. 其他数据库按DateTime(timezone=True)绑定
+    """
+
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "sqlite":
+            return dialect.type_descriptor(String())
+        return dialect.type_descriptor(DateTime(timezone=True))
+
+    def process_bind_param(self, value: Optional[datetime], dialect) -> Any:
+        if value is None or dialect.name != "sqlite":
+            return value
+        if value.tzinfo is not None:
+            # SQLite中的时间为UTC
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        text = value.strftime("%Y-%m-%d %H:%M:%S")
+        return text + f".{value.microsecond:06d}" if value.microsecond else text
+
+
+def _invalid_cursor() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="无效的分页游标"
+    )
+
+
+def _decode_payload(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeEncodeError, binascii.Error):
+        raise _invalid_cursor()
+    if not isinstance(payload, dict):
+        raise _invalid_cursor()
+    row_id = payload.get("id")
+    if not isinstance(row_id, int) or isinstance(row_id, bool):
+        raise _invalid_cursor()
+    return payload
+
+
+def encode_cursor(row_id: int, sort_key: Optional[datetime] = None) -> str:
+    """
+    生成分页游标
+
+    Args:
+        row_id: 边界行的ID
+        sort_key: 边界行的排序时间, 只按ID排序时为None
+
+    Returns:
+        str: URL安全的游标字符串
+    """
+    data = {"id": row_id}
+    if sort_key is not None:
+        data["k"] = sort_key.isoformat()
+    payload = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """
+    解析只按ID排序的分页游标
+
+    Args:
+        cursor: 游标字符串, 为空时返回None
+
+    Returns:
+        Optional[int]: 边界行的ID
+
+    Raises:
+        HTTPException: 游标格式错误
+    """
+    if not cursor:
+        return None
+    return _decode_payload(cursor)["id"]
+
+
+def decode_keyset_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """
+    解析按(时间, ID)排序的分页游标
+
+    Args:
+        cursor: 游标字符串, 为空时返回None
+
+    Returns:
+        Optional[Tuple[datetime, int]]: 边界行的排序时间和ID
+
+    Raises:
+        HTTPException: 游标格式错误或不带排序时间
+    """
+    if not cursor:
+        return None
+    payload = _decode_payload(cursor)
+    try:
+        sort_key = datetime.fromisoformat(payload["k"])
+    except (KeyError, TypeError, ValueError):
+        raise _invalid_cursor()
+    return sort_key, payload["id"]
+
+
+def cursor_boundary(sort_key: datetime, row_id: int) -> ColumnElement:
+    """
+    游标边界, 与(排序时间列, ID列)做行比较
+
+    Args:
+        sort_key: 边界行的排序时间
+        row_id: 边界行的ID
+
+    Returns:
+        ColumnElement: (排序时间, ID)元组
+    """
+    return tuple_(literal(sort_key, CursorTimestamp()), literal(row_id))
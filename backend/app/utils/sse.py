@@ -0,0 +1,127 @@
+"""
+SSE输出工具
+事件预编码为字节, 以及把细碎的流式分块按时间窗口/字节阈值合并成较少的帧
+"""
+import asyncio
+import json
+from typing import Any, AsyncGenerator, Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 未安装orjson时退回标准库
+    orjson = None
+
+
+def dumps(data: Dict[str, Any]) -> bytes:
+    """序列化为UTF-8 JSON字节, 优先使用orjson"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_event(data: Dict[str, Any], event_id: Optional[str] = None) -> bytes:
+    """
+    编码一个SSE事件帧
+
+    Args:
+        data: 事件数据
+        event_id: 事件ID, 客户端重连时通过Last-Event-ID带回
+
+    Returns:
+        bytes: "id: ...\\ndata: ...\\n\\n" 帧
+    """
+    frame = b"data: " + dumps(data) + b"\n\n"
+    if event_id is not None:
+        return b"id: " + event_id.encode("utf-8") + b"\n" + frame
+    return frame
+
+
+async def coalesce(
+    stream: AsyncGenerator[str, None],
+    window_ms: float = 30.0,
+    max_bytes: int = 1024
+) -> AsyncGenerator[str, None]:
+    """
+    合并流式分块
+
+    第一个分块立即输出(不增加首token延迟), 之后的分块先缓冲,
+    距离上次输出超过时间窗口或缓冲超过字节阈值时合并输出;
+    上游停顿时由定时器按时输出, 不会等到下一个分块到达
+
+    Args:
+        stream: 上游分块流
+        window_ms: 时间窗口(毫秒), 0表示不合并
+        max_bytes: 缓冲大小阈值(按字符数计)
+
+    Returns:
+        AsyncGenerator: 合并后的分块流
+    """
+    if window_ms <= 0:
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+        return
+
+    window = window_ms / 1000
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    buffer = []
+    state = {"size": 0, "last_flush": None, "timer": None, "finished": False, "error": None}
+
+    def arm_timer() -> None:
+        # 每个窗口最多一个定时器, 而不是每个分块一次超时等待
+        if state["timer"] is None and not ready.is_set():
+            delay = state["last_flush"] + window - loop.time()
+            if delay <= 0:
+                ready.set()
+            else:
+                state["timer"] = loop.call_later(delay, ready.set)
+
+    async def pump() -> None:
+        # 单独的任务读取上游, 分块追加到缓冲区, 由消费端按窗口取走
+        try:
+            async for chunk in stream:
+                buffer.append(chunk)
+                state["size"] += len(chunk)
+                if state["last_flush"] is None or state["size"] >= max_bytes:
+                    ready.set()
+                else:
+                    arm_timer()
+        except Exception as e:
+            state["error"] = e
+        finally:
+            state["finished"] = True
+            ready.set()
+
+    reader = asyncio.ensure_future(pump())
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            if state["timer"] is not None:
+                state["timer"].cancel()
+                state["timer"] = None
+
+            if buffer:
+                content = "".join(buffer)
+                buffer.clear()
+                state["size"] = 0
+                state["last_flush"] = loop.time()
+                yield content
+
+            if state["finished"] and not buffer:
+                if state["error"] is not None:
+                    raise state["error"]
+                return
+            if buffer:
+                # 消费端输出期间又到达的分块
+                arm_timer()
+    finally:
+        # 先停止读取任务, 再关闭上游(生成器运行中不能aclose)
+        if state["timer"] is not None:
+            state["timer"].cancel()
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        await stream.aclose()
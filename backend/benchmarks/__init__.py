@@ -0,0 +1,4 @@
+"""
+性能基准测试
+在本地数据库和模拟LLM提供商上驱动真实的FastAPI应用, 输出可比较的结果
+"""
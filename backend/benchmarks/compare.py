@@ -0,0 +1,75 @@
+"""
+对比两次基准测试结果
+
+用法(在backend目录下执行):
+    python -m benchmarks.compare benchmarks/results/旧.json benchmarks/results/新.json
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# (指标路径, 数值越大越好)
+METRICS = (
+    (("throughput_rps",), True),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p95"), False),
+    (("latency_ms", "p99"), False),
+    (("ttfb_ms", "p50"), False),
+    (("first_token_ms", "p50"), False),
+    (("chunk_frames_per_request",), False),
+    (("db_queries_per_request",), False),
+)
+
+
+def load(path: str) -> Tuple[dict, Dict[Tuple[str, int], dict]]:
+    """读取结果文件, 按(场景, 并发)索引"""
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return data["meta"], {(run["scenario"], run["concurrency"]): run for run in data["runs"]}
+
+
+def metric(run: dict, path: Tuple[str, ...]) -> Optional[float]:
+    value = run
+    for key in path:
+        if value is None:
+            return None
+        value = value.get(key)
+    return value
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="对比两次基准测试结果")
+    parser.add_argument("baseline", help="基准结果JSON")
+    parser.add_argument("candidate", help="新结果JSON")
+    parser.add_argument("--threshold", type=float, default=5.0, help="变化超过该百分比时标记")
+    args = parser.parse_args()
+
+    base_meta, base_runs = load(args.baseline)
+    cand_meta, cand_runs = load(args.candidate)
+    print(f"baseline:  {base_meta.get('git_revision')} ({base_meta.get('timestamp')})")
+    print(f"candidate: {cand_meta.get('git_revision')} ({cand_meta.get('timestamp')})\n")
+
+    print(f"{'scenario':<22}{'conc':>5}  {'metric':<24}{'baseline':>10}{'candidate':>11}{'change':>9}")
+    for key in sorted(base_runs.keys() & cand_runs.keys()):
+        for path, higher_is_better in METRICS:
+            before = metric(base_runs[key], path)
+            after = metric(cand_runs[key], path)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            flag = ""
+            if abs(change) >= args.threshold:
+                improved = (change > 0) == higher_is_better
+                flag = "  better" if improved else "  WORSE"
+            print(
+                f"{key[0]:<22}{key[1]:>5}  {'.'.join(path):<24}"
+                f"{before:>10.2f}{after:>11.2f}{change:>+8.1f}%{flag}"
+            )
+
+    missing = base_runs.keys() ^ cand_runs.keys()
+    if missing:
+        print(f"\n仅出现在一次运行中的组合: {sorted(missing)}")
+
+
+if __name__ == "__main__":
+    main()
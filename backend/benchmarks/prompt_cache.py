@@ -0,0 +1,368 @@
+"""
+提示词缓存基准测试
+启动一个本地的Anthropic Messages API替身服务, 检查请求格式(cache_control断点数量、
+位置和内容块结构), 并按Anthropic的前缀缓存规则模拟缓存读写和首token延迟;
+通过LLMService驱动一段多轮长会话, 对比开启/关闭提示词缓存的输入Token构成和首token延迟
+
+替身的缓存规则:
+- 断点处的前缀(系统提示+此前所有内容块)达到最小长度时写入缓存, 存活ttl秒, 命中时续期
+- 每个断点向前最多回看20个内容块查找已缓存的前缀, 取最长的命中
+- 首token延迟 = 基础延迟 + 未缓存Token/预填充速度 + 缓存Token/(预填充速度*10)
+
+用法(在backend目录下执行):
+    python -m benchmarks.prompt_cache
+    python -m benchmarks.prompt_cache --turns 80 --system-tokens 3000 --reply-tokens 200
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+LOOKBACK_BLOCKS = 20
+MAX_BREAKPOINTS = 4
+
+_WORDS = (
+    "order refund shipping account password invoice warranty delivery return policy "
+    "customer support ticket status update payment card address email phone issue "
+    "product device screen battery replace repair schedule technician confirm thanks"
+).split()
+
+
+def _text(rng: random.Random, tokens: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(tokens))
+
+
+def _tokens(text: str) -> int:
+    # 替身只需要稳定的计数, 词表中每个词约为1个token
+    return max(1, len(text.split()))
+
+
+class RequestShapeError(ValueError):
+    """请求格式不符合Messages API的约束"""
+
+
+class StandInAnthropic:
+    """Anthropic Messages API替身: 校验请求格式, 模拟前缀缓存"""
+
+    def __init__(
+        self,
+        min_cache_tokens: int,
+        ttl_seconds: float,
+        base_ttft_ms: float,
+        prefill_tokens_per_second: float,
+        reply_tokens: int,
+        seed: int
+    ):
+        self.min_cache_tokens = min_cache_tokens
+        self.ttl_seconds = ttl_seconds
+        self.base_ttft = base_ttft_ms / 1000
+        self.prefill_tps = prefill_tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.rng = random.Random(seed)
+        self._cache: Dict[str, float] = {}  # 前缀哈希 -> 过期时间
+        self.requests: List[dict] = []
+
+    @staticmethod
+    def _blocks(content, where: str) -> List[Tuple[str, bool]]:
+        """把str或内容块列表展开为(文本, 是否断点), 同时检查块结构"""
+        if isinstance(content, str):
+            return [(content, False)]
+        if not isinstance(content, list) or not content:
+            raise RequestShapeError(f"{where}: content必须是字符串或非空内容块列表")
+        blocks = []
+        for block in content:
+            if block.get("type") != "text" or not isinstance(block.get("text"), str):
+                raise RequestShapeError(f"{where}: 只支持text内容块")
+            extra = set(block) - {"type", "text", "cache_control"}
+            if extra:
+                raise RequestShapeError(f"{where}: 未知字段 {sorted(extra)}")
+            marker = block.get("cache_control")
+            if marker is not None and marker != {"type": "ephemeral"}:
+                raise RequestShapeError(f"{where}: cache_control必须为 {{\"type\": \"ephemeral\"}}")
+            blocks.append((block["text"], marker is not None))
+        return blocks
+
+    def check(self, body: dict, beta_header: str) -> List[Tuple[str, bool]]:
+        """
+        校验请求格式, 返回按缓存顺序(系统提示在前)展开的内容块
+
+        Raises:
+            RequestShapeError: 格式错误
+        """
+        blocks = []
+        if "system" in body:
+            if body["system"] in (None, "", []):
+                raise RequestShapeError("system不能为空, 没有系统提示时不应传该参数")
+            blocks += self._blocks(body["system"], "system")
+
+        messages = body.get("messages")
+        if not messages:
+            raise RequestShapeError("messages不能为空")
+        if messages[0].get("role") != "user":
+            raise RequestShapeError("第一条消息必须是user")
+        for index, message in enumerate(messages):
+            if message.get("role") not in ("user", "assistant"):
+                raise RequestShapeError(f"messages[{index}]: role必须为user或assistant")
+            blocks += self._blocks(message.get("content"), f"messages[{index}]")
+
+        breakpoints = sum(1 for _, marked in blocks if marked)
+        if breakpoints > MAX_BREAKPOINTS:
+            raise RequestShapeError(f"最多{MAX_BREAKPOINTS}个cache_control断点, 实际{breakpoints}个")
+        if breakpoints and "prompt-caching" not in beta_header:
+            raise RequestShapeError("使用cache_control需要prompt-caching beta请求头")
+        return blocks
+
+    def usage(self, blocks: List[Tuple[str, bool]]) -> Dict[str, int]:
+        """按前缀缓存规则计算本次请求的缓存读写和未缓存Token数"""
+        now = time.monotonic()
+        hashes, totals = [], []
+        digest = hashlib.blake2b(digest_size=16)
+        total = 0
+        for text, _ in blocks:
+            digest.update(text.encode("utf-8") + b"\x00")
+            hashes.append(digest.copy().hexdigest())
+            total += _tokens(text)
+            totals.append(total)
+
+        breakpoints = [index for index, (_, marked) in enumerate(blocks) if marked]
+        hit = -1
+        for point in breakpoints:
+            for index in range(point, max(-1, point - LOOKBACK_BLOCKS), -1):
+                expires = self._cache.get(hashes[index])
+                if expires is not None and expires > now:
+                    self._cache[hashes[index]] = now + self.ttl_seconds
+                    hit = max(hit, index)
+                    break
+
+        cache_read = totals[hit] if hit >= 0 else 0
+        cache_write = 0
+        written_to = hit
+        for point in breakpoints:
+            if point > hit and totals[point] >= self.min_cache_tokens:
+                self._cache[hashes[point]] = now + self.ttl_seconds
+                written_to = point
+        if written_to > hit:
+            cache_write = totals[written_to] - cache_read
+        cached_until = max(hit, written_to)
+        uncached = total - (totals[cached_until] if cached_until >= 0 else 0)
+        return {
+            "input_tokens": uncached,
+            "cache_creation_input_tokens": cache_write,
+            "cache_read_input_tokens": cache_read
+        }
+
+    def ttft(self, usage: Dict[str, int]) -> float:
+        prefill = usage["input_tokens"] + usage["cache_creation_input_tokens"]
+        return (
+            self.base_ttft
+            + prefill / self.prefill_tps
+            + usage["cache_read_input_tokens"] / (self.prefill_tps * 10)
+        )
+
+    def build_app(self):
+        """替身服务的ASGI应用"""
+        from starlette.applications import Starlette
+        from starlette.requests import Request
+        from starlette.responses import JSONResponse, StreamingResponse
+        from starlette.routing import Route
+
+        async def messages(request: Request):
+            body = await request.json()
+            try:
+                blocks = self.check(body, request.headers.get("anthropic-beta", ""))
+            except RequestShapeError as e:
+                return JSONResponse(
+                    {"type": "error", "error": {"type": "invalid_request_error", "message": str(e)}},
+                    status_code=400
+                )
+            usage = self.usage(blocks)
+            self.requests.append({"breakpoints": sum(1 for _, marked in blocks if marked), **usage})
+            reply = _text(self.rng, self.reply_tokens)
+            message = {
+                "id": f"msg_{len(self.requests)}",
+                "type": "message",
+                "role": "assistant",
+                "model": body["model"],
+                "stop_reason": None,
+                "stop_sequence": None,
+            }
+            await asyncio.sleep(self.ttft(usage))
+
+            if not body.get("stream"):
+                return JSONResponse({
+                    **message,
+                    "content": [{"type": "text", "text": reply}],
+                    "stop_reason": "end_turn",
+                    "usage": {**usage, "output_tokens": _tokens(reply)}
+                })
+
+            def event(name: str, data: dict) -> bytes:
+                return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+            async def events():
+                yield event("message_start", {
+                    "type": "message_start",
+                    "message": {**message, "content": [], "usage": {**usage, "output_tokens": 1}}
+                })
+                yield event("content_block_start", {
+                    "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}
+                })
+                words = reply.split(" ")
+                for start in range(0, len(words), 8):
+                    text = " ".join(words[start:start + 8]) + ("" if start + 8 >= len(words) else " ")
+                    yield event("content_block_delta", {
+                        "type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}
+                    })
+                yield event("content_block_stop", {"type": "content_block_stop", "index": 0})
+                yield event("message_delta", {
+                    "type": "message_delta",
+                    "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                    "usage": {"output_tokens": _tokens(reply)}
+                })
+                yield event("message_stop", {"type": "message_stop"})
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return Starlette(routes=[Route("/v1/messages", messages, methods=["POST"])])
+
+
+async def run_conversation(service, model: str, args: argparse.Namespace) -> List[dict]:
+    """驱动一段多轮会话, 每轮记录首token延迟和提供商报告的用量"""
+    from app.services.prompt_cache import ProviderUsage
+
+    rng = random.Random(args.seed)
+    messages = [{"role": "system", "content": _text(rng, args.system_tokens)}]
+    turns = []
+    for _ in range(args.turns):
+        messages.append({"role": "user", "content": _text(rng, args.user_tokens)})
+        usage = ProviderUsage()
+        started = time.perf_counter()
+        first_token = None
+        parts = []
+        stream = await service.chat(messages=list(messages), model=model, stream=True, use_cache=False, usage=usage)
+        async for chunk in stream:
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            parts.append(chunk)
+        messages.append({"role": "assistant", "content": "".join(parts)})
+        turns.append({
+            "ttft_ms": round(first_token * 1000, 1),
+            "input_tokens": usage.input_tokens,
+            "cache_read_tokens": usage.cache_read_tokens,
+            "cache_write_tokens": usage.cache_write_tokens,
+            "output_tokens": usage.output_tokens,
+        })
+    return turns
+
+
+def summarize(name: str, turns: List[dict], requests: List[dict]) -> dict:
+    input_tokens = sum(t["input_tokens"] for t in turns)
+    cache_read = sum(t["cache_read_tokens"] for t in turns)
+    cache_write = sum(t["cache_write_tokens"] for t in turns)
+    uncached = input_tokens - cache_read - cache_write
+    ttft = np.asarray([t["ttft_ms"] for t in turns])
+    late = ttft[len(ttft) // 2:]
+    return {
+        "variant": name,
+        "turns": len(turns),
+        "input_tokens": input_tokens,
+        "cache_read_tokens": cache_read,
+        "cache_write_tokens": cache_write,
+        "uncached_tokens": uncached,
+        "cache_hit_ratio": round(cache_read / input_tokens, 3) if input_tokens else 0.0,
+        # 按Anthropic定价倍率折算: 写入1.25倍, 读取0.1倍
+        "input_cost_units": round(uncached + cache_write * 1.25 + cache_read * 0.1),
+        "max_breakpoints": max((r["breakpoints"] for r in requests), default=0),
+        "ttft_ms_mean": round(float(ttft.mean()), 1),
+        "ttft_ms_second_half_mean": round(float(late.mean()), 1),
+        "ttft_ms_last": float(ttft[-1]),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="提示词缓存基准测试")
+    parser.add_argument("--turns", type=int, default=60, help="会话轮数")
+    parser.add_argument("--system-tokens", type=int, default=1500, help="系统提示长度")
+    parser.add_argument("--user-tokens", type=int, default=60, help="每条用户消息长度")
+    parser.add_argument("--reply-tokens", type=int, default=180, help="每条回复长度")
+    parser.add_argument("--base-ttft-ms", type=float, default=150.0, help="替身的基础首token延迟")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=20000.0, help="替身的预填充速度")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default=None, help="结果JSON路径, 默认 benchmarks/results/prompt-cache-<时间>.json")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+
+    stand_in = StandInAnthropic(
+        min_cache_tokens=1024,
+        ttl_seconds=300,
+        base_ttft_ms=args.base_ttft_ms,
+        prefill_tokens_per_second=args.prefill_tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        seed=args.seed
+    )
+    from benchmarks.run import LocalServer
+
+    server = LocalServer(stand_in.build_app())
+    url = server.start()
+
+    # 替身地址必须在导入应用前配置
+    os.environ["ANTHROPIC_API_KEY"] = "stand-in"
+    os.environ["ANTHROPIC_BASE_URL"] = url
+    os.environ["LLM_MAX_RETRIES"] = "0"
+    os.environ["DEBUG"] = "False"
+
+    from app.services.llm_service import LLMService
+    from app.services.prompt_cache import PromptCachePlanner
+    from app.services.llm_clients import LLMClientPool
+
+    async def run_all() -> List[dict]:
+        results = []
+        for name, enabled in (("no prompt cache", False), ("prompt cache", True)):
+            pool = LLMClientPool()
+            service = LLMService(client_pool=pool, planner=PromptCachePlanner(enabled=enabled))
+            stand_in.requests.clear()
+            try:
+                turns = await run_conversation(service, "claude-3-5-sonnet-20241022", args)
+            finally:
+                await pool.aclose()
+            results.append(summarize(name, turns, stand_in.requests))
+        return results
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        server.stop()
+
+    header = f"{'variant':<18}{'input':>9}{'read':>9}{'write':>8}{'uncached':>10}{'hit':>7}{'cost':>9}{'bps':>5}{'ttft':>8}{'ttft 2nd':>10}{'last':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['variant']:<18}{r['input_tokens']:>9}{r['cache_read_tokens']:>9}{r['cache_write_tokens']:>8}"
+            f"{r['uncached_tokens']:>10}{r['cache_hit_ratio']:>7.1%}{r['input_cost_units']:>9}{r['max_breakpoints']:>5}"
+            f"{r['ttft_ms_mean']:>8.1f}{r['ttft_ms_second_half_mean']:>10.1f}{r['ttft_ms_last']:>8.1f}"
+        )
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"prompt-cache-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "meta": {"timestamp": datetime.now().isoformat(timespec="seconds"), **vars(args)},
+        "variants": results,
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n结果已保存: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""
+端到端负载基准测试
+启动真实的FastAPI应用(app.main:app), 使用本地数据库和模拟LLM提供商,
+按给定并发驱动聊天、会话列表/搜索和登录接口
+
+用法(在backend目录下执行):
+    python -m benchmarks.run
+    python -m benchmarks.run --scenarios chat,chat_stream --concurrency 1,8,32 --requests 300
+    python -m benchmarks.run --url http://localhost:8000   # 压测已启动的服务(无法统计SQL数)
+
+结果写入 benchmarks/results/<时间>.json, 使用 python -m benchmarks.compare 对比两次运行
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+SCENARIOS = ("login", "chat", "chat_stream", "conversations_list", "conversations_search")
+SEARCH_WORDS = ("python", "数据库", "性能", "部署", "缓存", "前端", "模型", "测试")
+PASSWORD = "benchmark-password"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# 基准测试使用的默认模拟提供商参数, 可通过同名环境变量覆盖
+MOCK_DEFAULTS = {
+    "MOCK_LLM_ENABLED": "True",
+    "MOCK_LLM_TTFT_MS": "fixed:20",
+    "MOCK_LLM_TOKENS_PER_SECOND": "fixed:2000",
+    "MOCK_LLM_OUTPUT_TOKENS": "fixed:100",
+    "MOCK_LLM_CHUNK_TOKENS": "4",
+    "MOCK_LLM_SEED": "42",
+}
+
+
+@dataclass
+class Sample:
+    """单次请求的测量结果(秒)"""
+    latency: float
+    ok: bool
+    ttfb: Optional[float] = None  # 首个响应字节
+    first_token: Optional[float] = None  # 首个内容分块(流式)
+    frames: Optional[int] = None  # 收到的内容帧数(流式)
+
+
+@dataclass
+class BenchUser:
+    """压测用户"""
+    username: str
+    headers: Dict[str, str]
+
+
+class QueryCounter:
+    """统计引擎执行的SQL语句数"""
+
+    def __init__(self, *engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        self._lock = threading.Lock()
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args) -> None:
+        with self._lock:
+            self.count += 1
+
+
+class LocalServer:
+    """在后台线程中运行uvicorn, 客户端通过真实的HTTP连接访问"""
+
+    def __init__(self, app):
+        import uvicorn
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="on")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self) -> str:
+        self.thread.start()
+        deadline = time.monotonic() + 15
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError("基准测试服务启动失败")
+            time.sleep(0.05)
+        return f"http://127.0.0.1:{self.port}"
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=15)
+
+
+def summarize(values: List[float]) -> Optional[Dict[str, float]]:
+    """计算分位数(毫秒), 没有样本时返回None"""
+    if not values:
+        return None
+    data = np.asarray(values, dtype=np.float64) * 1000
+    return {
+        "mean": round(float(data.mean()), 2),
+        "p50": round(float(np.percentile(data, 50)), 2),
+        "p95": round(float(np.percentile(data, 95)), 2),
+        "p99": round(float(np.percentile(data, 99)), 2),
+        "max": round(float(data.max()), 2),
+    }
+
+
+# ---------------------------------------------------------------- 场景
+
+async def _timed(request: Awaitable[httpx.Response]) -> Sample:
+    started = time.perf_counter()
+    try:
+        response = await request
+        ok = response.is_success
+    except httpx.HTTPError:
+        ok = False
+    return Sample(latency=time.perf_counter() - started, ok=ok)
+
+
+async def request_login(client: httpx.AsyncClient, user: BenchUser, index: int, model: str) -> Sample:
+    return await _timed(client.post(
+        "/api/auth/login", json={"username": user.username, "password": PASSWORD}
+    ))
+
+
+async def request_chat(client: httpx.AsyncClient, user: BenchUser, index: int, model: str) -> Sample:
+    payload = {"message": f"基准测试消息 {index}: 请简要介绍一下{SEARCH_WORDS[index % len(SEARCH_WORDS)]}", "model": model}
+    return await _timed(client.post("/api/chat/", json=payload, headers=user.headers))
+
+
+async def request_chat_stream(client: httpx.AsyncClient, user: BenchUser, index: int, model: str) -> Sample:
+    payload = {"message": f"基准测试流式消息 {index}: 请详细解释{SEARCH_WORDS[index % len(SEARCH_WORDS)]}", "model": model}
+    started = time.perf_counter()
+    ttfb = first_token = None
+    frames = 0
+    ok = False
+    try:
+        async with client.stream("POST", "/api/chat/stream", json=payload, headers=user.headers) as response:
+            ok = response.is_success
+            async for line in response.aiter_lines():
+                now = time.perf_counter() - started
+                if ttfb is None:
+                    ttfb = now
+                if not line.startswith("data: "):
+                    continue
+                event_type = json.loads(line[6:]).get("type")
+                if event_type == "chunk":
+                    frames += 1
+                    if first_token is None:
+                        first_token = now
+                elif event_type == "error":
+                    ok = False
+    except httpx.HTTPError:
+        ok = False
+    return Sample(
+        latency=time.perf_counter() - started, ok=ok, ttfb=ttfb, first_token=first_token, frames=frames
+    )
+
+
+async def request_conversations_list(client: httpx.AsyncClient, user: BenchUser, index: int, model: str) -> Sample:
+    return await _timed(client.get("/api/conversations/", params={"limit": 20}, headers=user.headers))
+
+
+async def request_conversations_search(client: httpx.AsyncClient, user: BenchUser, index: int, model: str) -> Sample:
+    params = {"q": SEARCH_WORDS[index % len(SEARCH_WORDS)], "limit": 20}
+    return await _timed(client.get("/api/conversations/search/", params=params, headers=user.headers))
+
+
+REQUESTS: Dict[str, Callable[[httpx.AsyncClient, BenchUser, int, str], Awaitable[Sample]]] = {
+    "login": request_login,
+    "chat": request_chat,
+    "chat_stream": request_chat_stream,
+    "conversations_list": request_conversations_list,
+    "conversations_search": request_conversations_search,
+}
+
+
+# ---------------------------------------------------------------- 运行
+
+async def prepare_users(client: httpx.AsyncClient, count: int, conversations: int, model: str) -> List[BenchUser]:
+    """注册压测用户并为每个用户创建会话(用于列表和搜索场景)"""
+    users = []
+    for i in range(count):
+        username = f"bench_user_{i}"
+        # 用户已存在(压测外部服务时)返回400, 直接登录即可
+        await client.post("/api/auth/register", json={
+            "username": username, "email": f"{username}@example.com", "password": PASSWORD
+        })
+        response = await client.post("/api/auth/login", json={"username": username, "password": PASSWORD})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        users.append(BenchUser(username=username, headers=headers))
+
+    async def seed(user: BenchUser) -> None:
+        for j in range(conversations):
+            title = f"{SEARCH_WORDS[j % len(SEARCH_WORDS)]} 相关讨论 #{j}"
+            response = await client.post(
+                "/api/conversations/", json={"title": title, "model": model}, headers=user.headers
+            )
+            response.raise_for_status()
+
+    await asyncio.gather(*(seed(user) for user in users))
+    return users
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    name: str,
+    users: List[BenchUser],
+    concurrency: int,
+    total: int,
+    warmup: int,
+    model: str,
+    queries: Optional[QueryCounter]
+) -> dict:
+    """以固定并发执行一个场景, 返回统计结果"""
+    request = REQUESTS[name]
+
+    async def drive(indexes, samples: List[Sample]) -> None:
+        async def worker() -> None:
+            for index in indexes:
+                samples.append(await request(client, users[index % len(users)], index, model))
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    if warmup:
+        await drive(iter(range(-warmup, 0)), [])
+
+    samples: List[Sample] = []
+    queries_before = queries.count if queries else None
+    started = time.perf_counter()
+    await drive(iter(range(total)), samples)
+    elapsed = time.perf_counter() - started
+
+    ok = [s for s in samples if s.ok]
+    db_queries = queries.count - queries_before if queries else None
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": summarize([s.latency for s in ok]),
+        "ttfb_ms": summarize([s.ttfb for s in ok if s.ttfb is not None]),
+        "first_token_ms": summarize([s.first_token for s in ok if s.first_token is not None]),
+        "chunk_frames_per_request": (
+            round(sum(s.frames for s in ok if s.frames is not None) / len(ok), 1)
+            if ok and ok[0].frames is not None else None
+        ),
+        "db_queries_per_request": round(db_queries / len(samples), 2) if db_queries is not None and samples else None,
+    }
+
+
+def _fmt(stats: Optional[dict], key: str) -> str:
+    return f"{stats[key]:.1f}" if stats else "-"
+
+
+def print_report(runs: List[dict]) -> None:
+    """打印结果表格"""
+    header = f"{'scenario':<22}{'conc':>5}{'reqs':>6}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'ttfb50':>9}{'tft50':>9}{'q/req':>7}"
+    print(header)
+    print("-" * len(header))
+    for run in runs:
+        queries = run["db_queries_per_request"]
+        print(
+            f"{run['scenario']:<22}{run['concurrency']:>5}{run['requests']:>6}{run['errors']:>5}"
+            f"{run['throughput_rps'] or 0:>9.1f}"
+            f"{_fmt(run['latency_ms'], 'p50'):>9}{_fmt(run['latency_ms'], 'p95'):>9}{_fmt(run['latency_ms'], 'p99'):>9}"
+            f"{_fmt(run['ttfb_ms'], 'p50'):>9}{_fmt(run['first_token_ms'], 'p50'):>9}"
+            f"{queries if queries is not None else '-':>7}"
+        )
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(args: argparse.Namespace, base_url: str, queries: Optional[QueryCounter]) -> List[dict]:
+    max_concurrency = max(args.concurrency)
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        users = await prepare_users(client, args.users, args.conversations, args.model)
+        runs = []
+        for name in args.scenarios:
+            for concurrency in args.concurrency:
+                run = await run_scenario(
+                    client, name, users, concurrency, args.requests, args.warmup, args.model, queries
+                )
+                runs.append(run)
+                print(f"  {name} x{concurrency}: {run['throughput_rps']} req/s, {run['errors']} errors", file=sys.stderr)
+        return runs
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="聊天与会话接口的端到端负载基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"逗号分隔的场景, 可选: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="逗号分隔的并发数, 依次运行")
+    parser.add_argument("--requests", type=int, default=200, help="每个场景、每档并发的请求数")
+    parser.add_argument("--warmup", type=int, default=10, help="正式计时前的预热请求数")
+    parser.add_argument("--users", type=int, default=8, help="压测用户数, 请求轮流分配")
+    parser.add_argument("--conversations", type=int, default=50, help="每个用户预先创建的会话数")
+    parser.add_argument("--model", default="mock-bench", help="聊天场景使用的模型")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单个请求超时(秒)")
+    parser.add_argument("--database-url", default=None,
+                        help="本地运行时使用的数据库, 默认在临时目录创建SQLite")
+    parser.add_argument("--url", default=None, help="压测已运行的服务, 不启动本地应用")
+    parser.add_argument("--output", default=None, help="结果JSON路径, 默认 benchmarks/results/<时间>.json")
+    args = parser.parse_args(argv)
+
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+
+    server = queries = None
+    database = None
+    if args.url:
+        base_url = args.url
+    else:
+        # 必须在导入应用前设置, 配置在导入时读取
+        database = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='e-ai-bench-')}/bench.db"
+        os.environ["DATABASE_URL"] = database
+        os.environ["DEBUG"] = "False"
+        for key, value in MOCK_DEFAULTS.items():
+            os.environ.setdefault(key, value)
+
+        from app.main import app
+        from app.database import async_engine, engine
+
+        # 请求走异步引擎, 批量写入走同步引擎
+        queries = QueryCounter(async_engine.sync_engine, engine)
+        server = LocalServer(app)
+        base_url = server.start()
+
+    try:
+        runs = asyncio.run(benchmark(args, base_url, queries))
+    finally:
+        if server is not None:
+            server.stop()
+
+    print_report(runs)
+
+    result = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": args.url or "local",
+            "database": database.split("://", 1)[0] if database else None,
+            "model": args.model,
+            "requests": args.requests,
+            "users": args.users,
+            "conversations_per_user": args.conversations,
+            "mock": {key: os.environ.get(key) for key in MOCK_DEFAULTS} if not args.url else None,
+        },
+        "runs": runs,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n结果已保存: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+SSE帧合并基准测试
+用模拟提供商产生逐token的流, 对比逐分块json.dumps成帧(合并前)与
+按时间窗口合并+预编码(合并后)的帧率、字节数和每个流的CPU时间
+
+framing列为减去"upstream only"基线后的成帧CPU开销
+
+用法(在backend目录下执行):
+    python -m benchmarks.sse
+    python -m benchmarks.sse --streams 500 --tokens 400 --tokens-per-second 80 --windows 20,50
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncGenerator, Callable, List, Optional
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def upstream_only(stream: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
+    """不成帧, 仅消费上游, 作为CPU开销的基线"""
+    async def frames():
+        async for chunk in stream:
+            yield chunk.encode("utf-8")
+    return frames()
+
+
+def legacy_frames(stream: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
+    """合并前: 每个分块一帧, 标准库json.dumps, 由StreamingResponse编码为字节"""
+    async def frames():
+        async for chunk in stream:
+            frame = f"data: {json.dumps({'type': 'chunk', 'content': chunk}, ensure_ascii=False)}\n\n"
+            yield frame.encode("utf-8")
+    return frames()
+
+
+def coalesced_frames(window_ms: float, max_bytes: int) -> Callable[[AsyncGenerator[str, None]], AsyncGenerator[bytes, None]]:
+    """合并后: 按时间窗口合并分块, 预编码为字节"""
+    from app.utils.sse import coalesce, encode_event
+
+    def build(stream: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
+        async def frames():
+            async for chunk in coalesce(stream, window_ms=window_ms, max_bytes=max_bytes):
+                yield encode_event({"type": "chunk", "content": chunk})
+        return frames()
+    return build
+
+
+async def run_variant(
+    name: str,
+    pipeline: Callable[[AsyncGenerator[str, None]], AsyncGenerator[bytes, None]],
+    streams: int,
+    model: str
+) -> dict:
+    """并发运行多个流, 统计帧数、字节数、耗时和CPU时间"""
+    from app.services.mock_provider import mock_provider
+
+    frames = 0
+    total_bytes = 0
+    gaps: List[float] = []
+
+    async def one(index: int) -> None:
+        nonlocal frames, total_bytes
+        upstream = await mock_provider.chat(
+            [{"role": "user", "content": f"sse benchmark {index}"}], model, stream=True
+        )
+        last = None
+        async for frame in pipeline(upstream):
+            now = time.perf_counter()
+            if last is not None:
+                gaps.append(now - last)
+            last = now
+            frames += 1
+            total_bytes += len(frame)
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(streams)))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    gaps.sort()
+    return {
+        "variant": name,
+        "streams": streams,
+        "frames": frames,
+        "frames_per_stream": round(frames / streams, 1),
+        "frames_per_second": round(frames / elapsed, 1),
+        "bytes": total_bytes,
+        "duration_s": round(elapsed, 3),
+        "cpu_ms_per_stream": round(cpu * 1000 / streams, 3),
+        "max_frame_gap_ms": round(gaps[-1] * 1000, 1) if gaps else None,
+        "p99_frame_gap_ms": round(gaps[int(len(gaps) * 0.99) - 1] * 1000, 1) if gaps else None,
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="SSE帧合并基准测试")
+    parser.add_argument("--streams", type=int, default=200, help="并发流数")
+    parser.add_argument("--tokens", type=int, default=300, help="每个流的token数")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="每个流的输出速度")
+    parser.add_argument("--windows", default="20,50", help="逗号分隔的合并窗口(毫秒)")
+    parser.add_argument("--max-bytes", type=int, default=1024, help="合并缓冲阈值")
+    parser.add_argument("--output", default=None, help="结果JSON路径, 默认 benchmarks/results/sse-<时间>.json")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+
+    # 模拟提供商必须在导入应用前配置
+    os.environ["MOCK_LLM_ENABLED"] = "True"
+    os.environ["MOCK_LLM_TTFT_MS"] = "fixed:0"
+    os.environ["MOCK_LLM_TOKENS_PER_SECOND"] = f"fixed:{args.tokens_per_second}"
+    os.environ["MOCK_LLM_OUTPUT_TOKENS"] = f"fixed:{args.tokens}"
+    os.environ["MOCK_LLM_CHUNK_TOKENS"] = "1"
+    os.environ["DEBUG"] = "False"
+
+    variants = [("upstream only", upstream_only), ("per-delta json.dumps", legacy_frames)]
+    for window in (float(w) for w in args.windows.split(",")):
+        variants.append((f"coalesce {window:g}ms", coalesced_frames(window, args.max_bytes)))
+
+    async def run_all() -> List[dict]:
+        results = []
+        for name, pipeline in variants:
+            results.append(await run_variant(name, pipeline, args.streams, "mock-sse"))
+        return results
+
+    results = asyncio.run(run_all())
+    baseline = results[0]["cpu_ms_per_stream"]
+    for r in results:
+        r["framing_cpu_ms_per_stream"] = round(r["cpu_ms_per_stream"] - baseline, 3)
+
+    header = f"{'variant':<24}{'frames':>9}{'frames/s':>11}{'frames/str':>12}{'KB':>9}{'cpu ms/str':>12}{'framing':>9}{'p99 gap':>9}{'max gap':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['variant']:<24}{r['frames']:>9}{r['frames_per_second']:>11.1f}{r['frames_per_stream']:>12.1f}"
+            f"{r['bytes'] / 1024:>9.1f}{r['cpu_ms_per_stream']:>12.3f}{r['framing_cpu_ms_per_stream']:>9.3f}"
+            f"{r['p99_frame_gap_ms'] or 0:>9.1f}{r['max_frame_gap_ms'] or 0:>9.1f}"
+        )
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"sse-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "streams": args.streams,
+            "tokens": args.tokens,
+            "tokens_per_second": args.tokens_per_second,
+            "max_bytes": args.max_bytes,
+        },
+        "variants": results,
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n结果已保存: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+测试配置
+导入app之前指向临时SQLite数据库并启用模拟提供商, 表结构由迁移创建(含FTS索引)
+"""
+import os
+import tempfile
+import uuid
+
+_db_dir = tempfile.mkdtemp(prefix="llm-chat-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_dir}/test.db"
+os.environ["ASYNC_DATABASE_URL"] = ""
+os.environ["DEBUG"] = "False"
+os.environ["MOCK_LLM_ENABLED"] = "True"
+os.environ["MOCK_LLM_TTFT_MS"] = "fixed:1"
+os.environ["MOCK_LLM_OUTPUT_TOKENS"] = "fixed:5"
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    """迁移到最新版本后启动应用"""
+    from app.database import upgrade_database
+    from app.main import app
+
+    upgrade_database()
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def auth_headers(client):
+    """注册一个新用户并返回其认证头"""
+    username = f"user_{uuid.uuid4().hex[:8]}"
+    password = "secret123"
+    response = client.post("/api/auth/register", json={
+        "username": username,
+        "email": f"{username}@example.com",
+        "password": password
+    })
+    assert response.status_code == 201, response.text
+    token = client.post("/api/auth/login", json={
+        "username": username,
+        "password": password
+    }).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,104 @@
+"""
+批量聊天: 结果攒批写入会话、消息和使用记录, 提供商未报告的用量列为NULL
+"""
+import json
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models import ApiUsage, Conversation, Message
+from app.schemas import BatchChatItem
+from app.services.batch_service import BatchJob, BatchResult, BatchService
+from app.services.prompt_cache import ProviderUsage
+
+
+def _run_batch(client, headers, items, **options):
+    """提交任务并读取结果流直到done事件"""
+    response = client.post("/api/chat/batch", json={"items": items, "model": "mock-a", **options}, headers=headers)
+    assert response.status_code == 202, response.text
+    job_id = response.json()["job_id"]
+    lines = client.get(f"/api/chat/batch/{job_id}/results", headers=headers).text.splitlines()
+    return [json.loads(line) for line in lines]
+
+
+def _user_id(client, headers):
+    return client.get("/api/auth/me", headers=headers).json()["id"]
+
+
+def _job(user_id, items):
+    return BatchJob(
+        id="job",
+        user_id=user_id,
+        tier=None,
+        model="mock-a",
+        items=[BatchChatItem(**item) for item in items],
+        concurrency=1,
+        requests_per_minute=None,
+        use_cache=False,
+        save=True
+    )
+
+
+def test_results_are_saved_in_batches(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_WRITE_SIZE", 2)
+    items = [
+        {"message": "batch prompt one", "system": "Be brief."},
+        {"message": "batch prompt two"},
+        {"message": "batch prompt three"},
+    ]
+
+    events = _run_batch(client, auth_headers, items, concurrency=2)
+
+    results = [event for event in events if event["type"] == "result"]
+    done = events[-1]
+    assert done["type"] == "done"
+    assert done["status"] == "completed"
+    assert done["completed"] == 3 and done["failed"] == 0
+    assert sorted(result["index"] for result in results) == [0, 1, 2]
+    # result事件在写入之后产出, 已带有会话ID
+    assert all(result["conversation_id"] for result in results)
+
+    with SessionLocal() as db:
+        by_index = {result["index"]: db.get(Conversation, result["conversation_id"]) for result in results}
+        assert by_index[0].message_count == 3
+        assert by_index[1].message_count == 2
+        roles = db.scalars(
+            select(Message.role).where(Message.conversation_id == by_index[0].id).order_by(Message.id)
+        ).all()
+        assert roles == ["system", "user", "assistant"]
+
+    listed = client.get("/api/conversations/", headers=auth_headers).json()
+    assert len(listed["conversations"]) == 3
+
+
+def test_unsaved_batch_writes_nothing(client, auth_headers):
+    events = _run_batch(client, auth_headers, [{"message": "not saved"}], save=False)
+
+    (result,) = [event for event in events if event["type"] == "result"]
+    assert result["ok"]
+    assert result["conversation_id"] is None
+    assert client.get("/api/conversations/", headers=auth_headers).json()["conversations"] == []
+
+
+def test_unreported_usage_is_stored_as_null(client, auth_headers):
+    user_id = _user_id(client, auth_headers)
+    items = [{"message": "no usage reported"}, {"message": "usage reported"}]
+    reported = ProviderUsage()
+    reported.add(input_tokens=120, output_tokens=7, cache_read_tokens=64)
+    results = [
+        BatchResult(index=0, ok=True, content="reply", completion_tokens=1, usage=None),
+        BatchResult(index=1, ok=True, content="reply", completion_tokens=7, usage=reported),
+        BatchResult(index=2, ok=False, error="failed"),
+    ]
+
+    client.portal.call(BatchService._persist, _job(user_id, items + [{"message": "failed"}]), results)
+
+    assert results[0].conversation_id and results[1].conversation_id
+    assert results[2].conversation_id is None
+    with SessionLocal() as db:
+        rows = db.scalars(select(ApiUsage).where(ApiUsage.user_id == user_id).order_by(ApiUsage.id)).all()
+        assert [(row.prompt_tokens, row.cache_read_tokens, row.cache_write_tokens) for row in rows] == [
+            (None, None, None),
+            (120, 64, 0),
+        ]
@@ -0,0 +1,109 @@
+"""
+上下文组装: 按Token预算从最新的消息往前取, 最新的用户消息总是保留, 放不下时截断或报错
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.config import settings
+from app.services.context_builder import ELISION_MARKER, ContextBuilder
+from app.services.token_counter import MESSAGE_OVERHEAD_TOKENS, REPLY_PRIMING_TOKENS
+
+
+class _CharCounter:
+    """每个字符计一个Token"""
+
+    def count(self, text, model=None, memoize=True):
+        return len(text)
+
+
+class _SquareCounter:
+    """Token数随长度平方增长, 按比例估算的截断收敛不了"""
+
+    def count(self, text, model=None, memoize=True):
+        return len(text) ** 2 // 2
+
+
+class _StubSession:
+    """依次返回系统提示行和历史行(最新的在前)"""
+
+    def __init__(self, system, history):
+        self._results = [system, history]
+
+    async def scalars(self, statement):
+        return SimpleNamespace(all=lambda rows=self._results.pop(0): rows)
+
+
+def _row(row_id, role, content):
+    return SimpleNamespace(id=row_id, role=role, content=content, tokens=len(content))
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    """历史消息预算固定为200 Token"""
+    monkeypatch.setattr(settings, "CONTEXT_MAX_TOKENS", 200)
+    monkeypatch.setattr(settings, "CONTEXT_MIN_RECENT_MESSAGES", 1)
+    return 200
+
+
+def _build(system, history, counter=None):
+    builder = ContextBuilder(counter or _CharCounter())
+    return asyncio.run(builder.build(_StubSession(system, history), 1, "gpt-4"))
+
+
+def test_older_messages_are_dropped_to_fit_budget(budget):
+    history = [
+        _row(6, "user", "q" * 40),
+        _row(5, "assistant", "a" * 40),
+        _row(4, "user", "q" * 40),
+        _row(3, "assistant", "a" * 40),
+        _row(2, "user", "q" * 40),
+        _row(1, "assistant", "a" * 40),
+    ]
+    window = _build([_row(0, "system", "s" * 10)], history)
+
+    # 40+开销每条, 预算内放得下三条, 开头的助手回复被去掉
+    assert window.message_ids == [4, 5, 6]
+    assert [m["role"] for m in window.messages] == ["system", "user", "assistant", "user"]
+    assert window.truncated
+    assert not window.elided
+    assert window.used_tokens <= budget
+
+
+def test_latest_user_message_is_elided_to_fit(budget):
+    question = "head " + "x" * 1000 + " tail"
+    window = _build([_row(0, "system", "s" * 10)], [_row(2, "user", question), _row(1, "assistant", "a")])
+
+    assert window.message_ids == [2]
+    content = window.messages[-1]["content"]
+    assert content.startswith("head") and content.endswith("tail")
+    assert ELISION_MARKER in content
+    assert window.elided
+    assert window.used_tokens <= budget
+
+
+def test_elide_falls_back_to_hard_cut():
+    builder = ContextBuilder(_SquareCounter())
+    content, tokens = builder._elide("y" * 500, "gpt-4", 50)
+
+    assert tokens <= 50
+    assert content == "y" * 10
+
+
+def test_latest_user_message_kept_when_system_prompt_is_large(budget):
+    available = budget - REPLY_PRIMING_TOKENS - 2 * MESSAGE_OVERHEAD_TOKENS - 180
+    window = _build([_row(0, "system", "s" * 180)], [_row(1, "user", "q" * 500)])
+
+    assert window.message_ids == [1]
+    assert len(window.messages[-1]["content"]) <= available
+    assert window.used_tokens <= budget
+
+
+def test_context_too_large_when_system_prompt_fills_budget(budget):
+    with pytest.raises(HTTPException) as error:
+        _build([_row(0, "system", "s" * budget)], [_row(1, "user", "hello")])
+
+    assert error.value.status_code == 413
+    assert "上下文过长" in error.value.detail
@@ -0,0 +1,83 @@
+"""
+反规范化计数: 用户会话数、会话消息数和Token总数随写入在同一事务中维护, 与实际行数一致
+"""
+from sqlalchemy import func, select
+
+from app.database import SessionLocal
+from app.models import Conversation, Message
+from app.services.chat_service import ChatService
+
+
+def _user_id(client, headers):
+    return client.get("/api/auth/me", headers=headers).json()["id"]
+
+
+def _listed_total(client, headers):
+    return client.get("/api/conversations/", headers=headers).json()["total"]
+
+
+def _actual_conversations(user_id):
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(Conversation).where(Conversation.user_id == user_id))
+
+
+def _chat(client, headers, message, conversation_id=None):
+    response = client.post("/api/chat/", json={
+        "message": message,
+        "model": "mock-a",
+        "conversation_id": conversation_id,
+        "use_cache": False
+    }, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_conversation_count_follows_create_and_delete(client, auth_headers):
+    user_id = _user_id(client, auth_headers)
+    created = [
+        client.post("/api/conversations/", json={"title": f"c{i}"}, headers=auth_headers).json()["id"]
+        for i in range(3)
+    ]
+    # 不带会话ID的聊天会新建会话
+    _chat(client, auth_headers, "start a new conversation")
+    assert _listed_total(client, auth_headers) == _actual_conversations(user_id) == 4
+
+    for conversation_id in created[:2]:
+        assert client.delete(f"/api/conversations/{conversation_id}", headers=auth_headers).status_code == 204
+    # 删除不存在的会话不改变计数
+    assert client.delete(f"/api/conversations/{created[0]}", headers=auth_headers).status_code == 404
+
+    assert _listed_total(client, auth_headers) == _actual_conversations(user_id) == 2
+    assert client.get("/api/auth/me", headers=auth_headers).json()["conversation_count"] == 2
+
+
+def test_batch_conversations_are_counted(client, auth_headers):
+    user_id = _user_id(client, auth_headers)
+    response = client.post("/api/chat/batch", json={
+        "items": [{"message": "counted one"}, {"message": "counted two"}],
+        "model": "mock-a"
+    }, headers=auth_headers)
+    job_id = response.json()["job_id"]
+    client.get(f"/api/chat/batch/{job_id}/results", headers=auth_headers)
+
+    assert _listed_total(client, auth_headers) == _actual_conversations(user_id) == 2
+
+
+def test_message_counters_match_messages(client, auth_headers):
+    conversation_id = client.post(
+        "/api/conversations/", json={"title": "counted"}, headers=auth_headers
+    ).json()["id"]
+    for i in range(3):
+        reply = _chat(client, auth_headers, f"counter question {i}", conversation_id)
+
+    with SessionLocal() as db:
+        conversation = db.get(Conversation, conversation_id)
+        count, tokens = db.execute(
+            select(func.count(), func.sum(Message.tokens)).where(Message.conversation_id == conversation_id)
+        ).one()
+        assert conversation.message_count == count == 6
+        assert conversation.total_tokens == tokens
+        assert conversation.last_message_preview == ChatService.message_preview(reply["assistant_message"]["content"])
+
+    listed = client.get(f"/api/conversations/{conversation_id}", headers=auth_headers).json()
+    assert listed["message_count"] == 6
@@ -0,0 +1,262 @@
+"""
+进行中生成的登记表: 停止时立即结束上游读取, 只停止匹配的生成;
+断线重连按Last-Event-ID回放, 更早的事件以快照补齐; 一个生成分发给多个订阅方
+"""
+import asyncio
+import json
+
+from app.services import generation_registry as generation_registry_module
+from app.services.generation_registry import Generation, GenerationRegistry, LocalBroadcast
+
+
+async def _stalling(closed):
+    """输出一个分块后长时间没有输出"""
+    try:
+        yield "first"
+        await asyncio.sleep(10)
+        yield "never"
+    finally:
+        closed.append(True)
+
+
+def _registry(**options) -> GenerationRegistry:
+    return GenerationRegistry(LocalBroadcast(), **options)
+
+
+def _parse(frame: bytes):
+    """解析SSE帧, 返回(序号, 数据)"""
+    event_id, data = None, None
+    for line in frame.decode("utf-8").strip().split("\n"):
+        field, _, value = line.partition(": ")
+        if field == "id":
+            event_id = int(value.rpartition(":")[2])
+        elif field == "data":
+            data = json.loads(value)
+    return event_id, data
+
+
+async def _read_all(generation: Generation, after: int = 0):
+    return [_parse(frame) async for frame in generation.subscribe(after)]
+
+
+def _publish_chunks(generation: Generation, *chunks: str) -> None:
+    for chunk in chunks:
+        generation.publish({"type": "chunk", "content": chunk})
+
+
+def test_stop_ends_guarded_stream_without_waiting_for_next_chunk():
+    closed = []
+
+    async def run():
+        generation = Generation(1, 1)
+        chunks = []
+
+        async def read():
+            async for chunk in generation.guard(_stalling(closed)):
+                chunks.append(chunk)
+
+        reader = asyncio.ensure_future(read())
+        await asyncio.sleep(0.01)
+        generation.stop()
+        await asyncio.wait_for(reader, timeout=0.5)
+        return chunks, generation.reason
+
+    chunks, reason = asyncio.run(run())
+    assert chunks == ["first"]
+    assert reason == "stopped"
+    # 挂起的读取被取消, 上游在取消中执行清理
+    assert closed == [True]
+
+
+def test_guard_on_stopped_generation_reads_nothing():
+    closed = []
+
+    async def run():
+        generation = Generation(1, 1)
+        generation.stop()
+        return [chunk async for chunk in generation.guard(_stalling(closed))]
+
+    assert asyncio.run(run()) == []
+
+
+def test_stop_only_matching_generations():
+    async def run():
+        registry = _registry()
+        same_conversation = [registry.register(1, 10), registry.register(1, 10)]
+        other_conversation = registry.register(1, 11)
+        other_user = registry.register(2, 10)
+        finished = registry.register(1, 10)
+        registry.unregister(finished)
+
+        stopped = await registry.stop(1, 10)
+        return stopped, same_conversation, other_conversation, other_user, finished, registry
+
+    stopped, same_conversation, other_conversation, other_user, finished, registry = asyncio.run(run())
+    assert stopped == 2
+    assert all(generation.stopped for generation in same_conversation)
+    assert not other_conversation.stopped
+    assert not other_user.stopped
+    assert not finished.stopped
+    # 不指定会话时停止该用户的其余生成
+    assert registry.stop_local(1) == 1
+    assert other_conversation.stopped
+
+
+def test_active_returns_latest_unfinished_generation():
+    async def run():
+        registry = _registry()
+        older = registry.register(1, 10)
+        await asyncio.sleep(0.001)
+        newer = registry.register(1, 10)
+        assert registry.active(1, 10) is newer
+        registry.unregister(newer)
+        assert registry.active(1, 10) is older
+        assert registry.active(2, 10) is None
+        return [info["id"] for info in registry.user_generations(1)] == [older.id]
+
+    assert asyncio.run(run())
+
+
+def test_last_subscriber_leaving_stops_without_grace():
+    async def run():
+        generation = Generation(1, 1, grace_seconds=0)
+        subscriber = generation.subscribe()
+        generation.publish({"type": "chunk", "content": "a"})
+        await subscriber.__anext__()
+        await subscriber.aclose()
+        return generation.reason
+
+    assert asyncio.run(run()) == "disconnected"
+
+
+def test_resume_replays_events_after_last_event_id():
+    async def run():
+        generation = Generation(1, 1)
+        _publish_chunks(generation, "a", "b", "c")
+        generation.publish({"type": "done"})
+        generation.finish()
+        return await _read_all(generation, after=2)
+
+    assert asyncio.run(run()) == [(3, {"type": "chunk", "content": "c"}), (4, {"type": "done"})]
+
+
+def test_resume_behind_buffer_starts_with_snapshot():
+    async def run():
+        generation = Generation(1, 1, buffer_size=2)
+        _publish_chunks(generation, "a", "b", "c", "d")
+        generation.finish()
+        return await _read_all(generation, after=1)
+
+    # 事件2已移出缓冲区, 快照包含此前全部分块, 序号为缓冲区第一个事件之前
+    assert asyncio.run(run()) == [
+        (2, {"type": "snapshot", "content": "ab"}),
+        (3, {"type": "chunk", "content": "c"}),
+        (4, {"type": "chunk", "content": "d"}),
+    ]
+
+
+def test_reconnect_within_grace_keeps_generation_running():
+    async def run():
+        generation = Generation(1, 1, grace_seconds=0.05)
+        first = generation.subscribe()
+        _publish_chunks(generation, "a")
+        await first.__anext__()
+        await first.aclose()
+
+        # 宽限期内重连, 接着收到断线期间的输出
+        await asyncio.sleep(0.01)
+        second = generation.subscribe(after=1)
+        _publish_chunks(generation, "b")
+        resumed = _parse(await second.__anext__())
+        await asyncio.sleep(0.1)
+        stopped_while_connected = generation.stopped
+        await second.aclose()
+        await asyncio.sleep(0.1)
+        return resumed, stopped_while_connected, generation.reason
+
+    resumed, stopped_while_connected, reason = asyncio.run(run())
+    assert resumed == (2, {"type": "chunk", "content": "b"})
+    assert not stopped_while_connected
+    # 再次全部断开且宽限期内无人重连
+    assert reason == "disconnected"
+
+
+def test_finished_generation_kept_until_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(generation_registry_module.time, "monotonic", lambda: now[0])
+
+    registry = _registry(ttl_seconds=300)
+    generation = registry.register(1, 10)
+    registry.unregister(generation)
+
+    assert registry.get(1, generation.id) is generation
+    assert registry.get(2, generation.id) is None
+    now[0] += 301
+    assert registry.get(1, generation.id) is None
+
+
+def test_resume_header_errors(client, auth_headers):
+    bad = client.get("/api/chat/subscribe/1", headers={**auth_headers, "Last-Event-ID": "no-sequence"})
+    assert bad.status_code == 400
+    unknown = client.get("/api/chat/subscribe/1", headers={**auth_headers, "Last-Event-ID": "deadbeef:3"})
+    assert unknown.status_code == 404
+
+
+def test_every_subscriber_receives_the_whole_stream():
+    async def run():
+        generation = Generation(1, 1)
+        early = asyncio.ensure_future(_read_all(generation))
+        await asyncio.sleep(0)
+        _publish_chunks(generation, "a", "b")
+        await asyncio.sleep(0)
+        # 中途加入的订阅方从头回放
+        late = asyncio.ensure_future(_read_all(generation))
+        await asyncio.sleep(0)
+        _publish_chunks(generation, "c")
+        generation.finish()
+        return await asyncio.gather(early, late)
+
+    early, late = asyncio.run(run())
+    assert early == late
+    assert [data["content"] for _, data in early] == ["a", "b", "c"]
+
+
+def test_slow_subscriber_does_not_hold_back_others():
+    async def run():
+        generation = Generation(1, 1)
+        fast = generation.subscribe()
+        slow = generation.subscribe()
+        _publish_chunks(generation, *"abcde")
+        fast_events = [_parse(await fast.__anext__())[0] for _ in range(5)]
+        # 慢订阅方还没读任何事件, 发布和快订阅方都不受影响
+        first_slow = _parse(await slow.__anext__())[0]
+        info = generation.info()
+        await fast.aclose()
+        await slow.aclose()
+        return fast_events, first_slow, info
+
+    fast_events, first_slow, info = asyncio.run(run())
+    assert fast_events == [1, 2, 3, 4, 5]
+    assert first_slow == 1
+    assert info["subscribers"] == 2
+
+
+def test_one_subscriber_leaving_keeps_generation_running():
+    async def run():
+        generation = Generation(1, 1, grace_seconds=0)
+        tab = generation.subscribe()
+        other_tab = generation.subscribe()
+        _publish_chunks(generation, "a")
+        await tab.__anext__()
+        await other_tab.__anext__()
+        await tab.aclose()
+        still_running = not generation.stopped
+        await other_tab.aclose()
+        return still_running, generation.stopped
+
+    assert asyncio.run(run()) == (True, True)
+
+
+def test_subscribe_without_active_generation_is_404(client, auth_headers):
+    response = client.get("/api/chat/subscribe/123456", headers=auth_headers)
+    assert response.status_code == 404
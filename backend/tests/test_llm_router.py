@@ -0,0 +1,270 @@
+"""
+熔断器半开状态与路由中试探名额的占用/归还, 对冲请求被取消或落败时的收尾
+"""
+import asyncio
+import time
+
+import pytest
+
+from app.config import settings
+from app.services.llm_router import CircuitBreaker, LLMRouter
+
+
+def _half_open(breaker: CircuitBreaker) -> None:
+    """让熔断器处于冷却期已过的半开状态"""
+    breaker.failures = breaker.failure_threshold
+    breaker.opened_at = time.monotonic() - breaker.cooldown_seconds
+
+
+def _router(mode: str = "failover") -> LLMRouter:
+    return LLMRouter(
+        provider_for_model=lambda model: model,
+        mode=mode,
+        fallback_models={"primary": "backup"}
+    )
+
+
+@pytest.fixture
+def hedge_after_10ms(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_DELAY_MS", 10)
+
+
+async def _stream(*chunks: str, error: Exception = None):
+    for chunk in chunks:
+        yield chunk
+    if error is not None:
+        raise error
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=60)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.available()
+    assert not breaker.allow()
+
+
+def test_half_open_admits_a_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=60)
+    _half_open(breaker)
+    assert breaker.state == "half_open"
+    assert breaker.available()
+    assert breaker.allow()
+    # 试探进行中, 其他请求不放行
+    assert not breaker.available()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_half_open_probe_failure_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=60)
+    _half_open(breaker)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_released_probe_can_be_retried():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=60)
+    _half_open(breaker)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_candidate_filter_does_not_take_fallback_probe():
+    router = _router()
+    backup = router._stats("backup").breaker
+    _half_open(backup)
+
+    async def call(messages, model, stream):
+        return f"reply from {model}"
+
+    assert asyncio.run(router.dispatch(call, [], "primary", False)) == "reply from primary"
+    # 备用模型没有被调用, 试探名额仍然可用
+    assert backup.state == "half_open"
+    assert backup.available()
+
+
+def test_completed_probe_stream_closes_breaker():
+    router = _router()
+    breaker = router._stats("primary").breaker
+    _half_open(breaker)
+
+    async def call(messages, model, stream):
+        return _stream("a", "b", "c")
+
+    async def run():
+        stream = await router.dispatch(call, [], "primary", True)
+        return [chunk async for chunk in stream]
+
+    assert asyncio.run(run()) == ["a", "b", "c"]
+    assert breaker.state == "closed"
+
+
+def test_probe_stream_failure_reopens_breaker():
+    router = _router()
+    breaker = router._stats("primary").breaker
+    _half_open(breaker)
+
+    async def call(messages, model, stream):
+        return _stream("a", error=ConnectionError("reset"))
+
+    async def run():
+        stream = await router.dispatch(call, [], "primary", True)
+        async for _ in stream:
+            pass
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+    assert breaker.state == "open"
+
+
+def test_early_closed_probe_stream_releases_probe():
+    router = _router()
+    breaker = router._stats("primary").breaker
+    _half_open(breaker)
+    closed = []
+
+    async def upstream():
+        try:
+            for chunk in ("a", "b", "c"):
+                yield chunk
+        finally:
+            closed.append(True)
+
+    async def call(messages, model, stream):
+        return upstream()
+
+    async def run():
+        stream = await router.dispatch(call, [], "primary", True)
+        first = await stream.__anext__()
+        # 用户停止生成: 读到一半关闭
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(run()) == "a"
+    assert closed == [True]
+    # 既不算成功也不算失败, 下一个请求可以重新试探
+    assert breaker.state == "half_open"
+    assert breaker.available()
+
+
+def test_cancelled_probe_releases_probe():
+    router = _router()
+    breaker = router._stats("primary").breaker
+    _half_open(breaker)
+
+    async def call(messages, model, stream):
+        await asyncio.sleep(10)
+
+    async def run():
+        task = asyncio.ensure_future(router.dispatch(call, [], "primary", False))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    assert breaker.state == "half_open"
+    assert breaker.available()
+
+
+def test_first_token_latency_recorded_only_for_streams():
+    router = _router()
+
+    async def call(messages, model, stream):
+        return _stream("a") if stream else "reply"
+
+    async def run():
+        await router.dispatch(call, [], "primary", False)
+        stream = await router.dispatch(call, [], "primary", True)
+        return [chunk async for chunk in stream]
+
+    assert asyncio.run(run()) == ["a"]
+    assert len(router._stats("primary").first_token) == 1
+
+
+def test_cancel_before_hedge_cancels_primary(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_DELAY_MS", 10_000)
+    router = _router("hedged")
+    breaker = router._stats("primary").breaker
+    _half_open(breaker)
+    cancelled = []
+
+    async def call(messages, model, stream):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+
+    async def run():
+        task = asyncio.ensure_future(router.dispatch(call, [], "primary", True))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        # 在事件循环关闭(取消所有剩余任务)之前检查
+        return list(cancelled), breaker.available()
+
+    # 客户端断开时上游请求随之取消, 试探名额归还
+    assert asyncio.run(run()) == (["primary"], True)
+
+
+def test_cancel_during_hedge_cancels_both_attempts(hedge_after_10ms):
+    router = _router("hedged")
+    cancelled = []
+
+    async def call(messages, model, stream):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+
+    async def run():
+        task = asyncio.ensure_future(router.dispatch(call, [], "primary", True))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        return sorted(cancelled)
+
+    assert asyncio.run(run()) == ["backup", "primary"]
+    assert router._stats("primary").hedges == 1
+
+
+def test_hedge_loser_stream_is_closed(hedge_after_10ms):
+    router = _router("hedged")
+    closed = []
+
+    async def upstream(model, release):
+        try:
+            await release.wait()
+            yield model
+        finally:
+            closed.append(model)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def call(messages, model, stream):
+            return upstream(model, release)
+
+        task = asyncio.ensure_future(router.dispatch(call, [], "primary", True))
+        await asyncio.sleep(0.05)
+        # 两个请求在同一轮拿到首个分块, 只有一个能胜出
+        release.set()
+        stream = await task
+        chunks = [chunk async for chunk in stream]
+        await asyncio.sleep(0.01)
+        return chunks, sorted(closed)
+
+    chunks, closed_models = asyncio.run(run())
+    assert len(chunks) == 1
+    assert closed_models == ["backup", "primary"]
@@ -0,0 +1,129 @@
+"""
+模拟提供商: 分布规格解析, 相同请求产出相同文本, 按错误率模拟失败, 流式分块与用量
+"""
+import asyncio
+import random
+
+import pytest
+
+from app.services.mock_provider import Distribution, MockProfile, MockProvider, MockProviderError
+from app.services.prompt_cache import ProviderUsage
+
+
+MESSAGES = [{"role": "user", "content": "Describe the queue."}]
+
+
+def _profile(**overrides) -> MockProfile:
+    values = {"ttft_ms": 0, "tokens_per_second": 0, "output_tokens": 12}
+    values.update(overrides)
+    return MockProfile.from_settings(values)
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("fixed:5", "fixed:5"),
+    ("7", "fixed:7"),
+    (3, "fixed:3"),
+    (" Uniform:1,2 ", "uniform:1,2"),
+    ("lognormal:300,0.5", "lognormal:300,0.5"),
+])
+def test_distribution_parse(spec, expected):
+    assert repr(Distribution.parse(spec)) == expected
+
+
+@pytest.mark.parametrize("spec", ["gamma:1,2", "uniform:1", "normal:1,2,3"])
+def test_distribution_rejects_bad_spec(spec):
+    with pytest.raises(ValueError):
+        Distribution.parse(spec)
+
+
+def test_samples_are_non_negative():
+    rng = random.Random(0)
+    normal = Distribution.parse("normal:0,10")
+    assert min(normal.sample(rng) for _ in range(200)) == 0.0
+
+
+def test_same_request_produces_same_text():
+    first = MockProvider(profile=_profile(), seed=1)
+    second = MockProvider(profile=_profile(), seed=2)
+
+    async def run():
+        return (
+            await first.chat(MESSAGES, "mock-a", False),
+            await second.chat(MESSAGES, "mock-a", False),
+            await first.chat(MESSAGES, "mock-b", False)
+        )
+
+    reply, same, other_model = asyncio.run(run())
+    assert reply == same
+    assert len(reply.split()) == 12
+    assert other_model != reply
+
+
+def test_stream_chunks_join_to_full_reply():
+    provider = MockProvider(profile=_profile(chunk_tokens=5))
+    usage = ProviderUsage()
+
+    async def run():
+        full = await provider.chat(MESSAGES, "mock-a", False)
+        stream = await provider.chat(MESSAGES, "mock-a", True, usage)
+        return full, [chunk async for chunk in stream]
+
+    full, chunks = asyncio.run(run())
+    assert len(chunks) == 3
+    assert "".join(chunks) == full
+    assert usage.output_tokens == 12
+    assert provider.stats()["tokens"] == 24
+
+
+def test_error_rate_fails_before_first_token():
+    provider = MockProvider(profile=_profile(error_rate=1.0))
+
+    async def run():
+        with pytest.raises(MockProviderError):
+            await provider.chat(MESSAGES, "mock-a", False)
+        stream = await provider.chat(MESSAGES, "mock-a", True)
+        with pytest.raises(MockProviderError):
+            await stream.__anext__()
+
+    asyncio.run(run())
+    assert provider.stats()["errors"] == 2
+
+
+def test_midstream_error_after_partial_output():
+    provider = MockProvider(profile=_profile(midstream_error_rate=1.0), seed=3)
+
+    async def run():
+        chunks = []
+        stream = await provider.chat(MESSAGES, "mock-a", True)
+        with pytest.raises(MockProviderError):
+            async for chunk in stream:
+                chunks.append(chunk)
+        return chunks
+
+    chunks = asyncio.run(run())
+    assert 1 <= len(chunks) < 12
+    assert provider.stats()["errors"] == 1
+
+
+def test_model_profile_overrides_default():
+    provider = MockProvider(profile=_profile(), profiles={"mock-long": _profile(output_tokens=40)})
+
+    async def run():
+        return await provider.chat(MESSAGES, "mock-long", False)
+
+    assert len(asyncio.run(run()).split()) == 40
+    assert provider.stats()["models"] == ["mock-long"]
+
+
+def test_ttft_delays_first_chunk():
+    provider = MockProvider(profile=_profile(ttft_ms=50))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        stream = await provider.chat(MESSAGES, "mock-a", True)
+        await stream.__anext__()
+        await stream.aclose()
+        return loop.time() - started
+
+    assert asyncio.run(run()) >= 0.045
@@ -0,0 +1,142 @@
+"""
+键集分页: 游标携带排序键, 边界行被删除或更新后从原位置继续
+"""
+from datetime import datetime
+
+import pytest
+
+from app.database import SessionLocal
+from app.models import Message
+from app.utils.pagination import decode_keyset_cursor, encode_cursor
+
+
+def _walk_conversations(client, headers, after_first_page=None):
+    """按limit=3逐页读取会话列表, 第一页之后执行after_first_page"""
+    seen = []
+    cursor = None
+    first_page = True
+    while True:
+        params = {"limit": 3}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/api/conversations/", params=params, headers=headers)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        seen.extend(c["id"] for c in page["conversations"])
+        if first_page and after_first_page is not None:
+            after_first_page(seen)
+        first_page = False
+        cursor = page["next_cursor"]
+        if not cursor:
+            return seen
+
+
+def _create_conversations(client, headers, count):
+    return [
+        client.post("/api/conversations/", json={"title": f"c{i}"}, headers=headers).json()["id"]
+        for i in range(count)
+    ]
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(42, datetime(2026, 1, 2, 3, 4, 5))
+    sort_key, row_id = decode_keyset_cursor(cursor)
+    assert row_id == 42
+    assert sort_key.isoformat() == "2026-01-02T03:04:05"
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", encode_cursor(1), "eyJpZCI6dHJ1ZX0"])
+def test_invalid_cursor_is_rejected(client, auth_headers, cursor):
+    response = client.get("/api/conversations/", params={"cursor": cursor}, headers=auth_headers)
+    assert response.status_code == 400
+
+
+def test_conversation_pages_cover_every_row(client, auth_headers):
+    # 同一秒内创建, updated_at相同, 靠ID区分先后
+    ids = _create_conversations(client, auth_headers, 7)
+    assert _walk_conversations(client, auth_headers) == ids[::-1]
+
+
+def test_conversation_cursor_row_deleted(client, auth_headers):
+    ids = _create_conversations(client, auth_headers, 7)
+
+    def delete_boundary(seen):
+        client.delete(f"/api/conversations/{seen[-1]}", headers=auth_headers)
+
+    # 第一页已读到被删除的会话, 之后的页不重复也不遗漏
+    assert _walk_conversations(client, auth_headers, delete_boundary) == ids[::-1]
+    assert _walk_conversations(client, auth_headers) == [i for i in ids[::-1] if i != ids[4]]
+
+
+def test_conversation_cursor_row_moved(client, auth_headers):
+    ids = _create_conversations(client, auth_headers, 7)
+
+    def touch_boundary(seen):
+        client.put(f"/api/conversations/{seen[-1]}", json={"title": "moved"}, headers=auth_headers)
+
+    # 边界会话移到列表顶部, 仍从原位置继续
+    assert _walk_conversations(client, auth_headers, touch_boundary) == ids[::-1]
+
+
+def test_message_pages_backward_and_forward(client, auth_headers):
+    conversation_id = client.post(
+        "/api/conversations/", json={"title": "chat"}, headers=auth_headers
+    ).json()["id"]
+    for i in range(4):
+        response = client.post("/api/chat/", json={
+            "message": f"message {i}",
+            "model": "mock-a",
+            "conversation_id": conversation_id,
+            "use_cache": False
+        }, headers=auth_headers)
+        assert response.status_code == 200, response.text
+
+    url = f"/api/conversations/{conversation_id}/messages"
+    # 不带分页参数时返回全部消息, 没有游标响应头
+    response = client.get(url, headers=auth_headers)
+    everything = [m["id"] for m in response.json()]
+    assert len(everything) == 8
+    assert "X-Prev-Cursor" not in response.headers
+    assert "X-Next-Cursor" not in response.headers
+
+    # 从最近一页向前翻到头
+    response = client.get(url, params={"limit": 3}, headers=auth_headers)
+    collected = [m["id"] for m in response.json()]
+    assert "X-Next-Cursor" not in response.headers
+    while "X-Prev-Cursor" in response.headers:
+        response = client.get(
+            url, params={"limit": 3, "before": response.headers["X-Prev-Cursor"]}, headers=auth_headers
+        )
+        collected = [m["id"] for m in response.json()] + collected
+    assert collected == everything
+
+    # 从最早一页向后翻到最新
+    collected = [m["id"] for m in response.json()]
+    while "X-Next-Cursor" in response.headers:
+        response = client.get(
+            url, params={"limit": 3, "after": response.headers["X-Next-Cursor"]}, headers=auth_headers
+        )
+        collected += [m["id"] for m in response.json()]
+    assert collected == everything
+
+
+def test_messages_are_not_paged_unless_asked(client, auth_headers):
+    conversation_id = client.post(
+        "/api/conversations/", json={"title": "long chat"}, headers=auth_headers
+    ).json()["id"]
+    with SessionLocal() as db:
+        db.add_all(
+            Message(conversation_id=conversation_id, role="user" if i % 2 == 0 else "assistant", content=f"m{i}")
+            for i in range(120)
+        )
+        db.commit()
+
+    url = f"/api/conversations/{conversation_id}/messages"
+    # 超过以前的默认页大小(100)也全部返回
+    assert len(client.get(url, headers=auth_headers).json()) == 120
+
+    page = client.get(url, params={"limit": 50}, headers=auth_headers)
+    assert [m["content"] for m in page.json()] == [f"m{i}" for i in range(70, 120)]
+    older = client.get(url, params={"before": page.headers["X-Prev-Cursor"]}, headers=auth_headers)
+    # 只带游标时按默认页大小
+    assert [m["content"] for m in older.json()] == [f"m{i}" for i in range(0, 70)]
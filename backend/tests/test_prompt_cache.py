@@ -0,0 +1,155 @@
+"""
+提示词缓存: 断点规划, 发给Anthropic的请求形状(本地替身服务检查), 用量中的缓存读写Token
+"""
+import asyncio
+import json
+
+import httpx
+from anthropic import AsyncAnthropic
+
+from app.services.llm_service import LLMService
+from app.services.prompt_cache import EPHEMERAL, PromptCachePlanner, ProviderUsage
+
+
+class _FixedCounter:
+    """每条消息按固定Token数计数"""
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+
+    def count(self, text: str, model: str = None) -> int:
+        return self.tokens
+
+
+class _StandInPool:
+    """只提供Anthropic客户端的客户端池"""
+
+    def __init__(self, anthropic: AsyncAnthropic):
+        self.anthropic = anthropic
+        self.compatible_providers = {}
+
+
+def _conversation(turns: int):
+    messages = [{"role": "system", "content": "You are a support agent."}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i}"})
+        messages.append({"role": "assistant", "content": f"answer {i}"})
+    messages.append({"role": "user", "content": "latest question"})
+    return messages
+
+
+def _anthropic_stand_in(requests):
+    """记录请求并返回带缓存用量的Anthropic响应"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        body = json.loads(request.content)
+        return httpx.Response(200, json={
+            "id": "msg_test",
+            "type": "message",
+            "role": "assistant",
+            "model": body["model"],
+            "content": [{"type": "text", "text": "cached reply"}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": 10,
+                "output_tokens": 5,
+                "cache_read_input_tokens": 2000,
+                "cache_creation_input_tokens": 300
+            }
+        })
+
+    return AsyncAnthropic(
+        api_key="test",
+        base_url="http://anthropic.test",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+
+
+def test_planner_skips_short_prompts():
+    planner = PromptCachePlanner(counter=_FixedCounter(10), min_tokens=1024)
+    assert planner.plan(_conversation(2), "claude-3-5-sonnet") == []
+
+
+def test_planner_anchors_are_stable_across_turns():
+    planner = PromptCachePlanner(counter=_FixedCounter(200), min_tokens=100, block_tokens=1000)
+    before = planner.plan(_conversation(20), "claude-3-5-sonnet")
+    after = planner.plan(_conversation(21), "claude-3-5-sonnet")
+    assert len(before) == 4
+    # 系统提示和最后一条消息各一个断点
+    assert before[0] == 0
+    assert before[-1] == len(_conversation(20)) - 1
+    # 上一轮的整条前缀(最后一个断点)在下一轮仍是消息边界, 中间锚点不随新消息移动
+    assert set(before[1:-1]) <= set(after)
+
+
+def test_anthropic_request_carries_cache_control():
+    requests = []
+    service = LLMService(
+        client_pool=_StandInPool(_anthropic_stand_in(requests)),
+        planner=PromptCachePlanner(counter=_FixedCounter(200), min_tokens=100, block_tokens=1000)
+    )
+    messages = _conversation(10)
+    usage = ProviderUsage()
+
+    reply = asyncio.run(service._anthropic_chat(messages, "claude-3-5-sonnet", False, usage))
+
+    assert reply == "cached reply"
+    request = requests[0]
+    assert request.url.path == "/v1/messages"
+    assert "prompt-caching" in request.headers["anthropic-beta"]
+    body = json.loads(request.content)
+
+    # 系统提示作为带断点的内容块
+    assert body["system"] == [
+        {"type": "text", "text": "You are a support agent.", "cache_control": EPHEMERAL}
+    ]
+    # 最后一条消息带断点, 断点总数不超过4个
+    marked = [
+        index for index, msg in enumerate(body["messages"])
+        if isinstance(msg["content"], list) and msg["content"][0].get("cache_control") == EPHEMERAL
+    ]
+    assert marked[-1] == len(body["messages"]) - 1
+    assert 1 + len(marked) <= 4
+    # 未加断点的消息保持纯文本
+    assert all(
+        isinstance(msg["content"], str)
+        for index, msg in enumerate(body["messages"]) if index not in marked
+    )
+
+    assert usage.reported
+    assert usage.input_tokens == 10 + 2000 + 300
+    assert usage.cache_read_tokens == 2000
+    assert usage.cache_write_tokens == 300
+    assert usage.output_tokens == 5
+
+
+def test_anthropic_short_prompt_uses_plain_messages():
+    requests = []
+    service = LLMService(
+        client_pool=_StandInPool(_anthropic_stand_in(requests)),
+        planner=PromptCachePlanner(counter=_FixedCounter(10), min_tokens=1024)
+    )
+
+    asyncio.run(service._anthropic_chat(_conversation(1), "claude-3-5-sonnet", False))
+
+    request = requests[0]
+    assert "anthropic-beta" not in request.headers
+    body = json.loads(request.content)
+    assert body["system"] == "You are a support agent."
+    assert all(isinstance(msg["content"], str) for msg in body["messages"])
+
+
+def test_openai_cached_tokens_are_recorded():
+    usage = ProviderUsage()
+    usage.record_openai({
+        "prompt_tokens": 3000,
+        "completion_tokens": 50,
+        "prompt_tokens_details": {"cached_tokens": 2048}
+    })
+    usage.record_openai({"prompt_tokens": 100, "completion_tokens": 5, "prompt_cache_hit_tokens": 64})
+    assert usage.input_tokens == 3100
+    assert usage.output_tokens == 55
+    assert usage.cache_read_tokens == 2048 + 64
+    assert usage.cache_write_tokens == 0
@@ -0,0 +1,115 @@
+"""
+提供商限流: 令牌桶按时间补充, 额度不足时先到先得地排队, 超过截止时间报错
+"""
+import asyncio
+
+import pytest
+
+from app.services import rate_limiter as rate_limiter_module
+from app.services.rate_limiter import (
+    InMemoryBackend,
+    RateLimit,
+    RateLimitExceededError,
+    RateLimiter,
+)
+
+
+def _complete(coroutine):
+    """执行不会挂起的协程(不启动事件循环, 时钟可以随意替换)"""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise AssertionError("协程意外挂起")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_bucket_suggests_wait_and_refills(clock):
+    backend = InMemoryBackend()
+    limit = RateLimit(rpm=60, tpm=6000)
+
+    assert _complete(backend.try_acquire("p", limit, 6000)) == 0
+    # Token桶已空, 每秒补充100个
+    assert _complete(backend.try_acquire("p", limit, 300)) == pytest.approx(3.0)
+    clock[0] += 3
+    assert _complete(backend.try_acquire("p", limit, 300)) == 0
+
+
+def test_request_bucket_limits_rate(clock):
+    backend = InMemoryBackend()
+    limit = RateLimit(rpm=2)
+
+    assert _complete(backend.try_acquire("p", limit, 1)) == 0
+    assert _complete(backend.try_acquire("p", limit, 1)) == 0
+    assert _complete(backend.try_acquire("p", limit, 1)) == pytest.approx(30.0)
+
+
+def test_oversized_request_is_capped_at_capacity(clock):
+    backend = InMemoryBackend()
+    limit = RateLimit(tpm=1000)
+
+    # 超过桶容量的请求按容量计, 桶满时可以通过
+    assert _complete(backend.try_acquire("p", limit, 5000)) == 0
+    clock[0] += 60
+    assert _complete(backend.try_acquire("p", limit, 5000)) == 0
+
+
+def test_waiters_acquire_in_arrival_order():
+    # 每秒补充2000个Token
+    limiter = RateLimiter({"p": {"tpm": 120000}}, InMemoryBackend(), max_wait_seconds=5)
+    order = []
+
+    async def acquire(name, tokens):
+        await limiter.acquire("p", "m", tokens)
+        order.append(name)
+
+    async def run():
+        await limiter.acquire("p", "m", 120000)
+        # 后到的小请求不能插队到等待中的大请求前面
+        await asyncio.gather(acquire("large", 100), acquire("small", 10), acquire("tiny", 1))
+
+    asyncio.run(run())
+    assert order == ["large", "small", "tiny"]
+    stats = limiter.stats()["keys"]["p"]
+    assert stats["acquired"] == 4
+    assert stats["queue_depth"] == 0
+
+
+def test_wait_beyond_deadline_is_rejected():
+    limiter = RateLimiter({"p": {"tpm": 120000}}, InMemoryBackend(), max_wait_seconds=5)
+
+    async def run():
+        await limiter.acquire("p", "m", 120000)
+        with pytest.raises(RateLimitExceededError):
+            await limiter.acquire("p", "m", 1000, max_wait_seconds=0.1)
+
+    asyncio.run(run())
+    stats = limiter.stats()["keys"]["p"]
+    assert stats["rejected"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_model_limit_overrides_provider_limit():
+    limiter = RateLimiter(
+        {"p": {"rpm": 1}, "p:big": {"rpm": 100}, "q": {"rpm": 0}},
+        InMemoryBackend()
+    )
+
+    async def run():
+        for _ in range(3):
+            await limiter.acquire("p", "big", 1, max_wait_seconds=0)
+        # 未配置或额度为0的提供商不限流
+        for _ in range(3):
+            await limiter.acquire("q", "m", 1, max_wait_seconds=0)
+        await limiter.acquire("p", "small", 1, max_wait_seconds=0)
+        with pytest.raises(RateLimitExceededError):
+            await limiter.acquire("p", "small", 1, max_wait_seconds=0)
+
+    asyncio.run(run())
+    assert set(limiter.stats()["keys"]) == {"p", "p:big"}
@@ -0,0 +1,89 @@
+"""
+精确匹配响应缓存: 规范化后相同的请求命中, TTL到期和超出容量时淘汰
+"""
+import asyncio
+
+import pytest
+
+from app.services import response_cache as response_cache_module
+from app.services.llm_service import LLMService
+from app.services.response_cache import ResponseCache
+
+
+MESSAGES = [{"role": "user", "content": "What is a token bucket?"}]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可手动推进的单调时钟"""
+    now = [1000.0]
+    monkeypatch.setattr(response_cache_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_exact_hit_after_normalization():
+    cache = ResponseCache()
+    cache.set(cache.make_key("gpt-4", MESSAGES), "a bucket refills at a fixed rate")
+
+    same = [{"role": " User ", "content": "  What is a token bucket?\n"}]
+    assert cache.get(cache.make_key("gpt-4", same)) == "a bucket refills at a fixed rate"
+    assert cache.stats()["hits"] == 1
+
+
+def test_different_model_or_content_misses():
+    cache = ResponseCache()
+    cache.set(cache.make_key("gpt-4", MESSAGES), "reply")
+
+    assert cache.get(cache.make_key("gpt-3.5-turbo", MESSAGES)) is None
+    assert cache.get(cache.make_key("gpt-4", [{"role": "user", "content": "What is a leaky bucket?"}])) is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = ResponseCache(ttl_seconds=60)
+    key = cache.make_key("gpt-4", MESSAGES)
+    cache.set(key, "reply")
+
+    clock[0] += 59
+    assert cache.get(key) == "reply"
+    clock[0] += 1
+    assert cache.get(key) is None
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["entries"] == 0
+    assert stats["bytes"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_chat_serves_repeated_request_from_cache():
+    service = LLMService(cache=ResponseCache())
+    calls = []
+    original = service._dispatch
+
+    async def counting_dispatch(*args, **kwargs):
+        calls.append(1)
+        return await original(*args, **kwargs)
+
+    service._dispatch = counting_dispatch
+
+    async def run():
+        first = await service.chat(MESSAGES, model="mock-a")
+        second = await service.chat(MESSAGES, model="mock-a")
+        uncached = await service.chat(MESSAGES, model="mock-a", use_cache=False)
+        return first, second, uncached
+
+    first, second, _ = asyncio.run(run())
+    assert first == second
+    assert len(calls) == 2
@@ -0,0 +1,96 @@
+"""
+加权公平调度: 按虚拟完成时间分发, 权重高的等级分到更多份额, 交互式请求优先于批量请求
+"""
+import asyncio
+
+from app.services.scheduler import FairScheduler
+
+
+def _drain(scheduler, blocker, tickets):
+    """逐个归还名额(并发上限为1), 返回分发顺序"""
+    order = []
+    running = blocker
+    while True:
+        running.release()
+        granted = [t for t in tickets if t.granted.is_set() and t not in order]
+        if not granted:
+            return order
+        order.extend(granted)
+        running = granted[0]
+
+
+def test_higher_tier_gets_proportional_share():
+    async def run():
+        scheduler = FairScheduler(max_concurrency=1, tier_weights={"free": 1, "pro": 2})
+        blocker = scheduler.submit(user_id=99, tier="free")
+        free = [scheduler.submit(user_id=1, tier="free") for _ in range(3)]
+        pro = [scheduler.submit(user_id=2, tier="pro") for _ in range(3)]
+        order = _drain(scheduler, blocker, free + pro)
+        return ["free" if t in free else "pro" for t in order]
+
+    # 占位任务分发后虚拟时间为1; 完成时间: pro为1.5, 2, 2.5, free为2, 3, 4; 相同时先提交的在前
+    assert asyncio.run(run()) == ["pro", "free", "pro", "pro", "free", "free"]
+
+
+def test_heavy_user_does_not_starve_light_user():
+    async def run():
+        scheduler = FairScheduler(max_concurrency=1)
+        blocker = scheduler.submit(user_id=99)
+        heavy = [scheduler.submit(user_id=1, cost=100) for _ in range(3)]
+        light = scheduler.submit(user_id=2, cost=100)
+        order = _drain(scheduler, blocker, heavy + [light])
+        return order.index(light)
+
+    # 后到的轻度用户排在重度用户的第二个任务之前
+    assert asyncio.run(run()) == 1
+
+
+def test_interactive_dispatched_before_batch():
+    async def run():
+        scheduler = FairScheduler(max_concurrency=1)
+        blocker = scheduler.submit(user_id=99)
+        batch = scheduler.submit(user_id=1, interactive=False, cost=1)
+        interactive = scheduler.submit(user_id=2, interactive=True, cost=1000)
+        assert batch.position == 2
+        assert interactive.position == 1
+        return _drain(scheduler, blocker, [batch, interactive]) == [interactive, batch]
+
+    assert asyncio.run(run())
+
+
+def test_abandoned_ticket_leaves_queue():
+    async def run():
+        scheduler = FairScheduler(max_concurrency=1)
+        blocker = scheduler.submit(user_id=99)
+        first = scheduler.submit(user_id=1)
+        second = scheduler.submit(user_id=2)
+        first.release()
+        assert second.position == 1
+        blocker.release()
+        return second.granted.is_set(), scheduler.stats()
+
+    granted, stats = asyncio.run(run())
+    assert granted
+    assert stats["abandoned"] == 1
+    assert stats["running"] == 1
+
+
+def test_finished_flows_are_pruned():
+    async def run():
+        scheduler = FairScheduler(max_concurrency=1)
+        # 不排队的请求: 分发后虚拟时间追上其完成时间
+        for user_id in range(100):
+            scheduler.submit(user_id=user_id).release()
+        idle = scheduler.stats()["tracked_flows"]
+
+        blocker = scheduler.submit(user_id=99)
+        queued = [scheduler.submit(user_id=user_id) for user_id in range(5)]
+        busy = scheduler.stats()["tracked_flows"]
+        _drain(scheduler, blocker, queued)
+        queued[-1].release()
+        return idle, busy, scheduler.stats()["tracked_flows"]
+
+    idle, busy, drained = asyncio.run(run())
+    assert idle == 0
+    assert busy == 5
+    assert drained == 0
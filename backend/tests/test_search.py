@@ -0,0 +1,79 @@
+"""
+SQLite FTS5检索: 用户输入中的FTS语法按普通文本匹配, 不会报语法错误
+"""
+import html
+
+import pytest
+
+from app.services.search_service import LikeSearch, SqliteSearch, message_search
+
+
+def test_fts_query_quotes_each_term():
+    backend = SqliteSearch()
+    assert backend._fts_query('say "hi" OR NEAR(a') == '"say" """hi""" "OR" "NEAR(a"'
+
+
+def test_short_terms_fall_back_to_like():
+    backend = SqliteSearch()
+    assert backend.for_text("hello world") is backend
+    assert isinstance(backend.for_text("hello ab"), LikeSearch)
+
+
+@pytest.fixture
+def searchable(client, auth_headers):
+    """一个会话, 消息内容中带FTS5的语法字符"""
+    assert message_search.name == "sqlite"
+    contents = [
+        'the "quoted" phrase',
+        "alpha OR beta",
+        "column:value pair",
+        "NEAR(term wildcard* ^caret",
+    ]
+    for content in contents:
+        response = client.post("/api/chat/", json={
+            "message": content,
+            "model": "mock-a",
+            "use_cache": False
+        }, headers=auth_headers)
+        assert response.status_code == 200, response.text
+    return auth_headers
+
+
+def _search(client, headers, q):
+    response = client.get("/api/conversations/search/messages", params={"q": q}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.mark.parametrize("q, expected", [
+    ('"quoted"', 'the "quoted" phrase'),
+    ('"', 'the "quoted" phrase'),
+    ("OR beta", "alpha OR beta"),
+    ("column:value", "column:value pair"),
+    ("NEAR(term", "NEAR(term wildcard* ^caret"),
+    ("wildcard*", "NEAR(term wildcard* ^caret"),
+    ("^caret", "NEAR(term wildcard* ^caret"),
+])
+def test_fts_syntax_is_matched_literally(client, searchable, q, expected):
+    result = _search(client, searchable, q)
+    assert result["total"] == 1
+    assert result["hits"][0]["role"] == "user"
+    assert result["hits"][0]["snippet"].replace("<mark>", "").replace("</mark>", "") == html.escape(expected)
+    assert "<mark>" in result["hits"][0]["snippet"]
+
+
+# 模拟回复由常见英文词组成, 不匹配的检索都带上回复中不会出现的词
+@pytest.mark.parametrize("q", ['""', "AND zzz", "NOT zzz*", "(((", "zzz:", '"zzz'])
+def test_fts_syntax_without_match_returns_empty(client, searchable, q):
+    assert _search(client, searchable, q)["total"] == 0
+
+
+def test_snippet_is_escaped(client, auth_headers):
+    client.post("/api/chat/", json={
+        "message": "<script>alert(1)</script> payload",
+        "model": "mock-a",
+        "use_cache": False
+    }, headers=auth_headers)
+    snippet = _search(client, auth_headers, "payload")["hits"][0]["snippet"]
+    assert "<script>" not in snippet
+    assert "&lt;script&gt;" in snippet
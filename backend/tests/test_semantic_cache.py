@@ -0,0 +1,126 @@
+"""
+语义缓存: 相似度阈值决定命中, 向量化失败时按未命中处理
+"""
+import asyncio
+
+import numpy as np
+
+from app.services.llm_service import LLMService
+from app.services.response_cache import ResponseCache
+from app.services.semantic_cache import Embedder, HashingEmbedder, SemanticCache
+
+
+def _ask(question: str, system: str = "You are helpful."):
+    return [{"role": "system", "content": system}, {"role": "user", "content": question}]
+
+
+class _FlakyEmbedder(Embedder):
+    """本地向量化, fail为True时模拟远程向量化接口超时"""
+
+    def __init__(self):
+        self._inner = HashingEmbedder()
+        self.dim = self._inner.dim
+        self.fail = False
+
+    async def embed(self, text: str) -> np.ndarray:
+        if self.fail:
+            raise TimeoutError("embeddings request timed out")
+        return await self._inner.embed(text)
+
+
+def test_similar_question_hits_above_threshold():
+    cache = SemanticCache(HashingEmbedder(), threshold=0.8, enabled=True)
+
+    async def run():
+        await cache.store("gpt-4", _ask("How do I reset my password?"), "Use the reset link.")
+        return await cache.lookup("gpt-4", _ask("how do i reset my password"))
+
+    assert asyncio.run(run()) == "Use the reset link."
+    assert cache.stats()["hits"] == 1
+
+
+def test_unrelated_question_misses():
+    cache = SemanticCache(HashingEmbedder(), threshold=0.8, enabled=True)
+
+    async def run():
+        await cache.store("gpt-4", _ask("How do I reset my password?"), "Use the reset link.")
+        return await cache.lookup("gpt-4", _ask("What are your opening hours on Sunday?"))
+
+    assert asyncio.run(run()) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_threshold_separates_hit_from_miss():
+    embedder = HashingEmbedder()
+    stored, asked = "How do I reset my password?", "How can I reset the password for my account?"
+    score = float(asyncio.run(embedder.embed(stored)) @ asyncio.run(embedder.embed(asked)))
+
+    async def lookup(threshold):
+        cache = SemanticCache(embedder, threshold=threshold, enabled=True)
+        await cache.store("gpt-4", _ask(stored), "Use the reset link.")
+        return await cache.lookup("gpt-4", _ask(asked))
+
+    assert asyncio.run(lookup(score - 0.01)) == "Use the reset link."
+    assert asyncio.run(lookup(score + 0.01)) is None
+
+
+def test_scope_separates_models_and_system_prompts():
+    cache = SemanticCache(HashingEmbedder(), threshold=0.8, enabled=True)
+
+    async def run():
+        await cache.store("gpt-4", _ask("How do I reset my password?"), "Use the reset link.")
+        return (
+            await cache.lookup("gpt-3.5-turbo", _ask("How do I reset my password?")),
+            await cache.lookup("gpt-4", _ask("How do I reset my password?", system="Answer in French."))
+        )
+
+    assert asyncio.run(run()) == (None, None)
+
+
+def test_follow_up_turns_are_not_cached():
+    cache = SemanticCache(HashingEmbedder(), threshold=0.8, max_user_turns=1, enabled=True)
+    messages = _ask("How do I reset my password?") + [
+        {"role": "assistant", "content": "Use the reset link."},
+        {"role": "user", "content": "And then?"}
+    ]
+
+    async def run():
+        await cache.store("gpt-4", messages, "Check your inbox.")
+        return await cache.lookup("gpt-4", messages)
+
+    assert asyncio.run(run()) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_embedder_failure_degrades_to_miss():
+    embedder = _FlakyEmbedder()
+    cache = SemanticCache(embedder, enabled=True)
+
+    async def run():
+        await cache.store("gpt-4", _ask("How do I reset my password?"), "Use the reset link.")
+        embedder.fail = True
+        await cache.store("gpt-4", _ask("How do I close my account?"), "Contact support.")
+        return await cache.lookup("gpt-4", _ask("How do I reset my password?"))
+
+    assert asyncio.run(run()) is None
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["misses"] == 1
+    assert stats["errors"] == 2
+
+
+def test_chat_survives_embedder_failure():
+    embedder = _FlakyEmbedder()
+    semantic = SemanticCache(embedder, enabled=True)
+    service = LLMService(cache=ResponseCache(enabled=False), semantic=semantic)
+    messages = _ask("How do I reset my password?")
+
+    async def run():
+        await semantic.store("mock-a", messages, "Use the reset link.")
+        embedder.fail = True
+        return await service.chat(messages, model="mock-a")
+
+    # 查找和写入都失败, 请求照常由提供商回复
+    reply = asyncio.run(run())
+    assert reply and reply != "Use the reset link."
+    assert semantic.stats()["errors"] == 2
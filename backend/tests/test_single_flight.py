@@ -0,0 +1,200 @@
+"""
+请求合并: 领头请求的结果和错误传给所有跟随者, 单个调用方离开不影响其他人, 上游在首次迭代时才启动
+"""
+import asyncio
+
+import pytest
+
+from app.services.single_flight import SingleFlight
+
+
+async def _stream(*chunks: str, error: Exception = None, gate: asyncio.Event = None):
+    for index, chunk in enumerate(chunks):
+        if index and gate is not None:
+            # 首个分块之后等待放行, 跟随者在缓冲区已有内容时加入
+            await gate.wait()
+        yield chunk
+    if error is not None:
+        raise error
+
+
+def test_call_followers_share_leader_result():
+    flights = SingleFlight()
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "reply"
+
+    async def run():
+        return await asyncio.gather(*(flights.call("key", factory) for _ in range(3)))
+
+    assert asyncio.run(run()) == ["reply"] * 3
+    assert len(calls) == 1
+    assert flights.leaders == 1
+    assert flights.followers == 2
+
+
+def test_call_leader_error_reaches_followers_and_is_not_cached():
+    flights = SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def succeeding():
+        return "reply"
+
+    async def run():
+        results = await asyncio.gather(
+            *(flights.call("key", failing) for _ in range(3)),
+            return_exceptions=True
+        )
+        # 失败后移除, 相同key重新发起
+        retry = await flights.call("key", succeeding)
+        return results, retry
+
+    results, retry = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(r, ValueError) for r in results)
+    assert retry == "reply"
+    assert flights.stats()["in_flight_calls"] == 0
+
+
+def test_call_cancelled_follower_does_not_cancel_leader():
+    flights = SingleFlight()
+
+    async def factory():
+        await asyncio.sleep(0.05)
+        return "reply"
+
+    async def run():
+        leader = asyncio.ensure_future(flights.call("key", factory))
+        follower = asyncio.ensure_future(flights.call("key", factory))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        return await leader, await asyncio.gather(follower, return_exceptions=True)
+
+    result, (follower_result,) = asyncio.run(run())
+    assert result == "reply"
+    assert isinstance(follower_result, asyncio.CancelledError)
+
+
+def test_stream_follower_replays_buffered_chunks():
+    flights = SingleFlight()
+
+    async def run():
+        release = asyncio.Event()
+        calls = []
+
+        async def factory():
+            calls.append(1)
+            return _stream("a", "b", "c", gate=release)
+
+        async def collect(stream):
+            return [chunk async for chunk in stream]
+
+        leader = asyncio.ensure_future(collect(flights.stream("key", factory)))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(collect(flights.stream("key", factory)))
+        release.set()
+        return await asyncio.gather(leader, follower), calls
+
+    (leader, follower), calls = asyncio.run(run())
+    assert leader == follower == ["a", "b", "c"]
+    assert len(calls) == 1
+
+
+def test_stream_leader_error_reaches_followers():
+    flights = SingleFlight()
+
+    async def run():
+        async def factory():
+            return _stream("a", "b", error=ConnectionError("reset"))
+
+        async def collect(stream):
+            chunks = []
+            with pytest.raises(ConnectionError):
+                async for chunk in stream:
+                    chunks.append(chunk)
+            return chunks
+
+        return await asyncio.gather(
+            collect(flights.stream("key", factory)),
+            collect(flights.stream("key", factory))
+        )
+
+    assert asyncio.run(run()) == [["a", "b"], ["a", "b"]]
+
+
+def test_stream_factory_error_reaches_followers():
+    flights = SingleFlight()
+
+    async def run():
+        async def factory():
+            await asyncio.sleep(0.01)
+            raise ValueError("bad request")
+
+        async def collect(stream):
+            with pytest.raises(ValueError):
+                async for _ in stream:
+                    pass
+
+        await asyncio.gather(
+            collect(flights.stream("key", factory)),
+            collect(flights.stream("key", factory))
+        )
+
+    asyncio.run(run())
+    assert flights.stats()["in_flight_streams"] == 0
+
+
+def test_stream_upstream_cancelled_when_all_subscribers_leave():
+    flights = SingleFlight()
+    closed = []
+
+    async def upstream():
+        try:
+            while True:
+                yield "x"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.append(True)
+
+    async def run():
+        async def factory():
+            return upstream()
+
+        stream = flights.stream("key", factory)
+        assert await stream.__anext__() == "x"
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert closed == [True]
+    assert flights.stats()["in_flight_streams"] == 0
+
+
+def test_stream_never_iterated_does_not_start_upstream():
+    flights = SingleFlight()
+    calls = []
+
+    async def run():
+        async def factory():
+            calls.append(1)
+            return _stream("a")
+
+        # 调用方在迭代前就失败或断开, 生成器被直接丢弃
+        flights.stream("key", factory)
+        await asyncio.sleep(0.01)
+        assert calls == []
+
+        # 相同请求加入这次生成并由它启动上游
+        return [chunk async for chunk in flights.stream("key", factory)]
+
+    assert asyncio.run(run()) == ["a"]
+    assert len(calls) == 1
+    assert flights.stats()["in_flight_streams"] == 0
@@ -0,0 +1,105 @@
+"""
+SSE输出: 事件帧编码, 流式分块按时间窗口/字节阈值合并, 上游停顿时按时输出
+"""
+import asyncio
+import json
+
+import pytest
+
+from app.utils.sse import coalesce, encode_event
+
+
+async def _timed(*steps, closed=None, error=None):
+    """
+    steps为(等待秒数, 分块); 结束或被关闭时记录到closed
+
+    同一轮到达的分块会在消费端被唤醒前全部进入缓冲区, 需要单独输出的分块前留出间隔
+    """
+    try:
+        for delay, chunk in steps:
+            if delay:
+                await asyncio.sleep(delay)
+            yield chunk
+        if error is not None:
+            raise error
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+async def _collect(stream):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    frames = []
+    async for frame in stream:
+        frames.append((frame, loop.time() - started))
+    return frames
+
+
+def test_encode_event_with_and_without_id():
+    assert encode_event({"type": "chunk", "content": "你好"}) == (
+        b"data: " + json.dumps({"type": "chunk", "content": "你好"}, ensure_ascii=False, separators=(",", ":")).encode() + b"\n\n"
+    )
+    framed = encode_event({"type": "done"}, event_id="g1:7")
+    assert framed.startswith(b"id: g1:7\ndata: ")
+    assert framed.endswith(b"\n\n")
+
+
+def test_first_chunk_is_not_delayed_and_burst_is_merged():
+    stream = _timed((0, "a"), (0.005, "b"), (0.005, "c"), (0.005, "d"))
+    frames = asyncio.run(_collect(coalesce(stream, window_ms=50)))
+
+    assert [frame for frame, _ in frames] == ["a", "bcd"]
+    assert frames[0][1] < 0.04
+
+
+def test_size_threshold_flushes_before_window():
+    stream = _timed((0, "x" * 4), (0.005, "y" * 4), (0.005, "z" * 4), (0.2, "end"))
+    frames = asyncio.run(_collect(coalesce(stream, window_ms=1000, max_bytes=8)))
+
+    assert [frame for frame, _ in frames][:2] == ["xxxx", "yyyyzzzz"]
+    # 达到阈值时不等待时间窗口
+    assert frames[1][1] < 0.1
+
+
+def test_stalled_upstream_flushes_on_timer():
+    stream = _timed((0, "a"), (0.005, "b"), (0.3, "c"))
+    frames = asyncio.run(_collect(coalesce(stream, window_ms=30)))
+
+    assert [frame for frame, _ in frames] == ["a", "b", "c"]
+    # 缓冲的"b"在窗口到期时输出, 不等到"c"到达
+    assert frames[1][1] < 0.2
+
+
+def test_buffered_content_is_flushed_before_error():
+    stream = _timed((0, "a"), (0.005, "b"), error=ConnectionError("reset"))
+
+    async def run():
+        frames = []
+        with pytest.raises(ConnectionError):
+            async for frame in coalesce(stream, window_ms=50):
+                frames.append(frame)
+        return frames
+
+    assert asyncio.run(run()) == ["a", "b"]
+
+
+def test_zero_window_passes_chunks_through():
+    stream = _timed((0, "a"), (0, "b"), (0, "c"))
+    frames = asyncio.run(_collect(coalesce(stream, window_ms=0)))
+
+    assert [frame for frame, _ in frames] == ["a", "b", "c"]
+
+
+def test_closing_early_closes_upstream():
+    closed = []
+    stream = _timed((0, "a"), (1, "b"), closed=closed)
+
+    async def run():
+        merged = coalesce(stream, window_ms=30)
+        first = await merged.__anext__()
+        await merged.aclose()
+        return first
+
+    assert asyncio.run(run()) == "a"
+    assert closed == [True]
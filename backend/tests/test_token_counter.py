@@ -0,0 +1,123 @@
+"""
+Token计数: 按内容哈希的计数缓存, 流式计数只在预分词边界处结算
+"""
+from app.services.token_counter import (
+    MESSAGE_OVERHEAD_TOKENS,
+    REPLY_PRIMING_TOKENS,
+    StreamingTokenCounter,
+    TokenCounter,
+    heuristic_count,
+)
+
+
+class _RecordingCounter:
+    """按字符数计数并记录每次计数的文本"""
+
+    def __init__(self):
+        self.segments = []
+
+    def count(self, text, model=None, memoize=True):
+        self.segments.append(text)
+        return len(text)
+
+
+def test_repeated_text_is_served_from_memo():
+    counter = TokenCounter()
+    first = counter.count("The quick brown fox", "gpt-4")
+    second = counter.count("The quick brown fox", "gpt-4")
+
+    assert first == second
+    stats = counter.stats()
+    assert stats["memo_hits"] == 1
+    assert stats["memo_misses"] == 1
+    assert stats["memo_entries"] == 1
+
+
+def test_memo_is_keyed_by_encoding():
+    counter = TokenCounter()
+    counter.count("The quick brown fox", "gpt-4")
+    counter.count("The quick brown fox", "gpt-3.5-turbo")  # 同为cl100k_base
+    counter.count("The quick brown fox", "gpt-4o")  # o200k_base
+
+    stats = counter.stats()
+    assert stats["memo_hits"] == 1
+    assert stats["memo_entries"] == 2
+
+
+def test_memo_evicts_least_recently_used():
+    counter = TokenCounter(memo_size=2)
+    counter.count("alpha")
+    counter.count("beta")
+    counter.count("alpha")
+    counter.count("gamma")
+    counter.count("beta")
+
+    stats = counter.stats()
+    assert stats["memo_entries"] == 2
+    assert stats["memo_hits"] == 1
+    assert stats["memo_misses"] == 4
+
+
+def test_memoize_false_bypasses_memo():
+    counter = TokenCounter()
+    counter.count("streaming delta", memoize=False)
+    counter.count("streaming delta", memoize=False)
+
+    stats = counter.stats()
+    assert stats["memo_entries"] == 0
+    assert stats["memo_hits"] == stats["memo_misses"] == 0
+
+
+def test_count_messages_adds_format_overhead():
+    counter = TokenCounter()
+    messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}]
+
+    expected = REPLY_PRIMING_TOKENS + 2 * MESSAGE_OVERHEAD_TOKENS + sum(
+        heuristic_count(msg["content"]) for msg in messages
+    )
+    assert counter.count_messages(messages, "gpt-4") == expected
+
+
+def test_streaming_counts_only_up_to_last_boundary():
+    recorder = _RecordingCounter()
+    stream = StreamingTokenCounter(recorder)
+
+    stream.feed("Hel")
+    assert recorder.segments == []
+    stream.feed("lo wor")
+    # 空白之前的部分已稳定, 空白及之后的尾部留待后续
+    assert recorder.segments == ["Hello"]
+    stream.feed("ld")
+    assert recorder.segments == ["Hello"]
+    assert stream.total == len("Hello world")
+    assert recorder.segments[-1] == " world"
+
+
+def test_streaming_splits_on_cjk_punctuation():
+    recorder = _RecordingCounter()
+    stream = StreamingTokenCounter(recorder)
+
+    stream.feed("你好，世界")
+    assert recorder.segments == ["你好"]
+
+
+def test_streaming_forces_cut_when_no_boundary_arrives():
+    recorder = _RecordingCounter()
+    stream = StreamingTokenCounter(recorder)
+
+    stream.feed("x" * 200)
+    assert recorder.segments == []
+    stream.feed("x" * 100)
+    assert recorder.segments == ["x" * 300]
+    assert stream.total == 300
+
+
+def test_streaming_total_matches_whole_text():
+    recorder = _RecordingCounter()
+    stream = StreamingTokenCounter(recorder)
+    text = "Streaming output, split at arbitrary points.\nSecond line!"
+    for start in range(0, len(text), 7):
+        stream.feed(text[start:start + 7])
+
+    # 各段不重不漏
+    assert stream.total == len(text)
@@ -0,0 +1,138 @@
+"""
+延迟写入: 按数量或时间批量写入使用记录, 写入失败时放回缓冲区, 关闭时写完剩余数据
+"""
+import asyncio
+import uuid
+
+import pytest
+from sqlalchemy import func, select
+
+from app.database import SessionLocal
+from app.models import ApiUsage, Conversation, Message
+from app.services import write_behind as write_behind_module
+from app.services.write_behind import DEFAULT_TITLE, WriteBehindBuffer
+
+
+@pytest.fixture
+def user_id(client, auth_headers):
+    return client.get("/api/auth/me", headers=auth_headers).json()["id"]
+
+
+@pytest.fixture
+def model():
+    """每个测试使用不同的模型名, 按模型统计写入的行"""
+    return f"wb-{uuid.uuid4().hex[:8]}"
+
+
+def _stored(model: str) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(ApiUsage).where(ApiUsage.model == model))
+
+
+class _FailingSession:
+    """模拟数据库不可用"""
+
+    async def __aenter__(self):
+        raise ConnectionError("database unavailable")
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def test_full_batch_is_written_without_waiting_for_interval(client, user_id, model):
+    async def run():
+        buffer = WriteBehindBuffer(batch_size=3, flush_interval=60)
+        await buffer.start()
+        try:
+            for _ in range(2):
+                await buffer.add_usage(user_id=user_id, model=model, tokens=1, cost=0.0)
+            await asyncio.sleep(0.05)
+            before_full = _stored(model)
+            await buffer.add_usage(user_id=user_id, model=model, tokens=1, cost=0.0)
+            await asyncio.sleep(0.1)
+            return before_full, buffer.stats()
+        finally:
+            await buffer.aclose()
+
+    before_full, stats = client.portal.call(run)
+    assert before_full == 0
+    assert stats["flushed_usages"] == 3
+    assert stats["flushes"] == 1
+    assert _stored(model) == 3
+
+
+def test_partial_batch_is_written_on_interval(client, user_id, model):
+    async def run():
+        buffer = WriteBehindBuffer(batch_size=100, flush_interval=0.05)
+        await buffer.start()
+        try:
+            await buffer.add_usage(user_id=user_id, model=model, tokens=1, cost=0.0)
+            await asyncio.sleep(0.2)
+            return buffer.stats()["pending_usages"]
+        finally:
+            await buffer.aclose()
+
+    assert client.portal.call(run) == 0
+    assert _stored(model) == 1
+
+
+def test_close_writes_remaining_records(client, user_id, model):
+    async def run():
+        buffer = WriteBehindBuffer(batch_size=100, flush_interval=60)
+        await buffer.start()
+        for _ in range(5):
+            await buffer.add_usage(user_id=user_id, model=model, tokens=1, cost=0.0)
+        await buffer.aclose()
+        return buffer.stats()
+
+    stats = client.portal.call(run)
+    assert stats["pending_usages"] == 0
+    assert stats["running"] is False
+    assert _stored(model) == 5
+
+
+def test_failed_flush_keeps_records_for_retry(client, user_id, model, monkeypatch):
+    async def run():
+        buffer = WriteBehindBuffer(batch_size=100, flush_interval=60, max_pending=3)
+        # 后台任务未启动: 每次记录后直接写入
+        monkeypatch.setattr(write_behind_module, "AsyncSessionLocal", _FailingSession)
+        for _ in range(4):
+            with pytest.raises(ConnectionError):
+                await buffer.add_usage(user_id=user_id, model=model, tokens=1, cost=0.0)
+        failed = buffer.stats()
+
+        monkeypatch.undo()
+        await buffer.flush()
+        return failed, buffer.stats()
+
+    failed, recovered = client.portal.call(run)
+    assert failed["failures"] == 4
+    # 超过上限时丢弃最早的记录
+    assert failed["pending_usages"] == 3
+    assert failed["dropped"] == 1
+    assert recovered["pending_usages"] == 0
+    assert _stored(model) == 3
+
+
+def test_title_updated_only_while_default(client, auth_headers):
+    created = [
+        client.post("/api/conversations/", json={"title": title}, headers=auth_headers).json()["id"]
+        for title in (DEFAULT_TITLE, "Renamed by user")
+    ]
+    with SessionLocal() as db:
+        for conversation_id in created:
+            db.add(Message(conversation_id=conversation_id, role="user", content="How do token buckets refill over time?"))
+        db.commit()
+
+    async def run():
+        buffer = WriteBehindBuffer(batch_size=100, flush_interval=60)
+        await buffer.start()
+        for conversation_id in created + created:
+            await buffer.update_title(conversation_id)
+        assert buffer.stats()["pending_titles"] == 2
+        await buffer.aclose()
+
+    client.portal.call(run)
+    with SessionLocal() as db:
+        titles = [db.get(Conversation, conversation_id).title for conversation_id in created]
+    assert titles == ["How do token buckets refill ov", "Renamed by user"]
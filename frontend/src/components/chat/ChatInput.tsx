@@ -11,6 +11,7 @@ interface ChatInputProps {
   onStop?: () => void;
   disabled?: boolean;
   isGenerating?: boolean;
+  queuePosition?: number;
 }
 
 export function ChatInput({
@@ -18,6 +19,7 @@ export function ChatInput({
   onStop,
   disabled = false,
   isGenerating = false,
+  queuePosition = 0,
 }: ChatInputProps) {
   const [message, setMessage] = useState('');
 
@@ -38,6 +40,11 @@ export function ChatInput({
 
   return (
     <form onSubmit={handleSubmit} className="border-t border-gray-200 dark:border-gray-700 bg-white dark:bg-gray-900 p-4">
+      {isGenerating && queuePosition > 0 && (
+        <div className="max-w-4xl mx-auto mb-2 text-sm text-gray-500 dark:text-gray-400">
+          排队中, 前方还有 {queuePosition - 1} 个请求...
+        </div>
+      )}
       <div className="max-w-4xl mx-auto flex gap-2">
         <textarea
           value={message}
@@ -1,24 +1,71 @@
 /**
  * 消息列表组件
  */
-import { useEffect, useRef } from 'react';
+import { UIEvent, useCallback, useLayoutEffect, useRef } from 'react';
 import { Message } from '@/services/chat';
 import { ChatMessage } from './ChatMessage';
 import { Loading } from '../common/Loading';
 
+// 距顶部小于该距离(px)时加载更早的消息
+const LOAD_OLDER_THRESHOLD = 100;
+
 interface MessageListProps {
   messages: Message[];
   isLoading?: boolean;
+  hasOlder?: boolean;
+  onLoadOlder?: () => Promise<void>;
 }
 
-export function MessageList({ messages, isLoading }: MessageListProps) {
+export function MessageList({ messages, isLoading, hasOlder, onLoadOlder }: MessageListProps) {
+  const containerRef = useRef<HTMLDivElement>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // 加载更早消息前的第一条消息和内容高度, 用于在顶部插入后保持滚动位置
+  const anchorRef = useRef<{ first: Message; height: number } | null>(null);
+  const loadingOlderRef = useRef(false);
 
-  // 自动滚动到底部
-  useEffect(() => {
+  useLayoutEffect(() => {
+    const container = containerRef.current;
+    const anchor = anchorRef.current;
+    if (container && anchor && messages.includes(anchor.first)) {
+      if (messages[0] !== anchor.first) {
+        // 在顶部插入了更早的消息, 保持当前可见内容不动
+        container.scrollTop += container.scrollHeight - anchor.height;
+        anchorRef.current = null;
+      }
+      return;
+    }
+    anchorRef.current = null;
+    // 自动滚动到底部
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [messages]);
 
+  const handleScroll = useCallback(
+    async (event: UIEvent<HTMLDivElement>) => {
+      const container = event.currentTarget;
+      if (
+        !hasOlder ||
+        !onLoadOlder ||
+        loadingOlderRef.current ||
+        container.scrollTop > LOAD_OLDER_THRESHOLD
+      ) {
+        return;
+      }
+
+      loadingOlderRef.current = true;
+      anchorRef.current = { first: messages[0], height: container.scrollHeight };
+      try {
+        await onLoadOlder();
+      } finally {
+        loadingOlderRef.current = false;
+        // 加载失败或会话已切换时不会插入消息, 下一帧清除
+        requestAnimationFrame(() => {
+          anchorRef.current = null;
+        });
+      }
+    },
+    [messages, hasOlder, onLoadOlder]
+  );
+
   if (messages.length === 0 && !isLoading) {
     return (
       <div className="flex-1 flex items-center justify-center text-gray-500 dark:text-gray-400">
@@ -31,7 +78,11 @@ export function MessageList({ messages, isLoading }: MessageListProps) {
   }
 
   return (
-    <div className="flex-1 overflow-y-auto scrollbar-thin">
+    <div
+      ref={containerRef}
+      onScroll={handleScroll}
+      className="flex-1 overflow-y-auto scrollbar-thin"
+    >
       <div className="max-w-4xl mx-auto">
         {messages.map((message) => (
           <ChatMessage key={message.id} message={message} />
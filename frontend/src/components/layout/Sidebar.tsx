@@ -125,8 +125,18 @@ export function Sidebar({
                     <p className="text-sm font-medium text-gray-900 dark:text-gray-100 truncate">
                       {conversation.title}
                     </p>
+                    {conversation.last_message_preview && (
+                      <p className="text-xs text-gray-600 dark:text-gray-300 mt-1 truncate">
+                        {conversation.last_message_preview}
+                      </p>
+                    )}
                     <p className="text-xs text-gray-500 dark:text-gray-400 mt-1">
-                      {formatDate(conversation.updated_at || conversation.created_at)}
+                      {formatDate(
+                        conversation.last_message_at ||
+                          conversation.updated_at ||
+                          conversation.created_at
+                      )}
+                      {conversation.message_count > 0 && ` · ${conversation.message_count} 条消息`}
                     </p>
                   </div>
                 </div>
@@ -6,11 +6,14 @@ import { useChatStore } from '@/store/chatStore';
 import { useSettingsStore } from '@/store/settingsStore';
 import {
   sendMessageStream,
+  subscribeGeneration,
   stopGeneration as stopGenerationApi,
+  StreamHttpError,
   Message,
 } from '@/services/chat';
 import {
   getConversations,
+  getConversation,
   getConversationMessages,
   createConversation,
   updateConversation as updateConversationApi,
@@ -22,19 +25,24 @@ export function useChat() {
   const {
     currentConversation,
     messages,
+    olderCursor,
     conversations,
     isLoading,
     isGenerating,
+    queuePosition,
     setCurrentConversation,
     setMessages,
     addMessage,
+    prependMessages,
     updateLastMessage,
+    setOlderCursor,
     setConversations,
     addConversation,
     updateConversation: updateConversationInStore,
     removeConversation,
     setLoading,
     setGenerating,
+    setQueuePosition,
     clearCurrentConversation,
   } = useChatStore();
 
@@ -53,31 +61,98 @@ export function useChat() {
     }
   }, [setLoading, setConversations]);
 
+  // 跟随其他标签页或设备上进行中的生成
+  const followGeneration = useCallback(
+    async (conversationId: number) => {
+      let attached = false;
+      try {
+        let fullContent = '';
+        for await (const event of subscribeGeneration(conversationId)) {
+          // 切换到其他会话后停止跟随
+          if (useChatStore.getState().currentConversation?.id !== conversationId) break;
+
+          if (event.type === 'init') {
+            attached = true;
+            setGenerating(true);
+            addMessage({
+              role: 'assistant',
+              content: '',
+              created_at: new Date().toISOString(),
+            } as Message);
+          } else if (event.type === 'queued') {
+            setQueuePosition(event.position ?? 0);
+          } else if (event.type === 'snapshot') {
+            fullContent = event.content ?? '';
+            updateLastMessage(fullContent);
+          } else if (event.type === 'chunk') {
+            setQueuePosition(0);
+            if (event.content) {
+              fullContent += event.content;
+              updateLastMessage(fullContent);
+            }
+          } else if (event.type === 'done' || event.type === 'error') {
+            break;
+          }
+        }
+      } catch (error) {
+        // 没有进行中的生成
+        if (!(error instanceof StreamHttpError && error.status === 404)) {
+          console.error('订阅生成失败:', handleApiError(error));
+        }
+      } finally {
+        if (attached) {
+          setGenerating(false);
+          setQueuePosition(0);
+        }
+      }
+    },
+    [addMessage, updateLastMessage, setGenerating, setQueuePosition]
+  );
+
   // 加载会话消息
   const loadConversationMessages = useCallback(
     async (conversationId: number) => {
       try {
         setLoading(true);
-        const [conversation, messages] = await Promise.all([
-          getConversations().then((res) =>
-            res.conversations.find((c) => c.id === conversationId)
-          ),
+        const [conversation, page] = await Promise.all([
+          getConversation(conversationId),
           getConversationMessages(conversationId),
         ]);
 
-        if (conversation) {
-          setCurrentConversation(conversation);
+        setCurrentConversation(conversation);
+        setMessages(page.messages);
+        setOlderCursor(page.prevCursor);
+
+        // 会话正在其他地方生成时接上输出
+        if (!useChatStore.getState().isGenerating) {
+          void followGeneration(conversationId);
         }
-        setMessages(messages);
       } catch (error) {
         console.error('加载会话消息失败:', handleApiError(error));
       } finally {
         setLoading(false);
       }
     },
-    [setLoading, setCurrentConversation, setMessages]
+    [setLoading, setCurrentConversation, setMessages, setOlderCursor, followGeneration]
   );
 
+  // 加载更早的消息(消息列表滚动到顶部时调用)
+  const loadOlderMessages = useCallback(async () => {
+    const { currentConversation: conversation, olderCursor: cursor } =
+      useChatStore.getState();
+    if (!conversation || !cursor) return;
+
+    try {
+      const page = await getConversationMessages(conversation.id, undefined, cursor);
+      // 加载期间切换了会话时丢弃结果
+      if (useChatStore.getState().currentConversation?.id !== conversation.id) return;
+      prependMessages(page.messages);
+      setOlderCursor(page.prevCursor);
+    } catch (error) {
+      console.error('加载更早消息失败:', handleApiError(error));
+    }
+  }, [prependMessages, setOlderCursor]);
+
   // 发送消息
   const sendMessage = useCallback(
     async (content: string) => {
@@ -121,8 +196,16 @@ export function useChat() {
               // 新会话,重新加载会话列表
               await loadConversations();
             }
+          } else if (event.type === 'queued') {
+            // 排队中
+            setQueuePosition(event.position ?? 0);
+          } else if (event.type === 'snapshot') {
+            // 重连时缺失的部分已移出服务端缓冲区, 以快照替换
+            fullContent = event.content ?? '';
+            updateLastMessage(fullContent);
           } else if (event.type === 'chunk') {
             // 流式内容
+            setQueuePosition(0);
             if (event.content) {
               fullContent += event.content;
               updateLastMessage(fullContent);
@@ -144,12 +227,14 @@ export function useChat() {
         throw error;
       } finally {
         setGenerating(false);
+        setQueuePosition(0);
       }
     },
     [
       currentConversation,
       selectedModel,
       setGenerating,
+      setQueuePosition,
       addMessage,
       updateLastMessage,
       loadConversations,
@@ -167,12 +252,13 @@ export function useChat() {
       addConversation(conversation);
       setCurrentConversation(conversation);
       setMessages([]);
+      setOlderCursor(null);
       return conversation;
     } catch (error) {
       console.error('创建会话失败:', handleApiError(error));
       throw error;
     }
-  }, [selectedModel, addConversation, setCurrentConversation, setMessages]);
+  }, [selectedModel, addConversation, setCurrentConversation, setMessages, setOlderCursor]);
 
   // 更新会话
   const updateConversation = useCallback(
@@ -211,21 +297,24 @@ export function useChat() {
   // 停止生成
   const stopGeneration = useCallback(async () => {
     try {
-      await stopGenerationApi();
+      await stopGenerationApi(currentConversation?.id);
       setGenerating(false);
     } catch (error) {
       console.error('停止生成失败:', handleApiError(error));
     }
-  }, [setGenerating]);
+  }, [currentConversation, setGenerating]);
 
   return {
     currentConversation,
     messages,
+    hasOlderMessages: olderCursor !== null,
     conversations,
     isLoading,
     isGenerating,
+    queuePosition,
     loadConversations,
     loadConversationMessages,
+    loadOlderMessages,
     sendMessage,
     createNewConversation,
     updateConversation,
@@ -19,8 +19,11 @@ export function Chat() {
     conversations,
     isLoading,
     isGenerating,
+    queuePosition,
     loadConversations,
     loadConversationMessages,
+    loadOlderMessages,
+    hasOlderMessages,
     sendMessage,
     createNewConversation,
     updateConversation,
@@ -81,12 +84,18 @@ export function Chat() {
 
         {/* 主内容区 */}
         <div className="flex-1 flex flex-col">
-          <MessageList messages={messages} isLoading={isLoading} />
+          <MessageList
+            messages={messages}
+            isLoading={isLoading}
+            hasOlder={hasOlderMessages}
+            onLoadOlder={loadOlderMessages}
+          />
           <ChatInput
             onSend={handleSendMessage}
             onStop={stopGeneration}
             disabled={isLoading}
             isGenerating={isGenerating}
+            queuePosition={queuePosition}
           />
         </div>
       </div>
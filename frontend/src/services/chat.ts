@@ -17,20 +17,34 @@ export interface ChatRequest {
   message: string;
   model?: string;
   stream?: boolean;
+  use_cache?: boolean;
+}
+
+export interface ContextWindowInfo {
+  budget_tokens: number;
+  used_tokens: number;
+  included_messages: number;
+  truncated: boolean;
+  elided: boolean;
+  oldest_message_id: number | null;
 }
 
 export interface ChatResponse {
   conversation_id: number;
   message: Message;
   assistant_message: Message;
+  context?: ContextWindowInfo;
 }
 
 export interface StreamEvent {
-  type: 'init' | 'chunk' | 'done' | 'error';
+  type: 'init' | 'queued' | 'snapshot' | 'chunk' | 'done' | 'error';
   conversation_id?: number;
   message?: Message;
   assistant_message?: Message;
+  context?: ContextWindowInfo;
   content?: string;
+  position?: number;
+  stopped?: boolean;
   error?: string;
 }
 
@@ -45,62 +59,130 @@ export async function sendMessage(data: ChatRequest): Promise<ChatResponse> {
   return response.data;
 }
 
+/** 流式请求断线后的最大重连次数 */
+const STREAM_MAX_RETRIES = 3;
+
 /**
- * 发送消息(流式)
+ * 流式请求的HTTP错误
  */
-export async function* sendMessageStream(
-  data: ChatRequest
+export class StreamHttpError extends Error {
+  constructor(public status: number) {
+    super(`HTTP error! status: ${status}`);
+  }
+}
+
+/**
+ * 读取SSE事件流
+ * 连接中断时带Last-Event-ID重连, 服务端回放缺失的事件后接上实时输出
+ */
+async function* readEventStream(
+  path: string,
+  init: RequestInit
 ): AsyncGenerator<StreamEvent, void, unknown> {
-  const response = await fetch(`${api.defaults.baseURL}/chat/stream`, {
-    method: 'POST',
-    headers: {
+  let lastEventId: string | null = null;
+  let retries = 0;
+
+  while (true) {
+    const headers: Record<string, string> = {
       'Content-Type': 'application/json',
       Authorization: `Bearer ${localStorage.getItem('access_token')}`,
-    },
-    body: JSON.stringify({
-      ...data,
-      stream: true,
-    }),
-  });
+    };
+    if (lastEventId) {
+      headers['Last-Event-ID'] = lastEventId;
+    }
 
-  if (!response.ok) {
-    throw new Error(`HTTP error! status: ${response.status}`);
-  }
+    let finished = false;
+    try {
+      const response = await fetch(`${api.defaults.baseURL}${path}`, {
+        ...init,
+        headers,
+      });
 
-  const reader = response.body?.getReader();
-  const decoder = new TextDecoder();
+      if (!response.ok) {
+        // 4xx(如生成已过期)重连无意义
+        finished = true;
+        throw new StreamHttpError(response.status);
+      }
 
-  if (!reader) {
-    throw new Error('无法读取响应流');
-  }
+      const reader = response.body?.getReader();
+      const decoder = new TextDecoder();
+
+      if (!reader) {
+        finished = true;
+        throw new Error('无法读取响应流');
+      }
 
-  try {
-    while (true) {
-      const { done, value } = await reader.read();
-      if (done) break;
-
-      const chunk = decoder.decode(value);
-      const lines = chunk.split('\n');
-
-      for (const line of lines) {
-        if (line.startsWith('data: ')) {
-          try {
-            const data = JSON.parse(line.slice(6));
-            yield data as StreamEvent;
-          } catch (e) {
-            console.error('解析SSE数据失败:', e);
+      let buffer = '';
+      try {
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+
+          buffer += decoder.decode(value, { stream: true });
+          const lines = buffer.split('\n');
+          buffer = lines.pop() ?? '';
+
+          for (const line of lines) {
+            if (line.startsWith('id: ')) {
+              lastEventId = line.slice(4);
+            } else if (line.startsWith('data: ')) {
+              try {
+                const event = JSON.parse(line.slice(6)) as StreamEvent;
+                if (event.type === 'done' || event.type === 'error') {
+                  finished = true;
+                }
+                retries = 0;
+                yield event;
+              } catch (e) {
+                console.error('解析SSE数据失败:', e);
+              }
+            }
           }
         }
+      } finally {
+        reader.releaseLock();
+      }
+
+      if (finished) return;
+      throw new Error('连接中断');
+    } catch (error) {
+      if (finished || !lastEventId || retries >= STREAM_MAX_RETRIES) {
+        throw error;
       }
+      retries += 1;
+      await new Promise((resolve) => setTimeout(resolve, 500 * retries));
     }
-  } finally {
-    reader.releaseLock();
   }
 }
 
+/**
+ * 发送消息(流式)
+ */
+export function sendMessageStream(
+  data: ChatRequest
+): AsyncGenerator<StreamEvent, void, unknown> {
+  return readEventStream('/chat/stream', {
+    method: 'POST',
+    body: JSON.stringify({
+      ...data,
+      stream: true,
+    }),
+  });
+}
+
+/**
+ * 订阅会话中进行中的生成(在其他标签页或设备上发起的)
+ * 没有进行中的生成时抛出status为404的StreamHttpError
+ */
+export function subscribeGeneration(
+  conversationId: number
+): AsyncGenerator<StreamEvent, void, unknown> {
+  return readEventStream(`/chat/subscribe/${conversationId}`, { method: 'GET' });
+}
+
 /**
  * 停止生成
  */
-export async function stopGeneration(): Promise<void> {
-  await api.post('/chat/stop');
+export async function stopGeneration(conversationId?: number): Promise<void> {
+  await api.post('/chat/stop', { conversation_id: conversationId ?? null });
 }
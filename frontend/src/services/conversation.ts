@@ -11,11 +11,22 @@ export interface Conversation {
   model: string;
   created_at: string;
   updated_at?: string;
+  message_count: number;
+  total_tokens: number;
+  last_message_at?: string | null;
+  last_message_preview?: string | null;
 }
 
 export interface ConversationListResponse {
   total: number;
   conversations: Conversation[];
+  next_cursor?: string | null;
+}
+
+export interface MessagePage {
+  messages: Message[];
+  // 更早一页的游标, 为空表示已到第一条消息
+  prevCursor: string | null;
 }
 
 export interface ConversationCreateRequest {
@@ -30,13 +41,15 @@ export interface ConversationUpdateRequest {
 
 /**
  * 获取会话列表
+ * 传入上一页返回的next_cursor获取下一页
  */
 export async function getConversations(
   skip: number = 0,
-  limit: number = 20
+  limit: number = 20,
+  cursor?: string | null
 ): Promise<ConversationListResponse> {
   const response = await api.get<ConversationListResponse>('/conversations', {
-    params: { skip, limit },
+    params: cursor ? { cursor, limit } : { skip, limit },
   });
   return response.data;
 }
@@ -79,10 +92,20 @@ export async function deleteConversation(id: number): Promise<void> {
 
 /**
  * 获取会话消息
+ * 默认返回最新的一页, 传入before游标获取更早的消息
  */
-export async function getConversationMessages(id: number): Promise<Message[]> {
-  const response = await api.get<Message[]>(`/conversations/${id}/messages`);
-  return response.data;
+export async function getConversationMessages(
+  id: number,
+  limit: number = 100,
+  before?: string | null
+): Promise<MessagePage> {
+  const response = await api.get<Message[]>(`/conversations/${id}/messages`, {
+    params: before ? { limit, before } : { limit },
+  });
+  return {
+    messages: response.data,
+    prevCursor: response.headers['x-prev-cursor'] ?? null,
+  };
 }
 
 /**
@@ -91,9 +114,40 @@ export async function getConversationMessages(id: number): Promise<Message[]> {
 export async function searchConversations(
   query: string,
   skip: number = 0,
-  limit: number = 20
+  limit: number = 20,
+  cursor?: string | null
 ): Promise<ConversationListResponse> {
   const response = await api.get<ConversationListResponse>('/conversations/search/', {
+    params: cursor ? { q: query, cursor, limit } : { q: query, skip, limit },
+  });
+  return response.data;
+}
+
+export interface MessageSearchHit {
+  message_id: number;
+  conversation_id: number;
+  conversation_title: string;
+  role: string;
+  // 已转义的HTML, 命中部分用<mark>包裹
+  snippet: string;
+  rank: number;
+  created_at: string;
+}
+
+export interface MessageSearchResponse {
+  total: number;
+  hits: MessageSearchHit[];
+}
+
+/**
+ * 在所有会话中检索消息内容(按相关度排序)
+ */
+export async function searchMessages(
+  query: string,
+  skip: number = 0,
+  limit: number = 20
+): Promise<MessageSearchResponse> {
+  const response = await api.get<MessageSearchResponse>('/conversations/search/messages', {
     params: { q: query, skip, limit },
   });
   return response.data;
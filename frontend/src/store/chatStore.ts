@@ -14,8 +14,13 @@ interface ChatState {
   messages: Message[];
   setMessages: (messages: Message[]) => void;
   addMessage: (message: Message) => void;
+  prependMessages: (messages: Message[]) => void;
   updateLastMessage: (content: string) => void;
 
+  // 更早消息的分页游标(null表示已全部加载)
+  olderCursor: string | null;
+  setOlderCursor: (cursor: string | null) => void;
+
   // 会话列表
   conversations: Conversation[];
   setConversations: (conversations: Conversation[]) => void;
@@ -31,6 +36,10 @@ interface ChatState {
   isGenerating: boolean;
   setGenerating: (generating: boolean) => void;
 
+  // 排队位置(0表示未在排队)
+  queuePosition: number;
+  setQueuePosition: (position: number) => void;
+
   // 清空当前会话
   clearCurrentConversation: () => void;
 }
@@ -48,6 +57,10 @@ export const useChatStore = create<ChatState>((set) => ({
     set((state) => ({
       messages: [...state.messages, message],
     })),
+  prependMessages: (messages) =>
+    set((state) => ({
+      messages: [...messages, ...state.messages],
+    })),
   updateLastMessage: (content) =>
     set((state) => {
       const messages = [...state.messages];
@@ -58,6 +71,10 @@ export const useChatStore = create<ChatState>((set) => ({
       return { messages };
     }),
 
+  // 更早消息的分页游标
+  olderCursor: null,
+  setOlderCursor: (cursor) => set({ olderCursor: cursor }),
+
   // 会话列表
   conversations: [],
   setConversations: (conversations) => set({ conversations }),
@@ -84,10 +101,15 @@ export const useChatStore = create<ChatState>((set) => ({
   isGenerating: false,
   setGenerating: (generating) => set({ isGenerating: generating }),
 
+  // 排队位置
+  queuePosition: 0,
+  setQueuePosition: (position) => set({ queuePosition: position }),
+
   // 清空当前会话
   clearCurrentConversation: () =>
     set({
       currentConversation: null,
       messages: [],
+      olderCursor: null,
     }),
 }));